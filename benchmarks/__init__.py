@@ -0,0 +1,2 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks (not run by pytest)."""
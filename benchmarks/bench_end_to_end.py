@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""End-to-end benchmarks against the local broker stand-in (tests/mqttbroker.py).
+
+- MyMqtt publish throughput (windows/s) for QoS 0 and QoS 1
+- MyMqtt publish latency (QoS 1, until PUBACK), with and without a broker drop
+- generate_d0_d1 latency: smartmeter total published --> d0 received by the broker
+
+Run it with:
+`python -m benchmarks.bench_end_to_end`
+"""
+import sys
+import time
+from configparser import ConfigParser
+
+import paho.mqtt.client as mqtt_client
+
+import generate_d0_d1
+from benchmarks.bench_payload import load_mqttdata
+from smlmqttprocessor.mqtt import MyMqtt
+from tests.helpers import connected_mymqtt
+from tests.mqttbroker import MqttBrokerStandIn, wait_for
+
+N_WINDOWS = 200
+N_VALUES = 200
+
+
+def run_throughput(qos, field2values, n_windows=N_WINDOWS, drop_at=None):
+    """Publish n_windows windows, return (windows per second, number of lost messages, MyMqtt instance).
+
+    The throughput is None if not all messages were delivered.
+
+    :param drop_at: window number at which the broker drops all connections
+    """
+    n_topics = sum(len(value) for value in MyMqtt.construct_mqttdata(field2values).values())
+    n_messages = n_windows * n_topics
+    with MqttBrokerStandIn() as broker:
+        mymqtt = connected_mymqtt(broker.port, qos=str(qos))
+        start = time.perf_counter()
+        for i in range(n_windows):
+            if i == drop_at:
+                broker.disconnect_clients()
+                assert wait_for(lambda: not mymqtt.connected)
+                # publishing while reconnecting only queues (max_queued), the outage is part of the duration
+                assert wait_for(lambda: mymqtt.connected, timeout=30)
+            mymqtt.send(field2values)
+        delivered = wait_for(lambda: len(broker.received) >= n_messages and not mymqtt.inflight,
+                             timeout=30, interval=0.0001)
+        duration = time.perf_counter() - start
+        # (re-sent messages may be received twice)
+        n_lost = max(0, n_messages - len(broker.received))
+        mymqtt.disconnect()
+        mymqtt.client.loop_stop()
+    return (n_windows / duration if delivered else None), n_lost, mymqtt
+
+
+def run_d0_d1_latency(n_values=N_VALUES):
+    """Publish smartmeter totals, return list of latencies (seconds) until d0 arrived."""
+    latencies = []
+    with MqttBrokerStandIn() as broker:
+        config = ConfigParser()
+        config.read_dict({'Mqtt': {'port': str(broker.port)}})
+        client = generate_d0_d1.create_client(config)
+        client.loop_start()
+        publisher = mqtt_client.Client()
+        publisher.connect('127.0.0.1', broker.port)
+        publisher.loop_start()
+        wait_for(lambda: broker.n_connections == 2)
+        for i in range(n_values):
+            n_received = len(broker.received)
+            start = time.monotonic()
+            publisher.publish(generate_d0_d1.MQTT_TOPIC_SMARTMETER_TOTAL, str(1000.0 + i))
+            if i == 0:
+                # d0 needs at least two values
+                wait_for(lambda n=n_received: len(broker.received) > n, interval=0.0001)
+                continue
+            wait_for(lambda n=n_received: any(p.topic == generate_d0_d1.MQTT_TOPIC_D0
+                                              for p in broker.received[n:]), interval=0.0001)
+            d0 = [p for p in broker.received[n_received:] if p.topic == generate_d0_d1.MQTT_TOPIC_D0]
+            latencies.append(d0[0].timestamp - start)
+        for mqtt in (publisher, client):
+            mqtt.disconnect()
+            mqtt.loop_stop()
+    return latencies
+
+
+def main():
+    """Run the benchmarks and print tables."""
+    mqttdata = load_mqttdata()
+    field2values = {name: [values['first'], values['value']] for name, values in mqttdata.items()}
+
+    print("%-16s %12s %10s %10s %10s" % ("MyMqtt", "windows/s", "p50 ms", "p99 ms", "retried"))
+    for label, qos, drop_at in (("qos0", 0, None), ("qos1", 1, None),
+                                ("qos1 + drop", 1, N_WINDOWS // 2)):
+        rate, n_lost, mymqtt = run_throughput(qos, field2values, drop_at=drop_at)
+        if qos:
+            p50 = "%.1f" % (mymqtt.publish_latency.quantile(0.5) * 1000)
+            p99 = "%.1f" % (mymqtt.publish_latency.quantile(0.99) * 1000)
+        else:
+            p50 = p99 = "-"
+        # incomplete delivery: no meaningful throughput
+        rate = "%.1f" % rate if rate is not None else "lost %d" % n_lost
+        print("%-16s %12s %10s %10s %10d" % (label, rate, p50, p99, mymqtt.n_retried))
+        if mymqtt.n_queue_dropped:
+            print("%-16s %d messages dropped, queue full while reconnecting" % ("", mymqtt.n_queue_dropped))
+
+    latencies = sorted(run_d0_d1_latency())
+    print()
+    print("%-16s %12s %10s %10s" % ("generate_d0_d1", "values", "p50 ms", "p99 ms"))
+    print("%-16s %12d %10.2f %10.2f" % ("total --> d0", len(latencies),
+                                        latencies[len(latencies) // 2] * 1000,
+                                        latencies[int(len(latencies) * 0.99)] * 1000))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Benchmark single-topic payload codecs: size and encode/decode time vs. JSON.
+
+Also the consumer side of generate_d0_d1: extracting total.value only
+(extract_fields) vs. decoding the whole payload.
+
+Run it with:
+`python -m benchmarks.bench_payload`
+"""
+import json
+import sys
+import timeit
+from pathlib import Path
+
+from smlmqttprocessor.mqtt import MyMqtt
+from smlmqttprocessor.payload import PayloadEncoder, decode_payload, extract_fields
+from smlmqttprocessor.smltextmqttprocessor import SML_FIELDS, check_stream_packet_begin, parse_line
+from smlmqttprocessor.utils.message_utils import convert_messages2records
+
+TESTDATA = Path(__file__).parent.parent.joinpath("tests", "testdata", "EMH_eHZ-HW8E2AWL0EK2P.txt")
+NUMBER = 20000
+
+
+def load_mqttdata(filepath=TESTDATA, window_size=15):
+    """Parse a capture and aggregate its first window."""
+    messages = []
+    message = {}
+    with open(filepath, encoding="utf8") as fin:
+        for line in fin:
+            line = line.strip()
+            if check_stream_packet_begin(line):
+                if message:
+                    messages.append(message)
+                message = {}
+                continue
+            result = parse_line(line)
+            if result:
+                message[result[0]] = result[1]
+    return MyMqtt.construct_mqttdata(convert_messages2records(messages[:window_size]))
+
+
+def main():
+    """Run the benchmark and print a table."""
+    mqttdata = load_mqttdata()
+    field_names = list(SML_FIELDS)
+    json_size = len(json.dumps(mqttdata).encode())
+    print("%-8s %8s %8s %12s %12s" % ("codec", "bytes", "vs.json", "encode [us]", "decode [us]"))
+    for codec in ("json", "msgpack", "cbor", "struct"):
+        try:
+            encoder = PayloadEncoder(codec, field_names)
+        except RuntimeError as ex:
+            print("%-8s skipped: %s" % (codec, ex))
+            continue
+        payload = encoder.encode(mqttdata)
+        size = len(payload.encode() if isinstance(payload, str) else payload)
+        encode_time = timeit.timeit(lambda: encoder.encode(mqttdata), number=NUMBER) / NUMBER
+        decode_time = timeit.timeit(lambda: decode_payload(payload, field_names),
+                                    number=NUMBER) / NUMBER
+        print("%-8s %8d %7.0f%% %12.2f %12.2f" % (codec, size, 100.0 * size / json_size,
+                                                  encode_time * 1e6, decode_time * 1e6))
+    print()
+    bench_extract(mqttdata, field_names)
+    return 0
+
+
+def bench_extract(mqttdata, field_names):
+    """Extract total.value (and the tariff totals) vs. full decode, print a table."""
+    totals = tuple(name for name in field_names if name.startswith('total') and name in mqttdata) or ('total',)
+    print("%-8s %-28s %12s %12s %8s" % ("codec", "fields", "full [us]", "extract [us]", "speedup"))
+    for codec in ("json", "struct"):
+        payload = PayloadEncoder(codec, field_names).encode(mqttdata)
+        if isinstance(payload, str):
+            payload = payload.encode()  # as received via MQTT
+        for names in (('total',), totals):
+            full_time = timeit.timeit(lambda: decode_payload(payload, field_names)['total']['value'],
+                                      number=NUMBER) / NUMBER
+            extract_time = timeit.timeit(lambda: extract_fields(payload, names, field_names=field_names),
+                                         number=NUMBER) / NUMBER
+            print("%-8s %-28s %12.2f %12.2f %7.1fx" % (codec, ",".join(names)[:28], full_time * 1e6,
+                                                       extract_time * 1e6, full_time / extract_time))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
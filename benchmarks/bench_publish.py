@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Benchmark multi-topic publishing: socket writes (syscalls) and wall time per window.
+
+Publishes windows via MyMqtt to the local broker stand-in (tests/mqttbroker.py),
+once with and once without coalescing.
+
+Run it with:
+`python -m benchmarks.bench_publish`
+"""
+import sys
+import time
+from configparser import ConfigParser
+
+from benchmarks.bench_payload import load_mqttdata
+from smlmqttprocessor.mqtt import MyMqtt
+from tests.mqttbroker import MqttBrokerStandIn, wait_for
+
+N_WINDOWS = 200
+
+
+def run(coalesce, field2values, n_windows=N_WINDOWS):
+    """Publish n_windows windows, return (socket writes, seconds) per window."""
+    n_topics = sum(len(value) for value in MyMqtt.construct_mqttdata(field2values).values())
+    with MqttBrokerStandIn() as broker:
+        config = ConfigParser()
+        config.read_dict({'Mqtt': {'port': str(broker.port), 'coalesce': str(coalesce)}})
+        mymqtt = MyMqtt(config)
+        mymqtt.connect()
+        wait_for(lambda: mymqtt.connected)
+        n_writes = mymqtt.client.n_socket_writes
+        start = time.perf_counter()
+        for i in range(n_windows):
+            mymqtt.send(field2values)
+            # wait until the broker has received the complete window
+            wait_for(lambda i=i: len(broker.received) >= (i + 1) * n_topics, interval=0.0001)
+        duration = time.perf_counter() - start
+        n_writes = mymqtt.client.n_socket_writes - n_writes
+        mymqtt.disconnect()
+        mymqtt.client.loop_stop()
+    return n_writes / n_windows, duration / n_windows, n_topics
+
+
+def main():
+    """Run the benchmark and print a table."""
+    # re-create value lists (records) from an aggregated window
+    mqttdata = load_mqttdata()
+    field2values = {name: [values['first'], values['value']] for name, values in mqttdata.items()}
+    print("%-10s %8s %14s %14s" % ("coalesce", "topics", "writes/window", "ms/window"))
+    for coalesce in (False, True):
+        writes, seconds, n_topics = run(coalesce, field2values)
+        print("%-10s %8d %14.1f %14.3f" % (coalesce, n_topics, writes, seconds * 1000))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
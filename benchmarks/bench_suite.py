@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Benchmark suite with baselines: parser, processing loop, window aggregation, daily counters.
+
+The input are the frames (SML messages) of the bundled captures (tests/testdata)
+or synthetic frames, cycled up to the requested number of frames. For each
+benchmark the throughput (frames/s), the per-frame latency percentiles and
+the peak memory (tracemalloc, separate run with at most --memory-frames frames)
+are reported.
+
+With --save the results are stored as baseline, otherwise they are compared
+with the baseline (if it exists) and the exit code is 1 if a benchmark
+regressed by more than the threshold: throughput lower, p50 latency or peak
+memory higher than baseline * (1 +/- threshold). There is one baseline per
+input and window size. It is machine specific, i.e. create it on the machine
+running the comparison (e.g. the Raspberry Pi) before a change.
+
+Benchmarks:
+- parse_line: check_stream_packet_begin() and parse_line() of all lines of a frame
+- processing_loop: processing_loop() incl. reading
+- aggregation: convert_messages2records() and MyMqtt.construct_mqttdata() per window
+- daily: generate_d0_d1 DailyEnergyMonitor.add_value() per total value (1 value/s, i.e. day changes)
+
+Usage:
+  bench_suite.py [options] [<benchmark>...]
+  bench_suite.py -h | --help
+
+Options:
+  --frames=N          Number of frames per benchmark [default: 1000000]
+  --memory-frames=N   Max. number of frames of the memory run [default: 20000]
+  --window=N          Window size (frames) [default: 15]
+  --input=SOURCE      'captures' or 'synthetic' [default: captures]
+  --baseline=FILE     Baseline file [default: benchmarks/baseline.json]
+  --threshold=RATIO   Max. allowed regression [default: 0.2]
+  --save              Save the results as baseline (no comparison).
+  -h --help           Show this screen.
+
+Run it with:
+`python -m benchmarks.bench_suite --frames 100000`
+"""
+import gc
+import json
+import logging
+import random
+import sys
+import time
+import tracemalloc
+from array import array
+from pathlib import Path
+
+from docopt import docopt
+
+import generate_d0_d1
+import smlmqttprocessor.smltextmqttprocessor as stmp
+from smlmqttprocessor.loadgen import VirtualMeter
+from smlmqttprocessor.mqtt import MyMqtt
+from smlmqttprocessor.utils.message_utils import convert_messages2records
+
+TESTDATA = Path(__file__).parent.parent.joinpath("tests", "testdata")
+# percentiles of the per-frame latencies
+PERCENTILES = (50, 90, 99)
+# result keys checked for regressions: key --> True if higher is better
+CHECKED = {'frames_per_s': True, 'p50_us': False, 'peak_kib': False}
+
+
+def load_capture_frames(directory=TESTDATA):
+    """Return the frames of all bundled captures, each one a list of lines (header first)."""
+    frames = []
+    for filepath in sorted(directory.glob("*.txt")):
+        frame = None
+        with open(filepath, encoding="utf8") as fin:
+            for line in fin:
+                line = line.strip()
+                if stmp.check_stream_packet_begin(line):
+                    if frame:
+                        frames.append(frame)
+                    frame = [line]
+                elif frame is not None and line:
+                    frame.append(line)
+        if frame:
+            frames.append(frame)
+    return frames
+
+
+def synthetic_frames(n_frames=1000, seed=1, profile='iskra-l3'):
+    """Return frames of a virtual meter (smlmqttprocessor.loadgen), 1 frame/s."""
+    meter = VirtualMeter(profile, rng=random.Random(seed))
+    frames = []
+    for _ in range(n_frames):
+        meter.step()
+        frames.append(meter.text_frame())
+    return frames
+
+
+def _cycle(frames, n_frames):
+    """Yield n_frames frames, cycling through the given ones."""
+    for i in range(n_frames):
+        yield frames[i % len(frames)]
+
+
+def _parse_frame(frame):
+    message = {}
+    for line in frame[1:]:
+        result = stmp.parse_line(line)
+        if result:
+            message[result[0]] = result[1]
+    return message
+
+
+class FrameStream:
+    """Input stream (readline) of cycled frames, records the time at each frame start."""
+
+    def __init__(self, frames, n_frames):
+        """Input stream of n_frames cycled frames."""
+        self._lines = (line for frame in _cycle(frames, n_frames) for line in frame)
+        self.starts = array('d')
+
+    def readline(self):
+        """Return the next line, '' at the end."""
+        line = next(self._lines, '')
+        if line and stmp.check_stream_packet_begin(line):
+            self.starts.append(time.perf_counter())
+        return line
+
+
+def bench_parse_line(frames, n_frames, window_size):  # pylint: disable=unused-argument
+    """Parse frames line by line, return per-frame durations."""
+    durations = array('d')
+    clock = time.perf_counter
+    for frame in _cycle(frames, n_frames):
+        start = clock()
+        stmp.check_stream_packet_begin(frame[0])
+        for line in frame[1:]:
+            stmp.check_stream_packet_begin(line)
+            stmp.parse_line(line)
+        durations.append(clock() - start)
+    return durations
+
+
+def bench_processing_loop(frames, n_frames, window_size):
+    """Run processing_loop() on a stream of frames, return per-frame durations."""
+    stream = FrameStream(frames, n_frames)
+    stmp.processing_loop(stream, window_size, lambda messages: None, timeout=1)
+    end = time.perf_counter()
+    starts = stream.starts
+    durations = array('d', (following - start for start, following in zip(starts, starts[1:])))
+    durations.append(end - starts[-1])
+    return durations
+
+
+def _windows(frames, window_size):
+    """Return windows of parsed frames, each one of frames with the same fields (i.e. of one meter)."""
+    groups = {}
+    for frame in frames:
+        message = _parse_frame(frame)
+        groups.setdefault(frozenset(message), []).append(message)
+    windows = []
+    for messages in groups.values():
+        if len(messages) < 2:
+            continue  # too few frames of this meter
+        for offset in range(0, len(messages), window_size):
+            windows.append([messages[(offset + i) % len(messages)] for i in range(max(window_size, 2))])
+    return windows
+
+
+def bench_aggregation(frames, n_frames, window_size):
+    """Aggregate whole windows of parsed frames, return per-frame durations (window duration / size)."""
+    windows = _windows(frames, window_size)
+    durations = array('d')
+    clock = time.perf_counter
+    for i in range(max(1, n_frames // window_size)):
+        window = windows[i % len(windows)]
+        start = clock()
+        MyMqtt.construct_mqttdata(convert_messages2records(window))
+        duration = (clock() - start) / len(window)
+        durations.extend([duration] * len(window))
+    return durations
+
+
+def bench_daily(frames, n_frames, window_size):  # pylint: disable=unused-argument
+    """Add one total value per frame (1 frame/s) to a DailyEnergyMonitor, return per-frame durations."""
+    totals = [message['total'] for message in map(_parse_frame, frames) if 'total' in message]
+    now = [1700000000.0]
+    monitor = generate_d0_d1.DailyEnergyMonitor(history_days=7, periods=('week', 'month', 'year'),
+                                                clock=lambda: now[0])
+    offset = 0.0
+    durations = array('d')
+    clock = time.perf_counter
+    for i in range(n_frames):
+        value = totals[i % len(totals)]
+        if i % len(totals) == 0 and i:
+            # keep the readings increasing when cycling
+            offset = monitor.today.last - totals[0] + 0.1
+        start = clock()
+        monitor.add_value(value + offset)
+        durations.append(clock() - start)
+        now[0] += 1.0
+    return durations
+
+
+BENCHMARKS = {
+    'parse_line': bench_parse_line,
+    'processing_loop': bench_processing_loop,
+    'aggregation': bench_aggregation,
+    'daily': bench_daily,
+}
+
+
+def _percentile(sorted_values, percent):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * percent / 100))]
+
+
+def run_benchmark(name, frames, n_frames, window_size=15, memory_frames=20000):
+    """Run a benchmark, return its results (throughput, latency percentiles, peak memory)."""
+    function = BENCHMARKS[name]
+    gc.collect()
+    start = time.perf_counter()
+    durations = function(frames, n_frames, window_size)
+    elapsed = time.perf_counter() - start
+    # number of frames actually processed, e.g. whole windows only
+    n_done = len(durations)
+    durations = sorted(durations)
+    result = {'frames': n_done, 'frames_per_s': round(n_done / elapsed, 1)}
+    for percent in PERCENTILES:
+        result['p%d_us' % percent] = round(_percentile(durations, percent) * 1e6, 3)
+    del durations
+    # peak memory in a separate (smaller) run, tracemalloc slows everything down
+    gc.collect()
+    tracemalloc.start()
+    try:
+        function(frames, min(n_frames, memory_frames), window_size)
+        result['peak_kib'] = round(tracemalloc.get_traced_memory()[1] / 1024, 1)
+    finally:
+        tracemalloc.stop()
+    return result
+
+
+def compare(results, baseline, threshold=0.2):
+    """Compare results with a baseline.
+
+    :param results: benchmark name --> results
+    :param baseline: benchmark name --> results (of an earlier run)
+    :param threshold: max. allowed regression ratio, e.g. 0.2 for 20%
+    :return: list of regression descriptions, empty if none
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        for key, higher_is_better in CHECKED.items():
+            if not base.get(key) or key not in result:
+                continue
+            ratio = result[key] / base[key]
+            if (higher_is_better and ratio < 1 - threshold) or (not higher_is_better and ratio > 1 + threshold):
+                regressions.append("%s %s: %s (baseline %s, %+.0f%%)"
+                                   % (name, key, result[key], base[key], (ratio - 1) * 100))
+    return regressions
+
+
+def main(argv=None):
+    """Run the benchmarks, print a table, save or compare the baseline.
+
+    :return: exit code, 1 on a regression
+    """
+    arguments = docopt(__doc__, argv=argv)
+    names = arguments['<benchmark>'] or list(BENCHMARKS)
+    unknown = set(names) - set(BENCHMARKS)
+    if unknown:
+        print("Unknown benchmark(s): %s (valid: %s)" % (", ".join(sorted(unknown)), ", ".join(BENCHMARKS)))
+        return 2
+    n_frames = int(arguments['--frames'])
+    if arguments['--input'] == 'synthetic':
+        frames = synthetic_frames()
+    else:
+        frames = load_capture_frames()
+    baseline_file = Path(arguments['--baseline'])
+
+    results = {}
+    # e.g. the warning of processing_loop at the end of the input
+    logging.disable(logging.WARNING)
+    print("%-16s %10s %12s %10s %10s %10s %10s" % ("benchmark", "frames", "frames/s", "p50 us", "p90 us",
+                                                   "p99 us", "peak KiB"))
+    for name in names:
+        result = results[name] = run_benchmark(name, frames, n_frames, int(arguments['--window']),
+                                               int(arguments['--memory-frames']))
+        print("%-16s %10d %12.0f %10.2f %10.2f %10.2f %10.1f" % (
+            name, result['frames'], result['frames_per_s'], result['p50_us'], result['p90_us'], result['p99_us'],
+            result['peak_kib']))
+    logging.disable(logging.NOTSET)
+
+    # one baseline per input and window size
+    key = "%s/window=%s" % (arguments['--input'], arguments['--window'])
+    baselines = json.loads(baseline_file.read_text()) if baseline_file.exists() else {}
+    if arguments['--save']:
+        baselines.setdefault(key, {}).update(results)
+        baseline_file.write_text(json.dumps(baselines, indent=2, sort_keys=True) + "\n")
+        print("Baseline saved to %s (%s)" % (baseline_file, key))
+        return 0
+    if key not in baselines:
+        print("No baseline for %s in %s, create one with --save" % (key, baseline_file))
+        return 0
+    regressions = compare(results, baselines[key], float(arguments['--threshold']))
+    for regression in regressions:
+        print("REGRESSION %s" % regression)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
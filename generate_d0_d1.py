@@ -10,9 +10,20 @@ metrics are then published back to a designated MQTT topic,
 allowing for continuous updates on today's and yesterday's
 power usage.
 
+The backfill command replays timestamped total values from archived
+captures (jsonl sink) or MQTT dumps (mosquitto_sub -v -F '%U %t %p')
+and computes the consumption of each day in the whole range.
+
 Usage:
   generate_d0_d1.py
-
+  generate_d0_d1.py backfill [--csv=FILE] [--publish] [--timezone=TZ] <file>...
+  generate_d0_d1.py -h | --help
+
+Options:
+  --csv=FILE        Write the per-day consumption as CSV, '-' for STDOUT (default without --publish).
+  --publish         Publish the per-day consumption as retained MQTT messages <prefix>/day/<YYYY-MM-DD>.
+  --timezone=TZ     Time zone of the day boundaries, default: [Daily] timezone of config.ini.
+  <file>            Capture file or MQTT dump, '-' for STDIN, *.gz is decompressed.
 """
 #
 # LICENSE:
@@ -33,48 +44,200 @@ Usage:
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 import configparser
+import csv
+import functools
+import gzip
+import json
 import logging
 import os
+import struct
+import sys
+import time
+from abc import ABC, abstractmethod
 from pathlib import Path
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 
 import paho.mqtt.client as mqtt
+from docopt import docopt
 
+from smlmqttprocessor.payload import PAYLOAD_MAGIC, extract_fields
+from smlmqttprocessor.smltextmqttprocessor import SML_FIELDS
 from smlmqttprocessor.utils.mylogging import setup_logging
+from smlmqttprocessor.utils.profiling import install_profiling
+from smlmqttprocessor.utils.rollup import CalendarClock, DayCounter, get_timezone
 
 MQTT_TOPIC_SMARTMETER_TOTAL = "tele/smartmeter/total/value"
 MQTT_TOPIC_D0 = "tele/smartmeter/total/d0"
 MQTT_TOPIC_D1 = "tele/smartmeter/total/d1"
+# further values (d2..dN, wtd, mtd, ytd) are published as <prefix>/<name>
+MQTT_TOPIC_TOTAL_PREFIX = "tele/smartmeter/total"
+
+# single-topic payloads (JSON or binary, cf. Mqtt payload_codec) instead of a plain total value
+SINGLE_TOPIC_PAYLOAD_STARTS = (b'{', PAYLOAD_MAGIC)
+# ordered field names of 'struct' single-topic payloads, as sent by smltextmqttprocessor
+SML_FIELD_NAMES = tuple(SML_FIELDS)
+
+# period --> name of its to-date value
+PERIODS = {'week': 'wtd', 'month': 'mtd', 'year': 'ytd'}
 
 CONFIG_FILENAME = "config.ini"
+# format version of the checkpoint file
+CHECKPOINT_VERSION = 1
 
 
 DEBUG = bool(os.getenv("DEBUG", "").lower() in ("1", "true", "yes"))
 __script_dir = Path(__file__).parent
 
 
-class DailyEnergyMonitor:
-    """Calculate daily energy consumption for today & yesterday."""
-
-    d0_retained = None
-    d1_retained = None
-
-    def __init__(self, retain: bool = True):
-        """Calculate daily energy consumption for today & yesterday."""
+def _period_key(day: date, period: str):
+    """Return the key of the (ISO) week, month or year the day belongs to."""
+    if period == 'week':
+        return tuple(day.isocalendar())[:2]
+    if period == 'month':
+        return day.year, day.month
+    return day.year
+
+
+def _write_json_atomic(path: Path, data):
+    """Write data as JSON file, atomically (write temp file, then rename)."""
+    tmp_file = path.with_name(path.name + ".tmp")
+    with open(tmp_file, "w", encoding="utf8") as fout:
+        json.dump(data, fout)
+        fout.flush()
+        os.fsync(fout.fileno())
+    os.replace(tmp_file, path)
+
+
+class _Checkpointing(ABC):
+    """Periodic checkpoints of get_state() to checkpoint_file, restored with set_state()."""
+
+    __slots__ = ()
+    checkpoint_file = None
+    checkpoint_interval = 60
+    _last_checkpoint = 0
+
+    @abstractmethod
+    def get_state(self):
+        """Return the state as JSON-serializable dictionary."""
+
+    @abstractmethod
+    def set_state(self, state: dict):
+        """Restore the state from get_state()."""
+
+    @abstractmethod
+    def _has_state(self):
+        """Return True if there is anything worth saving."""
+
+    def save_checkpoint(self):
+        """Write the state to the checkpoint file, atomically."""
+        _write_json_atomic(self.checkpoint_file, self.get_state())
+        self._last_checkpoint = time.monotonic()
+
+    def checkpoint(self, force: bool = False):
+        """Save a checkpoint, at most every checkpoint_interval seconds (unless forced)."""
+        if not self.checkpoint_file or not self._has_state():
+            return
+        if not force and time.monotonic() - self._last_checkpoint < self.checkpoint_interval:
+            return
+        try:
+            self.save_checkpoint()
+        except OSError as ex:
+            logging.error("Checkpoint failed! %s", ex)
+
+    def load_checkpoint(self):
+        """Restore the state from the checkpoint file, return True if successful."""
+        if not self.checkpoint_file or not self.checkpoint_file.is_file():
+            return False
+        try:
+            with open(self.checkpoint_file, encoding="utf8") as fin:
+                self.set_state(json.load(fin))
+        except (OSError, ValueError, KeyError, TypeError) as ex:
+            logging.error("Invalid checkpoint %s! %s", self.checkpoint_file, ex)
+            return False
+        logging.info("Restored checkpoint %s", self.checkpoint_file)
+        return True
+
+
+class DailyEnergyMonitor(_Checkpointing):
+    """Calculate daily energy consumption for today & yesterday.
+
+    Optionally also for the days before (d2..dN) and week-, month- and
+    year-to-date. Only a ring of per-day counters (history_days + 1) and the
+    first reading of each period are kept.
+    """
+
+    # small memory footprint, many meters can be monitored in one process
+    __slots__ = ('retain', 'periods', 'history_days', 'current_date', 'days', 'period_start',
+                 'topics', 'd0', 'd1', 'd0_retained', 'd1_retained', 'checkpoint_file',
+                 'checkpoint_interval', '_last_checkpoint', 'publisher', 'calendar', 'clock')
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, retain: bool = True, history_days: int = 1, periods=(),
+                 checkpoint_file: Path = None, checkpoint_interval: float = 60,
+                 topics: dict = None, publisher=None, calendar: CalendarClock = None, clock=None):
+        """Calculate daily energy consumption for today & yesterday.
+
+        :param retain: MQTT retain flag for publishing
+        :param history_days: number of past days to keep, i.e. up to d<history_days>
+        :param periods: any of 'week', 'month', 'year' for the to-date values
+        :param checkpoint_file: file to save the state to (and restore it from), None to disable
+        :param checkpoint_interval: min. number of seconds between two checkpoints
+        :param topics: value name (e.g. d2, ytd) --> MQTT topic, default <prefix>/<name>
+        :param publisher: ChangePublisher, a default one if None
+        :param calendar: CalendarClock of the day boundaries (may be shared), local days if None
+        :param clock: callable returning the current POSIX timestamp, time.time if None
+        """
         self.retain = retain
-        self.data = []
+        unknown = set(periods) - set(PERIODS)
+        if unknown:
+            raise ValueError(f"Unknown period(s) {', '.join(sorted(unknown))}!")
+        self.periods = tuple(periods)
+        self.history_days = max(history_days, 1)
+        # day boundaries (local midnight), checked by a single timestamp comparison per reading
+        # injectable, e.g. ReplayClock for historic readings
+        self.clock = time.time if clock is None else clock
+        self.calendar = CalendarClock('day', timestamp=self.clock()) if calendar is None else calendar
+        self.current_date = self._today()  # start date
+        # ring of per-day counters (max. history_days + 1), oldest first, the last one is today
+        self.days = [DayCounter(self.current_date)]
+        # period --> (period key, first reading in this period)
+        self.period_start = {} if self.periods else None
+        self.topics = {} if topics is None else topics
         self.d0 = None  # today
         self.d1 = None  # yesterday
-        self.current_date = datetime.now().date()  # start date
+        # retained d0/d1 (MQTT), used as offsets
+        self.d0_retained = None
+        self.d1_retained = None
+        self.checkpoint_file = checkpoint_file
+        self.checkpoint_interval = checkpoint_interval
+        self._last_checkpoint = time.monotonic()
+        self.publisher = ChangePublisher() if publisher is None else publisher
+
+    @property
+    def today(self):
+        """Counter of the most recent day."""
+        return self.days[-1]
+
+    @property
+    def yesterday(self):
+        """Counter of yesterday, None if there are no readings."""
+        return self.day_counter(self._today() - timedelta(days=1))
+
+    def _today(self):
+        """Return the local date of today, advance the calendar on a day change."""
+        timestamp = self.clock()
+        if timestamp >= self.calendar.end:
+            self.calendar.advance(timestamp)
+        return self.calendar.day
 
     def add_value(self, total_value: float):
-        """Add a new value to the internal data store."""
-        timestamp = datetime.now()
-        self.data.append({'timestamp': timestamp, 'value': total_value})
-        logging.debug("new size of data[] is %s", len(self.data))
+        """Add a new value to the per-day counters."""
+        day = self._today()
+        self._add_reading(day, total_value)
+        logging.debug("number of readings today: %s", self.today.count)
 
         # calculate the difference (delta) aka consumption today so far (d_0)
-        delta = self.calculate_consumption_today()
+        delta = self.calculate_consumption_today(day)
         if delta:
             logging.debug("d0 delta since start: %.2f", delta)
             self.d0 = delta
@@ -86,57 +249,301 @@ class DailyEnergyMonitor:
             logging.debug("d0 delta: not enough data yet")
 
         # check if there's a new day
-        if self._check_is_new_day(timestamp):
+        if self._check_is_new_day(day):
+            # the retained offset belongs to the day which just ended
+            d0_offset = self.d0_retained if self.d0_retained else 0
             # reset on new day
             self.d0_retained = 0
-            self.current_date = timestamp.date()
+            self.current_date = day
             # calculate the difference (delta) aka consumption of yesterday (d_-1)
-            delta = self.calculate_consumption_yesterday()
+            delta = self.calculate_consumption_yesterday(day)
             if not delta:
                 logging.debug("d1 delta: not enough data yet")
             else:
                 logging.debug("d1 delta since start: %.2f", delta)
-                self.d1 = delta
-                # if there has been a retained value, use it as offset from now on
-                self.d1 += self.d1_retained if self.d1_retained else 0
+                # i.e. the final d0 of yesterday
+                self.d1 = delta + d0_offset
                 self.d1_retained = self.d1
                 # tell/publish
                 logging.info("d1: %.2f", self.d1)
 
-    def _check_is_new_day(self, timestamp: datetime):
-        return timestamp.date() != self.current_date
-
-    def calculate_consumption_today(self):
-        """Calculate the consumption of today (d_0)."""
-        today = datetime.now().date()
-        # slice data to just today's subset
-        today_data = [entry['value'] for entry in self.data
-                      if entry['timestamp'].date() == today]
-        if len(today_data) > 1:
-            return today_data[-1] - today_data[0]
-        return None
-
-    def calculate_consumption_yesterday(self):
-        """Calculate the consumption of yesterday (d_-1)."""
-        yesterday = datetime.now().date() - timedelta(days=1)
-        # slice data to yesterday
-        yesterday_data = [entry['value'] for entry in self.data
-                          if entry['timestamp'].date() == yesterday]
-        if len(yesterday_data) > 1:
-            return yesterday_data[-1] - yesterday_data[0]
+        self.checkpoint()
+
+    def _add_reading(self, day: date, value: float):
+        """Add a reading to the counter of its day, roll over on a new day."""
+        if day != self.today.date:
+            self.days.append(DayCounter(day))
+            if len(self.days) > self.history_days + 1:
+                # the oldest day drops out of the ring
+                del self.days[0]
+        self.today.add(value)
+        if self.today.count > 1 and len(self.period_start or ()) == len(self.periods):
+            return  # periods only change with the day
+        for period in self.periods:
+            key = _period_key(day, period)
+            if self.period_start.get(period, (None,))[0] != key:
+                self.period_start[period] = (key, value)
+
+    def _check_is_new_day(self, day: date):
+        return day != self.current_date
+
+    def day_counter(self, day: date):
+        """Return the counter of the given day, None if not (anymore) available."""
+        for counter in reversed(self.days):
+            if counter.date == day:
+                return counter
+            if counter.date < day:
+                break
         return None
 
-
-def handle_smartmeter_message(client, userdata, msg):
+    def _consumption(self, day: date):
+        """Return the consumption of the given day."""
+        counter = self.day_counter(day)
+        return counter.consumption if counter else None
+
+    def calculate_consumption_today(self, today: date = None):
+        """Calculate the consumption of today (d_0).
+
+        :param today: local date of today, default from the clock
+        """
+        return self._consumption(today or self._today())
+
+    def calculate_consumption_yesterday(self, today: date = None):
+        """Calculate the consumption of yesterday (d_-1).
+
+        :param today: local date of today, default from the clock
+        """
+        return self._consumption((today or self._today()) - timedelta(days=1))
+
+    def get_state(self):
+        """Return the state (per-day counters, offsets, d0/d1) as JSON-serializable dictionary."""
+        return {
+            'version': CHECKPOINT_VERSION,
+            'current_date': self.current_date.isoformat(),
+            'days': [[counter.date.isoformat(), counter.first, counter.last,
+                      counter.min, counter.max, counter.count] for counter in self.days],
+            'period_start': {period: [key, first] for period, (key, first)
+                             in (self.period_start or {}).items()},
+            'd0': self.d0,
+            'd1': self.d1,
+            'd0_retained': self.d0_retained,
+            'd1_retained': self.d1_retained,
+        }
+
+    def set_state(self, state: dict):
+        """Restore the state from get_state()."""
+        if state.get('version') != CHECKPOINT_VERSION:
+            raise ValueError(f"Unsupported checkpoint version {state.get('version')}!")
+        self.current_date = date.fromisoformat(state['current_date'])
+        self.days = []
+        for day, first, last, minimum, maximum, count in state['days'][-(self.history_days + 1):]:
+            counter = DayCounter(date.fromisoformat(day))
+            counter.first, counter.last, counter.min, counter.max, counter.count = \
+                first, last, minimum, maximum, count
+            self.days.append(counter)
+        if self.periods:
+            # JSON has no tuples (week key)
+            self.period_start = {period: (tuple(key) if isinstance(key, list) else key, first)
+                                 for period, (key, first) in state['period_start'].items()
+                                 if period in self.periods}
+        self.d0 = state['d0']
+        self.d1 = state['d1']
+        self.d0_retained = state['d0_retained']
+        self.d1_retained = state['d1_retained']
+        if self.current_date < self._today() - timedelta(days=1):
+            # checkpoint older than yesterday, i.e. no counter of yesterday: the stored d1 is stale
+            self.d1 = self.d1_retained = 0
+
+    def _has_state(self):
+        return self.today.count > 0
+
+    def history_values(self, today: date = None):
+        """Return the consumption of d2..dN and the to-date values (name --> value).
+
+        Values which cannot be calculated (not enough data) are left out.
+        The to-date values are the difference to the first reading seen in
+        the period, i.e. they start at the first reading after program start.
+
+        :param today: local date of today, default from the clock
+        """
+        today = today or self._today()
+        result = {}
+        for n in range(2, self.history_days + 1):
+            delta = self._consumption(today - timedelta(days=n))
+            if delta is not None:
+                result[f"d{n}"] = delta
+        if self.today.date != today:
+            return result
+        for period in self.periods:
+            start = self.period_start.get(period)
+            if start and start[0] == _period_key(today, period):
+                result[PERIODS[period]] = self.today.last - start[1]
+        return result
+
+
+class ChangePublisher:
+    """Decide whether a value is worth publishing (again).
+
+    Running values (d0 and the to-date values) are published if they changed
+    by at least the resolution or max_interval seconds have passed.
+    Values of completed days (d1..dN) are only published if they changed,
+    i.e. on day rollover or after a correction of the (retained) state.
+    """
+
+    __slots__ = ('resolution', 'max_interval', 'last', 'n_published', 'n_suppressed')
+
+    def __init__(self, resolution: float = 0.01, max_interval: float = 300):
+        """Decide whether a value is worth publishing (again).
+
+        :param resolution: min. change of running values to publish them
+        :param max_interval: max. seconds between publishing running values
+        """
+        self.resolution = resolution
+        self.max_interval = max_interval
+        self.last = {}  # name --> (value, time.monotonic())
+        self.n_published = 0
+        self.n_suppressed = 0
+
+    def due(self, name: str, value: float, running: bool = True):
+        """Return True if the value is to be published (and note it as published)."""
+        now = time.monotonic()
+        last = self.last.get(name)
+        if last is None:
+            due = True
+        elif running:
+            due = abs(value - last[0]) >= self.resolution or now - last[1] >= self.max_interval
+        else:
+            due = value != last[0]
+        if due:
+            self.last[name] = (value, now)
+            self.n_published += 1
+        else:
+            self.n_suppressed += 1
+        return due
+
+
+class MeterRegistry(_Checkpointing):
+    """DailyEnergyMonitor per meter, indexed by the topic of its total values.
+
+    Monitors are created lazily on the first message of a meter.
+    """
+
+    def __init__(self, factory, checkpoint_file: Path = None, checkpoint_interval: float = 60,
+                 totals=('total',)):
+        """Create a DailyEnergyMonitor per meter, indexed by the topic of its total values.
+
+        :param factory: callable returning a new DailyEnergyMonitor
+        :param checkpoint_file: file to save the states of all meters to, None to disable
+        :param checkpoint_interval: min. number of seconds between two checkpoints
+        :param totals: total fields of single-topic payloads, e.g. ('total', 'total_tariff1')
+        """
+        self.factory = factory
+        self.totals = tuple(totals)
+        self.monitors = {}  # topic --> DailyEnergyMonitor
+        self.checkpoint_file = checkpoint_file
+        self.checkpoint_interval = checkpoint_interval
+        self._last_checkpoint = time.monotonic()
+
+    def get(self, topic: str):
+        """Return the monitor of the meter, create it if necessary."""
+        monitor = self.monitors.get(topic)
+        if monitor is None:
+            monitor = self.monitors[topic] = self.factory()
+            logging.info("New meter: %s (#%d)", topic, len(self.monitors))
+        return monitor
+
+    def get_state(self):
+        """Return the states of all meters."""
+        return {'version': CHECKPOINT_VERSION,
+                'meters': {topic: monitor.get_state() for topic, monitor in self.monitors.items()}}
+
+    def set_state(self, state: dict):
+        """Restore the states of all meters."""
+        if state.get('version') != CHECKPOINT_VERSION:
+            raise ValueError(f"Unsupported checkpoint version {state.get('version')}!")
+        for topic, monitor_state in state['meters'].items():
+            monitor = self.factory()
+            monitor.set_state(monitor_state)
+            self.monitors[topic] = monitor
+
+    def _has_state(self):
+        return bool(self.monitors)
+
+
+def publish_values(client, monitor, topic_prefix: str):
+    """Publish d0, d1 and the history values of a monitor (if due), as <topic_prefix>/<name>."""
+    values = {'d0': monitor.d0, 'd1': monitor.d1}
+    # the day of the value just added
+    values.update(monitor.history_values(monitor.current_date))
+    for name, value in values.items():
+        if not value:
+            continue
+        value = round(value, 2)
+        if not monitor.publisher.due(name, value, running=name == 'd0' or name in PERIODS.values()):
+            continue
+        client.publish(monitor.topics.get(name, f"{topic_prefix}/{name}"), value,
+                       retain=monitor.retain)
+
+
+def parse_total(payload: bytes, name: str = 'total', field_names=SML_FIELD_NAMES):
+    """Return the total value of a plain (.../total/value) or a single-topic payload.
+
+    Single-topic payloads are decoded only partially, cf. extract_fields().
+
+    :param field_names: ordered field names of 'struct' single-topic payloads
+    :return: float, None if the single-topic payload has no such field
+    """
+    if payload.startswith(SINGLE_TOPIC_PAYLOAD_STARTS):
+        value = extract_fields(payload, (name,), field_names=field_names).get(name)
+        return None if value is None else float(value)
+    return float(payload.decode())
+
+
+def handle_smartmeter_message(client, userdata, msg, field_names=SML_FIELD_NAMES):
     """Handle MQTT message for smartmeter total values."""
-    value = float(msg.payload.decode())
+    try:
+        value = parse_total(msg.payload, field_names=field_names)
+    except (ValueError, struct.error) as ex:
+        # an exception would end paho's network loop
+        logging.warning("Cannot decode message of '%s', skipped! %s", msg.topic, ex)
+        return
+    if value is None:
+        return  # window without total value
     userdata.add_value(value)
     if DEBUG:
         return  # do nothing, stop here
-    if userdata.d0:
-        client.publish(MQTT_TOPIC_D0, round(userdata.d0, 2), retain=userdata.retain)
-    if userdata.d1:
-        client.publish(MQTT_TOPIC_D1, round(userdata.d1, 2), retain=userdata.retain)
+    publish_values(client, userdata, MQTT_TOPIC_TOTAL_PREFIX)
+
+
+def handle_meter_message(client, userdata, msg, field_names=SML_FIELD_NAMES):
+    """Handle MQTT message for total values of any meter (wildcard subscription).
+
+    The values are published next to the source topic,
+    e.g. tele/meter1/total/value --> tele/meter1/total/d0
+    Single-topic payloads count as one meter per total field (MeterRegistry.totals),
+    e.g. tele/meter1 --> tele/meter1/total/d0, tele/meter1/total_tariff1/d0
+    """
+    try:
+        if msg.payload.startswith(SINGLE_TOPIC_PAYLOAD_STARTS):
+            values = {f"{msg.topic}/{name}/value": float(value) for name, value
+                      in extract_fields(msg.payload, userdata.totals, field_names=field_names).items()}
+        else:
+            values = {msg.topic: float(msg.payload.decode())}
+    except (ValueError, struct.error) as ex:
+        # an exception would end paho's network loop
+        logging.warning("Cannot decode message of '%s', skipped! %s", msg.topic, ex)
+        return
+    for topic, value in values.items():
+        _add_meter_value(client, userdata, topic, value)
+    userdata.checkpoint()
+
+
+def _add_meter_value(client, registry, topic: str, value: float):
+    monitor = registry.get(topic)
+    monitor.add_value(value)
+    if DEBUG:
+        return  # do nothing, stop here
+    publish_values(client, monitor, topic.rsplit('/', 1)[0])
 
 
 def handle_retained_dx_message(client, userdata, msg):
@@ -159,6 +566,125 @@ def handle_retained_dx_message(client, userdata, msg):
         logging.warning("Unexpected message! (%s, %s)", msg.topic, msg.payload)
 
 
+class ReplayClock:
+    """Injectable clock for DailyEnergyMonitor, returns the timestamp of the replayed reading."""
+
+    __slots__ = ('now',)
+
+    def __init__(self, now: float = 0.0):
+        """Injectable clock, returns the timestamp of the replayed reading."""
+        self.now = now
+
+    def __call__(self):
+        """Return the current (replayed) POSIX timestamp."""
+        return self.now
+
+
+def _parse_timestamp(text: str):
+    """Return the POSIX timestamp of a number or an ISO 8601 string (local time if naive)."""
+    try:
+        return float(text)
+    except ValueError:
+        return datetime.fromisoformat(text).timestamp()
+
+
+def read_records(lines, topic: str = MQTT_TOPIC_SMARTMETER_TOTAL):
+    """Read timestamped total values from a capture file or an MQTT dump.
+
+    Supported line formats:
+      - JSON Lines capture (jsonl sink): {"timestamp": ..., "data": {"total": {"value": ...}, ...}}
+      - MQTT dump, e.g. mosquitto_sub -v -F '%U %t %p': <timestamp> <topic> <value>
+        (the timestamp as seconds since epoch or ISO 8601)
+    Lines which cannot be parsed are skipped.
+
+    :param lines: iterable of text lines
+    :param topic: topic for the capture file lines
+    :return: generator of (timestamp, topic, value)
+    """
+    n_skipped = 0
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            if line.startswith('{'):
+                record = json.loads(line)
+                total = record['data'].get('total')
+                if total is None:
+                    continue  # window without a total value
+                yield float(record['timestamp']), topic, float(total['value'])
+            else:
+                timestamp, record_topic, value = line.split(None, 2)
+                yield _parse_timestamp(timestamp), record_topic, float(value)
+        except (ValueError, KeyError, TypeError, AttributeError):
+            n_skipped += 1
+            logging.debug("Skipped line: %s", line)
+    if n_skipped:
+        logging.warning("Skipped %d invalid lines", n_skipped)
+
+
+def backfill(records, tz=None):
+    """Replay timestamped total values through a DailyEnergyMonitor per topic.
+
+    The records must be in chronological order (per topic).
+
+    :param records: iterable of (timestamp, topic, value), e.g. from read_records()
+    :param tz: tzinfo of the day boundaries, None for the system local time
+    :return: generator of (topic, DayCounter) per day, as soon as the day is complete,
+             the last (incomplete) day of each topic at the end
+    """
+    clock = ReplayClock()
+    monitors = {}
+    for timestamp, topic, value in records:
+        clock.now = timestamp
+        monitor = monitors.get(topic)
+        if monitor is None:
+            monitor = monitors[topic] = DailyEnergyMonitor(
+                clock=clock, calendar=CalendarClock('day', tz, timestamp))
+        day = monitor.today
+        monitor.add_value(value)
+        if monitor.today is not day and day.count:
+            yield topic, day
+    for topic, monitor in monitors.items():
+        if monitor.today.count:
+            yield topic, monitor.today
+
+
+def write_days_csv(days, fout):
+    """Write the per-day counters from backfill() as CSV.
+
+    :param days: iterable of (topic, DayCounter)
+    :param fout: text file
+    """
+    writer = csv.writer(fout)
+    writer.writerow(('topic', 'date', 'consumption', 'first', 'last', 'min', 'max', 'count'))
+    for topic, day in days:
+        consumption = day.consumption
+        writer.writerow((topic, day.date.isoformat(),
+                         '' if consumption is None else round(consumption, 3),
+                         day.first, day.last, day.min, day.max, day.count))
+
+
+def publish_days(client, days, retain: bool = True):
+    """Publish the per-day consumption from backfill() as <prefix>/day/<YYYY-MM-DD>.
+
+    :param client: connected MQTT client (network loop running)
+    :param days: iterable of (topic, DayCounter)
+    :param retain: MQTT retain flag
+    :return: number of published messages
+    """
+    infos = []
+    for topic, day in days:
+        consumption = day.consumption
+        if consumption is None:
+            continue
+        infos.append(client.publish(f"{topic.rsplit('/', 1)[0]}/day/{day.date.isoformat()}",
+                                    round(consumption, 2), qos=1, retain=retain))
+    for info in infos:
+        info.wait_for_publish()
+    return len(infos)
+
+
 def get_config(configfile: Path):
     """Read configuration from confile file."""
     config = configparser.ConfigParser()
@@ -174,40 +700,202 @@ def get_config(configfile: Path):
     return config
 
 
-def main():
-    """Start the program's main entry point."""
-    # set up logging framework
-    setup_logging(level=logging.INFO if not DEBUG else logging.DEBUG)
-
-    # configuration
-    config = get_config(Path(CONFIG_FILENAME))
-    mqtt_username = config.get('Mqtt', 'username')
-    mqtt_password = config.get('Mqtt', 'password')
+def _is_wildcard(topic: str):
+    return '+' in topic or '#' in topic
+
+
+def create_monitors(config):
+    """Create the DailyEnergyMonitor, or the MeterRegistry for a wildcard source topic or several totals.
+
+    :return: (DailyEnergyMonitor or MeterRegistry, source topic)
+    """
+    retain = config.getboolean('Mqtt', 'retain', fallback=True)
+    # the processor sends everything as one payload to topic_prefix (single_topic=true)
+    single_topic = config.getboolean('Mqtt', 'single_topic', fallback=False)
+    source_topic = config.get('Daily', 'source_topic', fallback=(
+        config.get('Mqtt', 'topic_prefix', fallback='tele/smartmeter') if single_topic
+        else MQTT_TOPIC_SMARTMETER_TOTAL))
+    # day boundaries at local midnight of this time zone (default: system local time)
+    calendar = CalendarClock('day', get_timezone(config.get('Daily', 'timezone', fallback='')),
+                             time.time())
+    # history: d2..dN, week-/month-/year-to-date
+    history_days = config.getint('Daily', 'history_days', fallback=1)
+    periods = [period.strip() for period in
+               config.get('Daily', 'periods', fallback='').split(',') if period.strip()]
+    # publish running values (d0, to-date) on change >= resolution or after max. interval
+    resolution = config.getfloat('Daily', 'publish_resolution', fallback=0.01)
+    max_interval = config.getfloat('Daily', 'publish_max_interval', fallback=300)
+    # checkpoints of the state, for exact restarts
+    checkpoint_file = config.get('Daily', 'checkpoint_file', fallback='')
+    if checkpoint_file and not Path(checkpoint_file).is_absolute():
+        checkpoint_file = __script_dir.joinpath(checkpoint_file)
+    checkpoint_file = Path(checkpoint_file) if checkpoint_file else None
+    checkpoint_interval = config.getfloat('Daily', 'checkpoint_interval', fallback=60)
+    # total fields of single-topic payloads, more than one are counted like several meters
+    totals = [name.strip() for name in
+              config.get('Daily', 'totals', fallback='total').split(',') if name.strip()]
+
+    if _is_wildcard(source_topic) or totals != ['total']:
+        last_level = source_topic.rsplit('/', 1)[-1]
+        # the published values must not match the subscription
+        # (single-topic: they are published below the source topic, e.g. <source>/total/d0)
+        if last_level == '#' or (last_level == '+' and not single_topic):
+            raise ValueError(f"Wildcard in last level of source topic '{source_topic}'!")
+        # one lightweight monitor per meter, sharing the (empty) topics dictionary and the calendar
+        topics = {}
+
+        def factory():
+            return DailyEnergyMonitor(retain=retain, history_days=history_days, periods=periods,
+                                      topics=topics, calendar=calendar,
+                                      publisher=ChangePublisher(resolution, max_interval))
+
+        return MeterRegistry(factory, checkpoint_file, checkpoint_interval, totals), source_topic
+
+    # optional topic per value, e.g. topic_d7, topic_ytd
+    topics = {}
+    if config.has_section('Daily'):
+        topics = {key[len('topic_'):]: topic for key, topic in config.items('Daily')
+                  if key.startswith('topic_')}
+    monitor = DailyEnergyMonitor(retain=retain, history_days=history_days, periods=periods,
+                                 checkpoint_file=checkpoint_file,
+                                 checkpoint_interval=checkpoint_interval, topics=topics,
+                                 publisher=ChangePublisher(resolution, max_interval),
+                                 calendar=calendar)
+    return monitor, source_topic
+
+
+def create_client(config):
+    """Create the MQTT client, connect and subscribe to the relevant topics."""
+    mqtt_username = config.get('Mqtt', 'username', fallback=None)
+    mqtt_password = config.get('Mqtt', 'password', fallback=None)
     mqtt_host = config.get('Mqtt', 'host', fallback='localhost')
     mqtt_port = config.getint('Mqtt', 'port', fallback=1883)
-    mqtt_retain = config.getboolean('Mqtt', 'retain', fallback='true')
+
+    userdata, source_topic = create_monitors(config)
+    restored = userdata.load_checkpoint()
+    multi_meter = isinstance(userdata, MeterRegistry)
+    # single-topic payloads with payload_codec=struct: the field names of the processor
+    field_names = [name.strip() for name in
+                   config.get('Daily', 'field_names', fallback=','.join(SML_FIELD_NAMES)).split(',')
+                   if name.strip()]
 
     # MQTT initialization
-    client = mqtt.Client(userdata=DailyEnergyMonitor(retain=mqtt_retain))
+    client = mqtt.Client(userdata=userdata)
     client.username_pw_set(username=mqtt_username, password=mqtt_password)
     client.enable_logger()
 
     # MQTT message callbacks
-    client.message_callback_add(MQTT_TOPIC_D0, handle_retained_dx_message)
-    client.message_callback_add(MQTT_TOPIC_D1, handle_retained_dx_message)
-    client.message_callback_add(MQTT_TOPIC_SMARTMETER_TOTAL, handle_smartmeter_message)
+    if multi_meter:
+        client.message_callback_add(source_topic, functools.partial(handle_meter_message,
+                                                                    field_names=field_names))
+    else:
+        client.message_callback_add(MQTT_TOPIC_D0, handle_retained_dx_message)
+        client.message_callback_add(MQTT_TOPIC_D1, handle_retained_dx_message)
+        client.message_callback_add(source_topic, functools.partial(handle_smartmeter_message,
+                                                                    field_names=field_names))
 
     # initialize MQTT connection
     client.connect(mqtt_host, port=mqtt_port)
     # NOTE subscriptions must come *after* connect() !
-    # subscribe to the retained messages
-    client.subscribe(MQTT_TOPIC_D0)
-    client.subscribe(MQTT_TOPIC_D1)
+    if not restored and not multi_meter:
+        # subscribe to the retained messages (no checkpoint, use them as offsets)
+        client.subscribe(MQTT_TOPIC_D0)
+        client.subscribe(MQTT_TOPIC_D1)
     # subscribe to the very topic which contains the source data
-    client.subscribe(MQTT_TOPIC_SMARTMETER_TOTAL)
+    client.subscribe(source_topic)
+    return client
+
+
+def _open_input(filename: str):
+    if filename == '-':
+        return sys.stdin
+    if filename.endswith('.gz'):
+        return gzip.open(filename, 'rt', encoding='utf8')
+    return open(filename, encoding='utf8')  # pylint: disable=consider-using-with
+
+
+def _read_files(filenames):
+    for filename in filenames:
+        fin = _open_input(filename)
+        try:
+            yield from read_records(fin)
+        finally:
+            if fin is not sys.stdin:
+                fin.close()
+
+
+def run_backfill(config, filenames, csv_file: str = None, publish: bool = False,
+                 timezone: str = None):
+    """Compute the per-day consumption from captures or MQTT dumps, write CSV and/or publish.
+
+    :param config: ConfigParser object, e.g. from config.ini
+    :param filenames: capture files or MQTT dumps, '-' for STDIN
+    :param csv_file: CSV output file, '-' for STDOUT
+    :param publish: publish retained <prefix>/day/<YYYY-MM-DD> messages
+    :param timezone: time zone name, default from [Daily] timezone
+    :return: list of (topic, DayCounter)
+    """
+    if timezone is None:
+        timezone = config.get('Daily', 'timezone', fallback='')
+    # the per-reading log messages of the monitors would slow down the replay
+    level = logging.getLogger().level
+    if not DEBUG:
+        logging.getLogger().setLevel(logging.WARNING)
+    try:
+        days = list(backfill(_read_files(filenames), get_timezone(timezone)))
+    finally:
+        logging.getLogger().setLevel(level)
+    logging.info("Backfill: %d days", len(days))
+    if csv_file == '-' or (csv_file is None and not publish):
+        write_days_csv(days, sys.stdout)
+    elif csv_file:
+        with open(csv_file, 'w', newline='', encoding='utf8') as fout:
+            write_days_csv(days, fout)
+    if publish:
+        client = mqtt.Client()
+        client.username_pw_set(username=config.get('Mqtt', 'username', fallback=None),
+                               password=config.get('Mqtt', 'password', fallback=None))
+        client.connect(config.get('Mqtt', 'host', fallback='localhost'),
+                       port=config.getint('Mqtt', 'port', fallback=1883))
+        client.loop_start()
+        try:
+            n_published = publish_days(client, days)
+            logging.info("Backfill: published %d days", n_published)
+        finally:
+            client.disconnect()
+            client.loop_stop()
+    return days
+
+
+def main(argv=()):
+    """Start the program's main entry point.
+
+    :param argv: command line arguments (without the program name)
+    """
+    arguments = docopt(__doc__, argv=list(argv))
+
+    # set up logging framework
+    setup_logging(level=logging.INFO if not DEBUG else logging.DEBUG)
+
+    # configuration
+    config = get_config(Path(CONFIG_FILENAME))
+
+    if arguments['backfill']:
+        run_backfill(config, arguments['<file>'], csv_file=arguments['--csv'],
+                     publish=arguments['--publish'], timezone=arguments['--timezone'])
+        return
 
-    client.loop_forever()
+    client = create_client(config)
+    # optional on-demand profiling (SIGUSR1: cProfile, SIGUSR2: tracemalloc)
+    profiling = install_profiling(config, 'generate_d0_d1')
+    try:
+        client.loop_forever()
+    finally:
+        if profiling:
+            profiling.close()
+        # pylint: disable=protected-access
+        client._userdata.checkpoint(force=True)
 
 
 if __name__ == "__main__":
-    main()
+    main(sys.argv[1:])
@@ -1,26 +1,28 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
-"""Simulate libsml sml_server output (decoded SML messages)."""
+"""Simulate libsml sml_server output (decoded SML messages).
+
+Replays a capture at 1 frame per second, endlessly.
+For synthetic data of many meters at higher rates see smlmqttprocessor/loadgen.py.
+"""
 
-import os
 import sys
+from pathlib import Path
 from time import sleep
 
-FILENAME = '../../tests/ISKRA_MT691_eHZ-MS2020.txt'
+FILENAME = Path(__file__).parent.parent.parent.joinpath('tests', 'testdata', 'ISKRA_MT691_eHZ-MS2020.txt')
+
+# SML headers, see SML_HEADERS in smltextmqttprocessor.py
+HEADERS = ('1-0:96.50.1*1#', '129-129:199.130.3*255#')
 
-__script_dir = os.path.dirname(os.path.realpath(__file__))
+filename = sys.argv[1] if len(sys.argv) > 1 else FILENAME
+with open(filename, encoding="utf8") as fin:
+    lines = [line.strip() for line in fin if line.strip()]
 
-with open(os.path.join(__script_dir, FILENAME), encoding="utf8") as fin:
-    while True:
-        for line in fin:
-            if line.startswith('1-0:96.50.1*1#ISK#'):
-                # sys.stdout.write(line)
-                print(line.strip())
-                print(fin.readline().strip())
-                print(fin.readline().strip())
-                print(fin.readline().strip())
-                print(fin.readline().strip())
+while True:
+    for i, line in enumerate(lines):
+        if i and line.startswith(HEADERS):
+            # a frame is complete
             sys.stdout.flush()
             sleep(1.0)
-
-        fin.seek(0)
+        print(line)
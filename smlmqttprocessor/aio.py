@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Asyncio building blocks of the processing core: input line readers and MQTT network I/O.
+
+smltextmqttprocessor runs input reading, window collection (incl. window
+deadline timers) and the MQTT client's network I/O in one asyncio event
+loop. Several meters can be processed concurrently in the same loop, one
+processing_loop_async() task per input, e.g.:
+
+    await asyncio.gather(processing_loop_async(await open_input('tcp:meter1:9000'), 15, fanout1),
+                         processing_loop_async(await open_input('tcp:meter2:9000'), 15, fanout2))
+
+The sinks keep their own threads, FanOut hands the windows over without blocking the loop.
+"""
+import asyncio
+import logging
+import os
+import stat
+import sys
+import threading
+from abc import ABC, abstractmethod
+
+# seconds a reader waits for a line before reporting "no data", see LineReader.idle()
+IDLE_INTERVAL = 1.0
+
+
+class LineReader(ABC):
+    """Base class of the asynchronous line readers."""
+
+    @abstractmethod
+    async def readline(self):
+        """Return the next line (str), '' if there is no data (yet)."""
+
+    async def idle(self):
+        """Wait after a readline() without data."""
+        await asyncio.sleep(IDLE_INTERVAL)
+
+    def close(self):
+        """Release resources."""
+
+
+class FileLineReader(LineReader):
+    """Read the lines of a file-like object which does not block, e.g. a regular file or io.StringIO.
+
+    At the end of the file readline() returns '', later calls return appended lines (like `tail -f`).
+
+    :param stream: file-like object with readline(), lines as str or bytes
+    :param owned: close the stream on close()
+    :param yield_every: yield to the event loop every n lines (other meters, timers)
+    """
+
+    def __init__(self, stream, owned=False, yield_every=100):
+        """Read the lines of a file-like object."""
+        self.stream = stream
+        self.owned = owned
+        self.yield_every = yield_every
+        self._n_lines = 0
+
+    async def readline(self):
+        """Return the next line, '' at the end of the file."""
+        self._n_lines += 1
+        if self._n_lines % self.yield_every == 0:
+            await asyncio.sleep(0)
+        line = self.stream.readline()
+        if isinstance(line, bytes):
+            # make sure line is a string, not bytes
+            line = line.decode('utf8', errors='replace')
+        return line
+
+    def close(self):
+        """Close the stream if owned."""
+        if self.owned:
+            self.stream.close()
+
+
+class StreamLineReader(LineReader):
+    """Read the lines of an asyncio stream, e.g. a pipe (STDIN), FIFO or socket.
+
+    :param reader: asyncio.StreamReader
+    :param transport: transport or StreamWriter, closed on close()
+    """
+
+    def __init__(self, reader, transport=None):
+        """Read the lines of an asyncio stream."""
+        self.reader = reader
+        self.transport = transport
+
+    async def readline(self):
+        """Return the next line, '' if there is none within IDLE_INTERVAL seconds or at the end of the stream."""
+        try:
+            line = await asyncio.wait_for(self.reader.readline(), IDLE_INTERVAL)
+        except asyncio.TimeoutError:
+            return ''
+        return line.decode('utf8', errors='replace')
+
+    async def idle(self):
+        """Wait at the end of the stream, readline() waited already otherwise."""
+        if self.reader.at_eof():
+            await asyncio.sleep(IDLE_INTERVAL)
+
+    def close(self):
+        """Close the transport."""
+        if self.transport:
+            self.transport.close()
+
+
+async def _pipe_reader(fileobj):
+    reader = asyncio.StreamReader()
+    transport, _ = await asyncio.get_running_loop().connect_read_pipe(
+        lambda: asyncio.StreamReaderProtocol(reader), fileobj)
+    return StreamLineReader(reader, transport)
+
+
+async def open_input(spec):
+    """Open the input, returns a LineReader.
+
+    :param spec: '-' (STDIN), a file or FIFO path, tcp:host:port or unix:path
+                 (e.g. the outputs of smlmqttprocessor.loadgen)
+    """
+    if spec.startswith('tcp:'):
+        host, port = spec[len('tcp:'):].rsplit(':', 1)
+        reader, writer = await asyncio.open_connection(host or 'localhost', int(port))
+        return StreamLineReader(reader, writer)
+    if spec.startswith('unix:'):
+        reader, writer = await asyncio.open_unix_connection(spec[len('unix:'):])
+        return StreamLineReader(reader, writer)
+    if spec == '-':
+        if stat.S_ISREG(os.fstat(sys.stdin.fileno()).st_mode):
+            # redirected file, e.g. `< capture.txt`
+            return FileLineReader(sys.stdin)
+        # pipe (e.g. from sml_server), terminal
+        return await _pipe_reader(sys.stdin)
+    mode = os.stat(spec).st_mode
+    if stat.S_ISFIFO(mode) or stat.S_ISCHR(mode):
+        # read-write, i.e. no end of file while there is no writer (yet)
+        return await _pipe_reader(os.fdopen(os.open(spec, os.O_RDWR | os.O_NONBLOCK), 'rb', buffering=0))
+    # pylint: disable=consider-using-with
+    return FileLineReader(open(spec, encoding='utf8', errors='replace'), owned=True)
+
+
+class AsyncioMqttAdapter:
+    """Drive a paho client's network I/O by an asyncio event loop instead of paho's thread (loop_start).
+
+    paho's socket callbacks register the socket with the event loop: readable
+    --> loop_read(), writable (only while paho has data to send) --> loop_write().
+    A task calls loop_misc() (keepalive, timeouts) every second and (re)connects
+    with exponential backoff. The client may still be used from other threads
+    (e.g. the sinks'), the socket callbacks hand over to the event loop.
+
+    :param client: paho client, connect_async() already called
+    :param loop: asyncio event loop (running, or run later)
+    :param min_delay: min. reconnect delay in seconds
+    :param max_delay: max. reconnect delay in seconds
+    """
+
+    def __init__(self, client, loop, min_delay=1, max_delay=120):
+        """Drive a paho client's network I/O by an asyncio event loop."""
+        self.client = client
+        self.loop = loop
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.stopped = False
+        self._thread_id = None  # of the event loop
+        # e.g. MyMqtt's connect timing
+        self._on_socket_open = client.on_socket_open
+        client.on_socket_open = self._socket_open
+        client.on_socket_close = self._socket_close
+        client.on_socket_register_write = self._register_write
+        client.on_socket_unregister_write = self._unregister_write
+        self._task = asyncio.run_coroutine_threadsafe(self._run(), loop)
+
+    def in_loop_thread(self):
+        """Return True if called from the event loop's thread."""
+        return self._thread_id == threading.get_ident()
+
+    def _call_in_loop(self, function, *args):
+        if self.in_loop_thread():
+            function(*args)
+        else:
+            self.loop.call_soon_threadsafe(function, *args)
+
+    # noinspection PyUnusedLocal
+    def _socket_open(self, client, userdata, sock):
+        if self._on_socket_open:
+            self._on_socket_open(client, userdata, sock)
+        self._call_in_loop(self.loop.add_reader, sock, self._read)
+
+    # noinspection PyUnusedLocal
+    def _socket_close(self, client, userdata, sock):  # pylint: disable=unused-argument
+        # registered by object, i.e. the removal also works once the socket is closed
+        self._call_in_loop(self._remove, sock)
+
+    def _remove(self, sock):
+        self.loop.remove_reader(sock)
+        self.loop.remove_writer(sock)
+
+    # noinspection PyUnusedLocal
+    def _register_write(self, client, userdata, sock):  # pylint: disable=unused-argument
+        self._call_in_loop(self.loop.add_writer, sock, self._write)
+
+    # noinspection PyUnusedLocal
+    def _unregister_write(self, client, userdata, sock):  # pylint: disable=unused-argument
+        self._call_in_loop(self.loop.remove_writer, sock)
+
+    def _read(self):
+        self.client.loop_read()
+
+    def _write(self):
+        self.client.loop_write()
+
+    async def _run(self):
+        self._thread_id = threading.get_ident()
+        delay = self.min_delay
+        while not self.stopped:
+            if self.client.socket() is None:
+                try:
+                    # blocking (DNS, TCP connect), hence in a worker thread
+                    await self.loop.run_in_executor(None, self.client.reconnect)
+                    delay = self.min_delay
+                except OSError as ex:
+                    logging.warning("MQTT connect failed, retrying in %d seconds! %s", delay, ex)
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, self.max_delay)
+                    continue
+            else:
+                self.client.loop_misc()
+            await asyncio.sleep(1)
+
+    def stop(self):
+        """Stop reconnecting (e.g. before disconnect()), a pending DISCONNECT is still written."""
+        self.stopped = True
+        self._task.cancel()
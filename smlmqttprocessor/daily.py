@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""In-process daily counters: today (d0) and yesterday (d1) per total field.
+
+Fed directly from the parsed total values (total, total_export, tariffs)
+of each window, i.e. without the broker round-trip of generate_d0_d1.py.
+The values are added to the window's aggregates (e.g. total --> d0), so
+all sinks get them with the window and MQTT publishes them in the same
+batch, e.g. as tele/smartmeter/total/d0 and tele/smartmeter/total/d1.
+"""
+from datetime import timedelta
+
+from smlmqttprocessor.utils.rollup import CalendarClock, DayCounter, get_timezone
+
+# value-types added to the aggregates of the total fields
+DAILY_STATS = ('d0', 'd1')
+
+
+class DailyCounters:
+    """Today (d0) and yesterday (d1) per total field.
+
+    Like generate_d0_d1.py, the consumption of a day is the difference of
+    its last and first reading. Counting starts with the first window after
+    the start of the program.
+
+    :param fields: total field names, e.g. ('total', 'total_export')
+    :param tz: tzinfo of the day boundaries, None for the system local time
+    :param timestamp: initial POSIX timestamp, default now
+    """
+
+    def __init__(self, fields=('total',), tz=None, timestamp=None):
+        """Today (d0) and yesterday (d1) per total field."""
+        self.fields = tuple(fields)
+        self.calendar = CalendarClock('day', tz, timestamp)
+        self.today = {}  # fieldname --> DayCounter
+        self.d1 = {}  # fieldname --> consumption of yesterday
+
+    def update(self, records, mqttdata, timestamp):
+        """Add the total values of a window, add d0/d1 to the window's aggregates.
+
+        :param records: collected data of the window, fieldname --> [data points]
+        :param mqttdata: 2-dim dictionary fieldname --> value-type --> value, updated in place
+        :param timestamp: POSIX timestamp of the window
+        """
+        if timestamp >= self.calendar.end:
+            self.calendar.advance(timestamp)
+        day = self.calendar.day
+        for name in self.fields:
+            values = records.get(name)
+            if not values or name not in mqttdata:
+                continue
+            counter = self.today.get(name)
+            if counter is None or counter.date != day:
+                self._new_day(name, counter, day)
+                counter = self.today[name] = DayCounter(day)
+            for value in values:
+                counter.add(value)
+            aggregates = mqttdata[name]
+            if counter.count > 1:
+                aggregates['d0'] = round(counter.consumption, 2)
+            if name in self.d1:
+                aggregates['d1'] = self.d1[name]
+
+    def _new_day(self, name, counter, day):
+        """Keep the consumption of the completed day as d1 if it was yesterday."""
+        if counter is not None and counter.count > 1 and counter.date == day - timedelta(days=1):
+            self.d1[name] = round(counter.consumption, 2)
+        else:
+            # no (complete) day before
+            self.d1.pop(name, None)
+
+
+def create_daily_counters(config):
+    """Create the DailyCounters according to the configuration, None if not enabled.
+
+    :param config: ConfigParser object, e.g. from config.ini
+    :raise ValueError: if enabled with the single-topic struct codec
+    """
+    if not config.getboolean('Daily', 'in_process', fallback=False):
+        return None
+    if config.getboolean('Mqtt', 'single_topic', fallback=False) and \
+            config.get('Mqtt', 'payload_codec', fallback='json') == 'struct':
+        # the fixed struct layout has no room for d0/d1, they would be dropped silently
+        raise ValueError("[Daily] in_process is not supported with the single-topic payload_codec=struct!")
+    fields = [name.strip() for name in
+              config.get('Daily', 'totals', fallback='total').split(',') if name.strip()]
+    return DailyCounters(fields, get_timezone(config.get('Daily', 'timezone', fallback='')))
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Built-in metrics of smltextmqttprocessor: ingest rate, parse latency, window and publish timings.
+
+Disabled unless an exporter is configured (section [Metrics]), then
+processing_loop() and FanOut get a ProcessorMetrics instance; disabled,
+they only check for None, i.e. there is no measurable overhead.
+
+Exporters:
+- Prometheus text format on a local HTTP endpoint (http_port), e.g. http://127.0.0.1:9101/metrics
+- periodic MQTT messages (mqtt_interval), one topic per value below mqtt_topic_prefix,
+  e.g. tele/smartmeter/$SYS/input_lines_total
+"""
+import logging
+import threading
+import time
+
+from smlmqttprocessor.sinks import MqttSink
+from smlmqttprocessor.tracing import TRACE_BUCKETS, TRACE_STAGES
+from smlmqttprocessor.utils.metrics import FAST_BUCKETS, OUTAGE_BUCKETS, MetricsRegistry
+
+# window flush (aggregation and queueing for the sinks), sink writes (e.g. MQTT send)
+WINDOW_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+
+
+class ProcessorMetrics:
+    """Metrics of the processing pipeline.
+
+    The hot-path metrics are attributes, e.g. metrics.lines.inc().
+
+    :param registry: MetricsRegistry, default a new one
+    """
+
+    def __init__(self, registry=None):
+        """Metrics of the processing pipeline."""
+        registry = self.registry = registry or MetricsRegistry()
+        self.lines = registry.counter('input_lines_total', "Lines read from the input")
+        self.messages = registry.counter('sml_messages_total', "SML messages (frames) read from the input")
+        self.malformed = registry.counter('malformed_lines_total', "Lines which could not be parsed")
+        self.read_time = registry.histogram('input_read_seconds', "Time waiting for an input line",
+                                            buckets=OUTAGE_BUCKETS[:6])
+        self.parse_time = registry.histogram('parse_line_seconds', "Time parsing a line", buckets=FAST_BUCKETS)
+        self.windows = registry.counter('windows_total', "Handled windows")
+        self.window_messages = registry.gauge('window_messages', "SML messages in the last window")
+        self.flush_time = registry.histogram('window_flush_seconds', "Time handling a window (until queued)",
+                                             buckets=WINDOW_BUCKETS)
+        self.aggregation_time = registry.histogram('aggregation_seconds', "Time aggregating a window",
+                                                   buckets=WINDOW_BUCKETS)
+        # window tracing, see smlmqttprocessor.tracing
+        self.stage_time = {stage: registry.histogram('window_stage_seconds', "Window latency per stage",
+                                                     buckets=TRACE_BUCKETS, labels={'stage': stage})
+                           for stage in TRACE_STAGES}
+        self.end_to_end = {frame: registry.histogram('window_end_to_end_seconds',
+                                                     "Time from reading a window's first/last frame until acknowledged",
+                                                     buckets=TRACE_BUCKETS, labels={'frame': frame})
+                           for frame in ('first', 'last')}
+
+    def add_fanout(self, fanout):
+        """Register the metrics of the sinks (and MQTT client) of a FanOut."""
+        registry = self.registry
+        for worker in fanout.workers:
+            labels = {'sink': worker.sink.name}
+            registry.counter('sink_windows_written_total', "Windows written by the sink",
+                             lambda w=worker: w.n_written, labels)
+            registry.counter('sink_windows_dropped_total', "Windows dropped as the sink was too slow",
+                             lambda w=worker: w.n_dropped, labels)
+            registry.counter('sink_errors_total', "Failed sink writes", lambda w=worker: w.n_errors, labels)
+            registry.gauge('sink_queue_length', "Windows waiting for the sink",
+                           lambda w=worker: w.queue.qsize(), labels)
+            registry.histogram('sink_write_seconds', "Time writing a window, e.g. MyMqtt.send",
+                               histogram=worker.write_time, labels=labels)
+            if isinstance(worker.sink, MqttSink):
+                self.add_mqtt(worker.sink.mymqtt)
+        if fanout.overload:
+            self.add_overload(fanout.overload)
+
+    def add_overload(self, overload):
+        """Register the lag and shed counts of an OverloadPolicy."""
+        registry = self.registry
+        registry.gauge('processing_lag_seconds', "Lag behind the meter (input) or of the sinks, the larger one",
+                       lambda: overload.lag)
+        registry.gauge('overload_active', "1 while shedding load", lambda: int(overload.active))
+        registry.counter('overload_activations_total', "Times the lag exceeded the threshold",
+                         lambda: overload.n_activations)
+        for policy, function in (('drop_frames', lambda: overload.n_frames_shed),
+                                 ('merge', lambda: overload.n_windows_merged),
+                                 ('value_only', lambda: overload.n_windows_value_only)):
+            registry.counter('overload_shed_total',
+                             "Shed load: frames reduced to counters, windows merged or value-only",
+                             function, {'policy': policy})
+
+    def add_mqtt(self, mymqtt):
+        """Register the metrics of a MyMqtt instance."""
+        registry = self.registry
+        registry.histogram('mqtt_publish_latency_seconds', "Time until a QoS>0 message is acknowledged",
+                           histogram=mymqtt.publish_latency)
+        registry.histogram('mqtt_reconnect_seconds', "Time from a disconnect until reconnected",
+                           histogram=mymqtt.reconnect_time)
+        registry.histogram('mqtt_outage_seconds', "Broker outages", histogram=mymqtt.outage_duration)
+        registry.counter('mqtt_reconnects_total', "(Re)connects", lambda: mymqtt.n_reconnects)
+        registry.counter('mqtt_retried_total', "Re-published unacknowledged messages", lambda: mymqtt.n_retried)
+        registry.counter('mqtt_queued_total', "Messages queued while disconnected", lambda: mymqtt.n_queued)
+        registry.counter('mqtt_queue_dropped_total', "Queued messages dropped", lambda: mymqtt.n_queue_dropped)
+        registry.gauge('mqtt_inflight', "Unacknowledged QoS>0 messages", lambda: len(mymqtt.inflight))
+
+
+class MetricsHttpServer:
+    """Serve the metrics in the Prometheus text format, in a background thread.
+
+    :param registry: MetricsRegistry
+    :param host: bind address, e.g. 127.0.0.1 (local only)
+    :param port: TCP port, 0 for any free port (see port attribute)
+    """
+
+    def __init__(self, registry, host='127.0.0.1', port=9101):
+        """Serve the metrics in the Prometheus text format."""
+        # imported only when enabled, http.server is one of the slowest imports at startup
+        # pylint: disable=import-outside-toplevel
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        class Handler(BaseHTTPRequestHandler):
+            """GET /metrics."""
+
+            # pylint: disable=invalid-name
+            def do_GET(self):
+                """Handle GET requests."""
+                if self.path.split('?', 1)[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = registry.render_prometheus().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+                logging.debug("metrics http: " + format, *args)
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self._thread = threading.Thread(target=self.server.serve_forever, name="metrics-http", daemon=True)
+        self._thread.start()
+        logging.info("Metrics: http://%s:%d/metrics", host, self.port)
+
+    def close(self):
+        """Stop the server."""
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class MetricsMqttReporter:
+    """Publish the metrics periodically via MQTT, one topic per value.
+
+    :param registry: MetricsRegistry
+    :param mymqtt: connected MyMqtt instance
+    :param topic_prefix: e.g. tele/smartmeter/$SYS
+    :param interval: seconds between two reports
+    """
+
+    def __init__(self, registry, mymqtt, topic_prefix, interval=60):
+        """Publish the metrics periodically via MQTT."""
+        self.registry = registry
+        self.mymqtt = mymqtt
+        self.topic_prefix = topic_prefix.rstrip('/')
+        self.interval = interval
+        self._previous = None  # (monotonic time, snapshot) of the last report
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="metrics-mqtt", daemon=True)
+        self._thread.start()
+
+    def report(self):
+        """Publish the current values, and the rates of the counters since the last report.
+
+        E.g. input_lines_total and input_lines_per_second.
+        """
+        now = time.monotonic()
+        values = self.registry.snapshot()
+        if self._previous:
+            elapsed = now - self._previous[0]
+            for key, value in list(values.items()):
+                name, _, labels = key.partition('/')
+                if name.endswith('_total') and elapsed > 0:
+                    rate_key = '/'.join(filter(None, (name[:-len('_total')] + '_per_second', labels)))
+                    values[rate_key] = round((value - self._previous[1].get(key, 0)) / elapsed, 3)
+        self._previous = (now, values)
+        # NOTE: no batch(), the MQTT sink's thread may be publishing at the same time
+        for key, value in values.items():
+            if value is not None:
+                self.mymqtt.publish("%s/%s" % (self.topic_prefix, key), value)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.report()
+            except Exception as ex:  # pylint: disable=broad-exception-caught
+                logging.error("Publishing the metrics failed! %s: %s", type(ex).__name__, ex)
+
+    def close(self):
+        """Stop reporting."""
+        self._stop.set()
+        self._thread.join(5)
+
+
+class Instrumentation:
+    """Metrics and their exporters, see create_instrumentation().
+
+    :param metrics: ProcessorMetrics
+    :param http: (host, port) of the Prometheus endpoint, None to disable
+    :param mqtt: (topic prefix, interval) of the MQTT reports, None to disable
+    """
+
+    def __init__(self, metrics, http=None, mqtt=None):
+        """Metrics and their exporters."""
+        self.metrics = metrics
+        self.http = http
+        self.mqtt = mqtt
+        self.exporters = []
+
+    def start(self, fanout):
+        """Register the sinks' metrics and start the exporters."""
+        self.metrics.add_fanout(fanout)
+        if self.http:
+            self.exporters.append(MetricsHttpServer(self.metrics.registry, *self.http))
+        if self.mqtt:
+            mqtt_sinks = [worker.sink for worker in fanout.workers if isinstance(worker.sink, MqttSink)]
+            if mqtt_sinks:
+                self.exporters.append(MetricsMqttReporter(self.metrics.registry, mqtt_sinks[0].mymqtt, *self.mqtt))
+            else:
+                logging.warning("Metrics: mqtt_interval is set, but there is no MQTT sink!")
+
+    def close(self):
+        """Stop the exporters."""
+        for exporter in self.exporters:
+            exporter.close()
+        self.exporters = []
+
+
+def create_instrumentation(config):
+    """Create the Instrumentation according to the configuration, None if no exporter is enabled.
+
+    :param config: ConfigParser object, e.g. from config.ini
+    """
+    http_port = config.getint('Metrics', 'http_port', fallback=0)
+    mqtt_interval = config.getfloat('Metrics', 'mqtt_interval', fallback=0)
+    if http_port <= 0 and mqtt_interval <= 0:
+        return None
+    http = mqtt = None
+    if http_port > 0:
+        http = (config.get('Metrics', 'http_host', fallback='127.0.0.1'), http_port)
+    if mqtt_interval > 0:
+        topic_prefix = config.get('Mqtt', 'topic_prefix', fallback='tele/smartmeter')
+        mqtt = (config.get('Metrics', 'mqtt_topic_prefix', fallback=topic_prefix + '/$SYS'), mqtt_interval)
+    return Instrumentation(ProcessorMetrics(), http, mqtt)
@@ -0,0 +1,406 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""loadgen.py - Synthetic multi-meter SML load generator.
+
+Simulates many virtual smart meters and writes their frames (SML messages)
+either as text like libsml's sml_server_time output (input of
+smltextmqttprocessor.py) or as binary SML transport frames (input of
+sml_server_time, e.g. via a pty). Each frame is one simulated second of the
+meter (totals and act_sensor_time advance accordingly), --rate sets how many
+frames per wall-clock second are written, i.e. --rate=100 is 100x the
+production rate.
+
+Usage:
+  loadgen.py [options] [<output>]
+  loadgen.py -h | --help
+
+Arguments:
+  output              '-' for STDOUT (default), a file, fifo:<path> (created if needed),
+                      pty (the device name is printed to STDERR), tcp:<host>:<port> or unix:<path>;
+                      '{meter}' in the output (e.g. fifo:/tmp/meter{meter}) gives each meter its own output
+
+Options:
+  -m --meters=N       Number of virtual meters [default: 1]
+  -p --profile=NAMES  Comma-separated profiles, cycled over the meters: iskra, iskra-l3, emh, pv [default: iskra]
+  -r --rate=HZ        Frames per second per meter, 0 for as fast as possible [default: 1]
+  -n --frames=N       Frames per meter, 0 for endless [default: 0]
+  -f --format=FORMAT  text (sml_server_time output) or binary (SML transport) [default: text]
+  --noise=WATT        Standard deviation of the power noise [default: 20]
+  --dropout=P         Probability of a drop-out, i.e. frames not sent [default: 0]
+  --burst=N           Max. number of frames of a drop-out [default: 1]
+  --garble=P          Probability of a garbled frame (truncated line, corrupted binary) [default: 0]
+  --seed=N            Random seed [default: 1]
+  -h --help           Show this screen.
+
+Run it with:
+`python -m smlmqttprocessor.loadgen --meters 10 --rate 100 | python smlmqttprocessor/smltextmqttprocessor.py --no-mqtt -`
+"""
+import math
+import os
+import random
+import socket
+import sys
+import time
+
+from docopt import docopt
+
+# pylint: disable=consider-using-f-string
+
+# units (DLMS unit codes) and their text
+WH = (30, 'Wh')
+W = (27, 'W')
+
+# profile --> header line (OBIS#value), server id OBIS, fields [(OBIS, kind, unit)], signature line
+# kinds: total (import), tariff1, tariff2 (import split), export, actual, l1..l3 (power)
+PROFILES = {
+    # e.g. ISKRA MT691 (ISKRA_MT691_eHZ-MS2020.txt)
+    'iskra': {
+        'header': ('1-0:96.50.1*1', 'ISK'),
+        'server_id': '1-0:96.1.0*255',
+        'fields': [('1-0:1.8.0*255', 'total', WH), ('1-0:16.7.0*255', 'actual', W)],
+        'signature': False,
+    },
+    # e.g. ISKRA MT175 with L1-L3 (ISKRA_MT175_eHZ.txt)
+    'iskra-l3': {
+        'header': ('129-129:199.130.3*255', 'ISK'),
+        'server_id': '1-0:0.0.9*255',
+        'fields': [('1-0:1.8.0*255', 'total', WH), ('1-0:1.8.1*255', 'tariff1', WH),
+                   ('1-0:1.8.2*255', 'tariff2', WH), ('1-0:16.7.0*255', 'actual', W),
+                   ('1-0:36.7.0*255', 'l1', W), ('1-0:56.7.0*255', 'l2', W), ('1-0:76.7.0*255', 'l3', W)],
+        'signature': True,
+    },
+    # e.g. EMH eHZ (EMH_eHZ-IW8E2AWL0EK2P.txt)
+    'emh': {
+        'header': ('129-129:199.130.3*255', 'EMH'),
+        'server_id': '1-0:0.0.9*255',
+        'fields': [('1-0:1.8.0*255', 'total', WH), ('1-0:1.8.1*255', 'tariff1', WH),
+                   ('1-0:1.8.2*255', 'tariff2', WH), ('1-0:16.7.0*255', 'actual', W)],
+        'signature': True,
+    },
+    # bidirectional meter with photovoltaics (export, negative actual power)
+    'pv': {
+        'header': ('1-0:96.50.1*1', 'ISK'),
+        'server_id': '1-0:96.1.0*255',
+        'fields': [('1-0:1.8.0*255', 'total', WH), ('1-0:2.8.0*255', 'export', WH),
+                   ('1-0:16.7.0*255', 'actual', W), ('1-0:36.7.0*255', 'l1', W),
+                   ('1-0:56.7.0*255', 'l2', W), ('1-0:76.7.0*255', 'l3', W)],
+        'signature': False,
+    },
+}
+
+
+class VirtualMeter:
+    """A simulated smart meter, one frame per simulated second.
+
+    The power is a slowly drifting base load per phase plus Gaussian noise,
+    the pv profile subtracts a (simulated) day-time solar production.
+
+    :param profile: one of PROFILES
+    :param index: meter number, makes server id and start values unique
+    :param rng: random.Random instance
+    :param noise: standard deviation of the power noise (W)
+    """
+
+    def __init__(self, profile='iskra', index=0, rng=None, noise=20.0):
+        """Simulate a smart meter."""
+        if profile not in PROFILES:
+            raise ValueError("Unknown profile '%s'! (valid: %s)" % (profile, ", ".join(PROFILES)))
+        self.profile = PROFILES[profile]
+        self.index = index
+        self.rng = rng or random.Random(index)
+        self.noise = noise
+        self.server_id = bytes([0x0a, 0x01]) + self.profile['header'][1].encode() + bytes([0x00]) \
+            + (0x04325ec5 + index).to_bytes(4, 'big')
+        self.sensor_time = 6825875 + index * 86400
+        self.total = 198927.3 + index * 1000.0  # Wh
+        self.tariff2 = 0.0
+        self.export = 0.0
+        self.base = [self.rng.uniform(20, 200) for _ in range(3)]  # W per phase
+        self.phases = list(self.base)
+
+    @property
+    def actual(self):
+        """Current (net) power in W, negative if exporting."""
+        return sum(self.phases)
+
+    def step(self):
+        """Advance the meter by one second."""
+        self.sensor_time += 1
+        for i, base in enumerate(self.base):
+            # mean-reverting random walk of the base load
+            self.base[i] = max(5.0, base + self.rng.gauss(0, 2) + (100 - base) * 0.001)
+            self.phases[i] = max(0.0, self.base[i] + self.rng.gauss(0, self.noise))
+        if 'export' in (kind for _, kind, _ in self.profile['fields']):
+            # solar production, peak 3 kW at simulated noon (1 frame = 1 simulated second)
+            daytime = (self.sensor_time % 86400) / 86400
+            solar = max(0.0, math.sin((daytime - 0.25) * 2 * math.pi)) * 1000
+            self.phases = [power - solar for power in self.phases]
+        power = self.actual
+        if power >= 0:
+            self.total += power / 3600
+            if self.sensor_time % 86400 >= 79200:
+                # low tariff from 22:00
+                self.tariff2 += power / 3600
+        else:
+            self.export -= power / 3600
+
+    def values(self):
+        """Return [(OBIS, value, unit)] of the current state."""
+        values = {
+            'total': round(self.total, 1), 'tariff1': round(self.total - self.tariff2, 1),
+            'tariff2': round(self.tariff2, 1), 'export': round(self.export, 1),
+            'actual': int(round(self.actual)),
+            'l1': int(round(self.phases[0])), 'l2': int(round(self.phases[1])), 'l3': int(round(self.phases[2])),
+        }
+        return [(obis, values[kind], unit) for obis, kind, unit in self.profile['fields']]
+
+    def text_frame(self):
+        """Return the current frame as lines like sml_server_time's output."""
+        header_obis, manufacturer = self.profile['header']
+        lines = ['%s#%s#' % (header_obis, manufacturer),
+                 '%s#%s #' % (self.profile['server_id'], ' '.join('%02x' % b for b in self.server_id))]
+        for obis, value, unit in self.values():
+            lines.append('%s#%s#%s' % (obis, value, unit[1]))
+        if self.profile['signature']:
+            signature = self.rng.getrandbits(48 * 8).to_bytes(48, 'big')
+            lines.append('129-129:199.130.5*255#%s #' % ' '.join('%02x' % b for b in signature))
+        lines.append('act_sensor_time#%d#' % self.sensor_time)
+        return lines
+
+    def binary_frame(self, transaction=0):
+        """Return the current frame as SML transport (open, get list and close response)."""
+        file_id = (self.sensor_time & 0xffffffff).to_bytes(4, 'big')
+        entries = [_list([_octets(_obis(self.profile['header'][0])), _NONE, _NONE, _NONE, _NONE,
+                          _octets(self.profile['header'][1].encode()), _NONE]),
+                   _list([_octets(_obis(self.profile['server_id'])), _NONE, _NONE, _NONE, _NONE,
+                          _octets(self.server_id), _NONE])]
+        for obis, value, unit in self.values():
+            scaler = -1 if isinstance(value, float) else 0
+            entries.append(_list([_octets(_obis(obis)), _NONE, _NONE, _unsigned(unit[0], 1),
+                                  _integer(scaler, 1), _integer(int(round(value * 10 ** -scaler)), 8), _NONE]))
+        sensor_time = _list([_unsigned(1, 1), _unsigned(self.sensor_time & 0xffffffff, 4)])
+        messages = [
+            _message(transaction, 0x0101, _list([_NONE, _NONE, _octets(file_id), _octets(self.server_id),
+                                                 _NONE, _NONE])),
+            _message(transaction + 1, 0x0701, _list([_NONE, _octets(self.server_id), _NONE, sensor_time,
+                                                     _list(entries), _NONE, _NONE])),
+            _message(transaction + 2, 0x0201, _list([_NONE])),
+        ]
+        return sml_file(b''.join(messages))
+
+
+# --- SML binary encoding (type-length fields, SML 1.04) ---
+
+_NONE = b'\x01'  # optional value not set
+
+
+def _obis(text):
+    """Return the 6 bytes of an OBIS code like 1-0:1.8.0*255."""
+    medium, rest = text.split('-', 1)
+    channel, rest = rest.split(':', 1)
+    indicator, rest = rest.split('.', 1)
+    mode, rest = rest.split('.', 1)
+    quantities, storage = rest.split('*', 1)
+    return bytes(int(part) for part in (medium, channel, indicator, mode, quantities, storage))
+
+
+def _octets(data):
+    if len(data) + 1 > 15:
+        # 2-byte type-length field (more bit), the length includes both bytes
+        length = len(data) + 2
+        return bytes([0x80 | (length >> 4), length & 0x0f]) + data
+    return bytes([len(data) + 1]) + data
+
+
+def _unsigned(value, size):
+    return bytes([0x60 | (size + 1)]) + value.to_bytes(size, 'big')
+
+
+def _integer(value, size):
+    return bytes([0x50 | (size + 1)]) + value.to_bytes(size, 'big', signed=True)
+
+
+def _list(items):
+    return bytes([0x70 | len(items)]) + b''.join(items)
+
+
+def crc16(data):
+    """CRC-16/X-25 of SML, as transmitted (big-endian)."""
+    crc = 0xffff
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0x8408 if crc & 1 else crc >> 1
+    crc ^= 0xffff
+    return ((crc << 8) | (crc >> 8)) & 0xffff
+
+
+def _message(transaction, tag, body):
+    data = _list([_octets(b'%d' % transaction), _unsigned(0, 1), _unsigned(0, 1),
+                  _list([_unsigned(tag, 2), body])])
+    # replace the list's TL (6 elements incl. CRC and end of message)
+    data = b'\x76' + data[1:]
+    return data + _unsigned(crc16(data), 2) + b'\x00'
+
+
+def sml_file(messages):
+    """Return SML messages wrapped in the transport (escape sequences, padding, CRC)."""
+    messages = messages.replace(b'\x1b\x1b\x1b\x1b', b'\x1b\x1b\x1b\x1b' * 2)
+    padding = -len(messages) % 4
+    data = b'\x1b\x1b\x1b\x1b\x01\x01\x01\x01' + messages + b'\x00' * padding + b'\x1b\x1b\x1b\x1b\x1a' \
+        + bytes([padding])
+    return data + crc16(data).to_bytes(2, 'big')
+
+
+# --- outputs ---
+
+def open_output(spec):
+    """Open an output for writing bytes.
+
+    :param spec: '-', a file name, fifo:<path>, pty, tcp:<host>:<port> or unix:<path>
+    :return: binary file object
+    """
+    # pylint: disable=consider-using-with
+    if spec in ('-', ''):
+        return sys.stdout.buffer
+    if spec.startswith('fifo:'):
+        path = spec[len('fifo:'):]
+        if not os.path.exists(path):
+            os.mkfifo(path)
+        return open(path, 'wb')  # blocks until there is a reader
+    if spec == 'pty':
+        master, slave = os.openpty()
+        print("pty: %s" % os.ttyname(slave), file=sys.stderr, flush=True)
+        return os.fdopen(master, 'wb')
+    if spec.startswith('tcp:'):
+        host, port = spec[len('tcp:'):].rsplit(':', 1)
+        return socket.create_connection((host, int(port))).makefile('wb')
+    if spec.startswith('unix:'):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(spec[len('unix:'):])
+        return sock.makefile('wb')
+    return open(spec, 'wb')
+
+
+class LoadGenerator:
+    """Frames of many virtual meters, with drop-outs and garbled frames.
+
+    :param meters: list of VirtualMeter
+    :param binary: binary SML transport instead of text
+    :param dropout: probability of a drop-out (per meter and frame)
+    :param burst: max. number of frames of a drop-out
+    :param garble: probability of a garbled frame
+    :param rng: random.Random instance
+    """
+
+    def __init__(self, meters, binary=False, dropout=0.0, burst=1, garble=0.0, rng=None):
+        """Frames of many virtual meters."""
+        self.meters = meters
+        self.binary = binary
+        self.dropout = dropout
+        self.burst = max(burst, 1)
+        self.garble = garble
+        self.rng = rng or random.Random(1)
+        self._dropped = [0] * len(meters)  # remaining frames of the current drop-out
+        self.n_frames = 0
+        self.n_dropped = 0
+        self.n_garbled = 0
+
+    def frame(self, index):
+        """Advance a meter by one second, return its frame as bytes, None if dropped."""
+        meter = self.meters[index]
+        meter.step()
+        if self._dropped[index] or (self.dropout and self.rng.random() < self.dropout):
+            if not self._dropped[index]:
+                self._dropped[index] = self.rng.randint(1, self.burst)
+            self._dropped[index] -= 1
+            self.n_dropped += 1
+            return None
+        self.n_frames += 1
+        garble = self.garble and self.rng.random() < self.garble
+        if garble:
+            self.n_garbled += 1
+        if self.binary:
+            data = meter.binary_frame(self.n_frames * 3 % 100000)
+            if garble:
+                # corrupt a byte of the payload, i.e. the CRC does not match
+                position = self.rng.randrange(8, len(data) - 8)
+                data = data[:position] + bytes([data[position] ^ 0xff]) + data[position + 1:]
+            return data
+        lines = meter.text_frame()
+        if garble:
+            # truncate a value line, e.g. '1-0:1.8.0*255#1989', i.e. not parseable
+            position = self.rng.randrange(2, len(lines))
+            line = lines[position]
+            lines[position] = line[:line.index('#') + 1 + self.rng.randrange(0, 4)]
+        return ('\n'.join(lines) + '\n').encode()
+
+    def run(self, outputs, rate=1.0, n_frames=0):
+        """Write frames to the outputs (one per meter, or one for all).
+
+        :param outputs: list of binary file objects
+        :param rate: frames per second per meter, 0 for as fast as possible
+        :param n_frames: frames per meter, 0 for endless
+        """
+        interval = 1.0 / rate if rate > 0 else 0.0
+        start = time.monotonic()
+        count = 0
+        while not n_frames or count < n_frames:
+            for index in range(len(self.meters)):
+                data = self.frame(index)
+                if data is not None:
+                    outputs[index % len(outputs)].write(data)
+            count += 1
+            for output in outputs:
+                output.flush()
+            if interval:
+                delay = start + count * interval - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+
+
+def main(argv=None):
+    """Run the load generator.
+
+    :return: exit/return code
+    """
+    arguments = docopt(__doc__, argv=argv)
+    n_meters = int(arguments['--meters'])
+    profiles = [name.strip() for name in arguments['--profile'].split(',') if name.strip()]
+    if arguments['--format'] not in ('text', 'binary'):
+        print("Unknown format '%s'! (valid: text, binary)" % arguments['--format'], file=sys.stderr)
+        return 2
+    rng = random.Random(int(arguments['--seed']))
+    noise = float(arguments['--noise'])
+    try:
+        meters = [VirtualMeter(profiles[i % len(profiles)], i, random.Random(rng.random()), noise)
+                  for i in range(n_meters)]
+    except ValueError as ex:
+        print(ex, file=sys.stderr)
+        return 2
+    generator = LoadGenerator(meters, binary=arguments['--format'] == 'binary',
+                              dropout=float(arguments['--dropout']), burst=int(arguments['--burst']),
+                              garble=float(arguments['--garble']), rng=rng)
+    spec = arguments['<output>'] or '-'
+    if '{meter}' in spec:
+        outputs = [open_output(spec.replace('{meter}', str(i))) for i in range(n_meters)]
+    else:
+        outputs = [open_output(spec)]
+    try:
+        generator.run(outputs, rate=float(arguments['--rate']), n_frames=int(arguments['--frames']))
+    except (BrokenPipeError, KeyboardInterrupt):
+        pass
+    finally:
+        print("frames: %d, dropped: %d, garbled: %d"
+              % (generator.n_frames, generator.n_dropped, generator.n_garbled), file=sys.stderr)
+        for output in outputs:
+            if output is not sys.stdout.buffer:
+                try:
+                    output.close()
+                except BrokenPipeError:
+                    pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,90 +1,521 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 """MQTT publishing."""
-import json
 import logging
+import select
+import socket
 import statistics
+import threading
 import time
+from collections import deque
+from contextlib import contextmanager
 
 from paho.mqtt import client as mqtt_client
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
+
+from smlmqttprocessor.aio import AsyncioMqttAdapter
+from smlmqttprocessor.daily import DAILY_STATS
+from smlmqttprocessor.payload import PayloadEncoder
+from smlmqttprocessor.utils.metrics import OUTAGE_BUCKETS, Histogram
+
+# MQTT v5 CONNACK reason code, also reported by paho for a v3 "unacceptable protocol version"
+UNSUPPORTED_PROTOCOL_VERSION = 132
+
+
+class CoalescingClient(mqtt_client.Client):
+    """paho MQTT client which can hold back socket writes and flush them at once.
+
+    While corked, all packets written by paho's network thread are buffered.
+    uncork() writes the buffer with as few socket writes (syscalls) as possible,
+    for max. flush_timeout seconds: if the server does not read (anymore), the
+    connection is shut down and paho reconnects. The buffer is written without
+    holding the lock, packets written by the network thread (e.g. the event
+    loop, see AsyncioMqttAdapter) meanwhile are buffered and flushed, too.
+    """
+
+    def __init__(self, *args, **kwargs):
+        """Create a paho MQTT client which can hold back socket writes and flush them at once."""
+        super().__init__(*args, **kwargs)
+        self._cork_cond = threading.Condition()
+        self._cork_depth = 0
+        self._cork_buffer = []
+        self._flushing = False
+        self.n_socket_writes = 0
+        self.flush_timeout = 10.0
+
+    def cork(self):
+        """Start holding back socket writes."""
+        with self._cork_cond:
+            self._cork_depth += 1
+
+    def uncork(self, timeout=0.1):
+        """Stop holding back socket writes and flush the buffer.
+
+        :param timeout: max. time to wait for the network thread to hand over queued packets
+        """
+        with self._cork_cond:
+            if self._cork_depth > 1:
+                self._cork_depth -= 1
+                return
+            # packets are written by the network thread, wait until all are buffered
+            self._cork_cond.wait_for(lambda: not self._out_packet, timeout=timeout)
+            self._cork_depth = 0
+            if self._flushing:
+                # the running flush writes this buffer, too
+                return
+            self._flushing = True
+        try:
+            while True:
+                with self._cork_cond:
+                    data = b''.join(self._cork_buffer)
+                    self._cork_buffer = []
+                    if not data:
+                        return
+                if not self._send_all(data):
+                    with self._cork_cond:
+                        # the connection is lost, so are the packets buffered meanwhile
+                        self._cork_buffer = []
+                    return
+        finally:
+            with self._cork_cond:
+                self._flushing = False
+
+    def _send_all(self, data):
+        """Write all data to the socket, return False if failed."""
+        view = memoryview(data)
+        deadline = time.monotonic() + self.flush_timeout
+        while view:
+            try:
+                written = super()._sock_send(view)
+                self.n_socket_writes += 1
+                view = view[written:]
+            except BlockingIOError:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    # not to block publishing forever, the rest of a
+                    # partially written packet would corrupt the stream: reconnect
+                    logging.error("MQTT flush timed out after %.1f s, %d bytes dropped, disconnecting!",
+                                  self.flush_timeout, len(view))
+                    self._shutdown_socket()
+                    return False
+                select.select([], [self._sock], [], min(remaining, 1.0))
+            except (AttributeError, OSError) as ex:
+                # no socket (anymore), QoS>0 messages are retried after reconnect
+                logging.warning("MQTT flush failed, %d bytes dropped! %s", len(view), ex)
+                return False
+        return True
+
+    def _shutdown_socket(self):
+        """Shut down the connection, the network loop notices it and reconnects."""
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except (AttributeError, OSError):
+            pass
+
+    def _sock_send(self, buf):
+        with self._cork_cond:
+            if self._cork_depth or self._flushing:
+                # (while flushing: after the flushed data, never in between)
+                self._cork_buffer.append(bytes(buf))
+                return len(buf)
+            self.n_socket_writes += 1
+            return super()._sock_send(buf)
+
+    def _packet_write(self):
+        result = super()._packet_write()
+        with self._cork_cond:
+            self._cork_cond.notify_all()
+        return result
 
 
 class MyMqtt:
     """MQTT publishing."""
 
-    def __init__(self, config):
+    def __init__(self, config, field_names=None, loop=None):
         """MQTT publishing.
 
         :param config: ConfigParser object, e.g. from config.ini
+        :param field_names: ordered SML field names (for the 'struct' payload codec)
+        :param loop: asyncio event loop for the network I/O, default paho's own thread
         """
         self.client = None
         self.config = config
+        self.loop = loop
+        self._adapter = None  # AsyncioMqttAdapter if loop is given
         self.connected = False
+        # MQTT protocol version, "5" enables topic aliases and message expiry
+        protocol = config.get('Mqtt', 'protocol', fallback='3.1.1')
+        self.protocol = mqtt_client.MQTTv5 if protocol in ('5', '5.0') else mqtt_client.MQTTv311
+        # MQTT v5 topic aliases: topic --> alias, only valid for the current connection
+        self.topic_aliases = {}
+        self.topic_alias_maximum = 0  # negotiated with the server on connect
+        # MQTT v5 message expiry interval in seconds, 0 to disable
+        self.message_expiry = config.getint('Mqtt', 'message_expiry', fallback=0)
+        # payload encoding for single-topic sending
+        self.encoder = PayloadEncoder(config.get('Mqtt', 'payload_codec', fallback='json'),
+                                      field_names)
+        # QoS per topic class: totals (total* fields, single topic) and stats (all others)
+        qos = config.getint('Mqtt', 'qos', fallback=0)
+        self.qos_totals = config.getint('Mqtt', 'qos_totals', fallback=qos)
+        self.qos_stats = config.getint('Mqtt', 'qos_stats', fallback=qos)
+        # in-flight window: max. number of unacknowledged QoS>0 messages before publish() blocks
+        self.max_inflight = config.getint('Mqtt', 'max_inflight', fallback=20)
+        self.inflight_timeout = config.getfloat('Mqtt', 'inflight_timeout', fallback=10.0)
+        # unacknowledged QoS>0 messages: (client, mid) --> (publish timestamp, topic, payload, qos, retain)
+        self.inflight = {}
+        # QoS 0 messages not yet written to the socket: (client, mid) --> publish timestamp
+        self._unwritten = {}
+        self._early_acks = set()
+        # (client, mid) --> WindowTrace of in-flight messages of traced windows
+        self._traces = {}
+        # embed the window's trace timestamps in the single-topic payload
+        self.trace_payload = config.getboolean('Mqtt', 'trace_payload', fallback=False)
+        self._inflight_cond = threading.Condition(threading.RLock())
+        # publish-to-ack latency (QoS 0: until written to the socket)
+        self.publish_latency = Histogram()
+        self.n_retried = 0
+        # coalesce all topics of one window into as few socket writes as possible
+        self.coalesce = config.getboolean('Mqtt', 'coalesce', fallback=True)
+        self._batch_depth = 0
+        # persistent session: stable client id, the server keeps subscriptions and
+        # QoS>0 messages across reconnects
+        self.client_id = config.get('Mqtt', 'client_id', fallback='SmlTextMqttProcessor')
+        self.clean_session = config.getboolean('Mqtt', 'clean_session', fallback=False)
+        self.session_expiry = config.getint('Mqtt', 'session_expiry', fallback=3600)  # MQTT v5
+        # publishes while (re)connecting are queued (oldest dropped if full), not blocking
+        self.pending = deque(maxlen=config.getint('Mqtt', 'max_queued', fallback=1000))
+        self._pending_lock = threading.Lock()
+        self.n_queued = 0
+        self.n_queue_dropped = 0
+        # reconnect metrics: handshake time (socket open --> CONNACK) and
+        # outage duration (connection lost --> CONNACK)
+        self.reconnect_time = Histogram()
+        self.outage_duration = Histogram(OUTAGE_BUCKETS)
+        self.n_reconnects = 0
+        self.disconnected_since = None  # time.monotonic() of connection loss
+        self._connect_started = None
+        self._client_protocol = None  # protocol of the current client
 
     def connect(self):
-        """Connect to MQTT server and handle disconnection/reconnection events."""
+        """Connect to MQTT server, without blocking.
+
+        Connecting and reconnecting (with exponential backoff) is done by paho's
+        network thread in the background. Publishes are queued meanwhile.
+        """
+        if self.client and self._client_protocol == self.protocol:
+            # network thread is running, it reconnects on its own
+            return
+
         # noinspection PyUnusedLocal,PyShadowingNames
         # pylint: disable=invalid-name,unused-argument
-        def on_connect(client, userdata, flags, rc):
-            logging.info("MQTT connect: %s (%d)", mqtt_client.connack_string(rc), rc)
-            self.connected = True
+        def on_connect(client, userdata, flags, rc, properties=None):
+            if self.protocol != mqtt_client.MQTTv5:
+                logging.info("MQTT connect: %s (%d)", mqtt_client.connack_string(rc), rc)
+                if rc == mqtt_client.CONNACK_ACCEPTED:
+                    self._on_connected(client)
+                return
+            logging.info("MQTT v5 connect: %s", rc)
+            if rc == UNSUPPORTED_PROTOCOL_VERSION:
+                # server does not speak MQTT v5, next connect() uses 3.1.1
+                logging.warning("MQTT v5 not supported by server, falling back to 3.1.1!")
+                self.protocol = mqtt_client.MQTTv311
+                client.disconnect()
+                return
+            if rc.value >= 0x80:
+                # connection refused, e.g. not authorized
+                return
+            # topic aliases are per connection, start over
+            self._unalias_out_messages(client)
+            self.topic_aliases = {}
+            server_maximum = getattr(properties, 'TopicAliasMaximum', 0)
+            self.topic_alias_maximum = min(server_maximum, self.config.getint(
+                'Mqtt', 'topic_alias_maximum', fallback=server_maximum))
+            logging.debug("MQTT v5 topic alias maximum: %d", self.topic_alias_maximum)
+            self._on_connected(client)
 
         # noinspection PyUnusedLocal,PyShadowingNames
         # pylint: disable=invalid-name,unused-argument
-        def on_disconnect(client, userdata, rc):
+        def on_disconnect(client, userdata, rc, properties=None):
             self.connected = False
             if rc == mqtt_client.MQTT_ERR_SUCCESS:
                 logging.info('MQTT disconnect: successful.')
+                return
+            if self.disconnected_since is None:
+                self.disconnected_since = time.monotonic()
+            if self.protocol == mqtt_client.MQTTv5:
+                logging.warning("MQTT unexpected disconnection! %s", rc)
             else:
                 logging.warning("MQTT unexpected disconnection! %s (%d)",
                                 mqtt_client.error_string(rc), rc)
 
-        ##
-        # NOTE!
-        # Creating a new Client() seems to be necessary.
-        # Just using reconnect() or connect() again did not work.
-        ##
-        client = mqtt_client.Client("SmlTextMqttProcessor")
+        # noinspection PyUnusedLocal
+        def on_socket_open(client, userdata, sock):  # pylint: disable=unused-argument
+            self._connect_started = time.monotonic()
+
+        if self.client:
+            # left-over client, e.g. after a protocol fallback or explicit disconnect(),
+            # its unacknowledged messages are re-published by the new client
+            if self._adapter:
+                self._adapter.stop()
+            self.client.disconnect()
+            self.client.loop_stop()
+        if self.protocol == mqtt_client.MQTTv5:
+            # MQTT v5 has clean_start (on connect) and session expiry instead of clean_session
+            client = CoalescingClient(self.client_id, protocol=self.protocol)
+        else:
+            client = CoalescingClient(self.client_id, clean_session=self.clean_session,
+                                      protocol=self.protocol)
+        client.flush_timeout = self.config.getfloat('Mqtt', 'flush_timeout', fallback=10.0)
 
         # store as class variable to be accessible later
         self.client = client
+        self._client_protocol = self.protocol
 
         if self.config.has_option('Mqtt', 'username'):
             client.username_pw_set(self.config.get('Mqtt', 'username'),
                                    password=self.config.get('Mqtt', 'password'))
         client.reconnect_delay_set(min_delay=1, max_delay=120)
+        client.max_inflight_messages_set(self.max_inflight)
         client.on_connect = on_connect
         client.on_disconnect = on_disconnect
+        client.on_publish = self._on_publish
+        client.on_socket_open = on_socket_open
 
         host = self.config.get('Mqtt', 'host', fallback='localhost')
         port = self.config.getint('Mqtt', 'port', fallback=1883)
+        kwargs = {}
+        if self.protocol == mqtt_client.MQTTv5:
+            kwargs['clean_start'] = self.clean_session
+            kwargs['properties'] = Properties(PacketTypes.CONNECT)
+            kwargs['properties'].SessionExpiryInterval = self.session_expiry
+        if self.disconnected_since is None:
+            self.disconnected_since = time.monotonic()
+        # connect (and reconnect) in the asyncio event loop or in paho's network thread (loop_start)
+        client.connect_async(host, port=port, **kwargs)
+        if self.loop:
+            self._adapter = AsyncioMqttAdapter(client, self.loop)
+        else:
+            client.loop_start()
 
-        # try-to-connect loop
-        wait_time = 1
-        while not self.connected:
-            try:
-                client.connect(host, port=port)
-                # loop_start() is necessary for on_* to work
-                # (asynchronous handling starts)
-                client.loop_start()
-                break
-            except Exception as ex:
-                logging.error("MQTT connect exception! %s: %s", type(ex).__name__, ex)
-                # increase waiting time
-                wait_time *= 2
-                # limit waiting time to max. 180 sec = 3 min
-                wait_effective = min(wait_time, 180)
-                logging.debug("waiting %d seconds before reconnect attempt...",
-                              wait_effective)
-                time.sleep(wait_effective)
+    def _on_connected(self, client):
+        """Handle an accepted (re)connect: metrics, flush the queue, retries."""
+        now = time.monotonic()
+        if self._connect_started is not None:
+            self.reconnect_time.observe(now - self._connect_started)
+        if self.disconnected_since is not None:
+            outage = now - self.disconnected_since
+            self.outage_duration.observe(outage)
+            self.disconnected_since = None
+            if self.n_reconnects or outage > 1:
+                logging.info("MQTT (re)connected after %.1f seconds", outage)
+        self.n_reconnects += 1
+        self._retry_inflight(client)
+        with self._pending_lock:
+            # publish queued messages before new ones, in order
+            while self.pending:
+                topic, payload, retain, qos = self.pending.popleft()
+                self._publish(client, topic, payload, retain, qos)
+            self.connected = True
+
+    def publish(self, topic, payload, retain=False, qos=0, trace=None):
+        """Publish a single message, using MQTT v5 features if available.
+
+        With MQTT v5 a topic alias is assigned on first use of a topic (as long
+        as the server's topic alias maximum allows), and afterwards only the
+        2-byte alias is sent instead of the full topic string.
+
+        For QoS>0 the message is tracked until acknowledged. If the in-flight
+        window is full, this blocks (backpressure) until there is room again
+        or inflight_timeout is hit.
+
+        While not connected the message is queued (never blocks) and published
+        after the (re)connect.
+
+        :param topic: MQTT topic
+        :param payload: MQTT payload
+        :param retain: MQTT retain flag
+        :param qos: MQTT QoS level
+        :param trace: optional WindowTrace of the message's window, counts its acknowledgement
+        :return: paho's MQTTMessageInfo, None if queued
+        """
+        if not self.connected:
+            with self._pending_lock:
+                if not self.connected:
+                    self._queue(topic, payload, retain, qos)
+                    return None
+        if qos and not (self._adapter and self._adapter.in_loop_thread()):
+            # (the event loop must not block, it handles the acknowledgements)
+            if self._batch_depth and len(self.inflight) >= self.max_inflight:
+                # in-flight messages might still be held back by the batch, flush them
+                # (not while holding the lock, the network thread needs it for on_publish)
+                self.client.uncork()
+                self.client.cork()
+            with self._inflight_cond:
+                if not self._inflight_cond.wait_for(lambda: len(self.inflight) < self.max_inflight,
+                                                    timeout=self.inflight_timeout):
+                    logging.warning("MQTT in-flight window full (%d), publishing anyway!",
+                                    len(self.inflight))
+        return self._publish(self.client, topic, payload, retain, qos, trace)
+
+    @contextmanager
+    def batch(self):
+        """Coalesce all publishes within this context into as few socket writes as possible.
+
+        Usage:
+            with mymqtt.batch():
+                mymqtt.publish(...)
+                mymqtt.publish(...)
+        """
+        client = self.client
+        if not isinstance(client, CoalescingClient):
+            # e.g. not connected yet
+            yield self
+            return
+        client.cork()
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            client.uncork()
+
+    def _queue(self, topic, payload, retain, qos):
+        """Queue a message until (re)connected, drop the oldest if the queue is full."""
+        if len(self.pending) == self.pending.maxlen:
+            self.n_queue_dropped += 1
+            if self.n_queue_dropped == 1 or self.n_queue_dropped % 100 == 0:
+                logging.warning("MQTT not connected, queue full, dropped oldest (#%d dropped)",
+                                self.n_queue_dropped)
+        self.pending.append((topic, payload, retain, qos))
+        self.n_queued += 1
+
+    def _publish(self, client, topic, payload, retain, qos, trace=None):
+        kwargs = {'retain': retain}
+        if qos:
+            kwargs['qos'] = qos
+        wire_topic = topic
+        if self.protocol == mqtt_client.MQTTv5:
+            wire_topic, kwargs['properties'] = self._publish_properties(topic)
+        # NOTE: paho calls on_publish while holding its own locks,
+        # hence do not hold self._inflight_cond while calling into paho
+        start = time.monotonic()
+        info = client.publish(wire_topic, payload, **kwargs)
+        if info is None or not (qos or info.rc == mqtt_client.MQTT_ERR_SUCCESS):
+            return info
+        key = (client, info.mid)
+        with self._inflight_cond:
+            if key in self._early_acks:
+                # already acknowledged before we got here
+                self._early_acks.discard(key)
+                self.publish_latency.observe(time.monotonic() - start)
+            else:
+                if qos:
+                    # track it, also if not connected (retried after reconnect)
+                    self.inflight[key] = (start, topic, payload, qos, retain)
+                else:
+                    # only for the latency and the trace, no backpressure
+                    self._unwritten[key] = start
+                if trace:
+                    trace.n_pending += 1
+                    self._traces[key] = trace
+            if trace:
+                trace.n_sent += 1
+        return info
+
+    def _publish_properties(self, topic):
+        """Return (topic to send, MQTT v5 publish properties)."""
+        properties = Properties(PacketTypes.PUBLISH)
+        if self.message_expiry > 0:
+            # let the server drop the message if not delivered within this period
+            properties.MessageExpiryInterval = self.message_expiry
+        alias = self.topic_aliases.get(topic)
+        if alias:
+            # alias is known to the server, send an empty topic
+            properties.TopicAlias = alias
+            topic = ""
+        elif len(self.topic_aliases) < self.topic_alias_maximum:
+            # first use, send topic and alias to establish the mapping
+            alias = len(self.topic_aliases) + 1
+            self.topic_aliases[topic] = alias
+            properties.TopicAlias = alias
+        return topic, properties
+
+    def _unalias_out_messages(self, client):
+        """Replace the topic aliases of the client's unacknowledged messages by their topics.
+
+        paho re-sends the unacknowledged QoS>0 messages after a reconnect as they
+        are, but the aliases of the previous connection are unknown to the server.
+        """
+        topics = {alias: topic for topic, alias in self.topic_aliases.items()}
+        # pylint: disable=protected-access
+        with client._out_message_mutex:
+            for message in client._out_messages.values():
+                alias = getattr(message.properties, 'TopicAlias', None)
+                if alias is None:
+                    continue
+                if not message.topic:
+                    message.topic = topics[alias].encode('utf-8')
+                delattr(message.properties, 'TopicAlias')
+
+    # noinspection PyUnusedLocal
+    def _on_publish(self, client, userdata, mid):  # pylint: disable=unused-argument
+        """Handle paho's on_publish, i.e. the message has been acknowledged (or sent for QoS 0)."""
+        with self._inflight_cond:
+            entry = self.inflight.pop((client, mid), None)
+            start = entry[0] if entry else self._unwritten.pop((client, mid), None)
+            if start is not None:
+                now = time.monotonic()
+                self.publish_latency.observe(now - start)
+                trace = self._traces.pop((client, mid), None)
+                if trace:
+                    trace.n_pending -= 1
+                    if not trace.n_pending and trace.published is not None:
+                        # last message of the window
+                        trace.acked = now
+                        trace.complete()
+                self._inflight_cond.notify_all()
+            else:
+                self._early_acks.add((client, mid))
+
+    def _retry_inflight(self, client):
+        """Re-publish unacknowledged QoS>0 messages of previous clients.
+
+        Unacknowledged messages of the current client are re-sent by paho itself.
+        """
+        with self._inflight_cond:
+            # re-sent by paho (with the DUP flag)
+            self.n_retried += sum(1 for key in self.inflight if key[0] is client)
+            pending = [(key, entry) for key, entry in self.inflight.items() if key[0] is not client]
+            self.inflight = {key: entry for key, entry in self.inflight.items() if key[0] is client}
+            # QoS 0 messages of previous clients are lost, stop tracking them
+            self._unwritten = {key: start for key, start in self._unwritten.items() if key[0] is client}
+            self._early_acks = {key for key in self._early_acks if key[0] is client}
+            # windows with lost (QoS 0) messages are never complete
+            traces = self._traces
+            self._traces = {key: trace for key, trace in traces.items() if key[0] is client}
+            pending = [(entry, traces.get(key)) for key, entry in pending]
+            for _, trace in pending:
+                if trace:
+                    trace.n_pending -= 1  # counted again when re-published
+            self.n_retried += len(pending)
+            self._inflight_cond.notify_all()
+        for (_, topic, payload, qos, retain), trace in pending:
+            self._publish(client, topic, payload, retain, qos, trace)
+        if pending:
+            logging.info("MQTT re-published #%d unacknowledged messages", len(pending))
 
     def disconnect(self):
         """Disconnect from MQTT server."""
+        if self._adapter:
+            self._adapter.stop()
         self.client.disconnect()
         self.connected = False
+        # a later connect() creates a new client
+        self._client_protocol = None
 
     @staticmethod
-    def construct_mqttdata(field2values):
+    def construct_mqttdata(field2values, value_only=False):
         """Construct a 2-dimensional dictionary fieldname-->value-type-->value.
 
         Example:
@@ -92,8 +523,11 @@ class MyMqtt:
            result['tptal']['mean'] := mean(collected-values)
 
         :param field2values: collected data, dictionary: fieldname --> [data points]
+        :param value_only: only the value (last data point) of each field, no statistics (overload)
         :return: 2-dim dictionary fieldname --> value-type --> value
         """
+        if value_only:
+            return {name: {'value': values[-1]} for name, values in field2values.items() if values}
         result = {}
         # special handling for time field
         if 'time' in field2values:
@@ -123,7 +557,8 @@ class MyMqtt:
             result[name]['mean'] = round(statistics.mean(values), 1)
             result[name]['min'] = min(values)
             result[name]['max'] = max(values)
-            result[name]['stdev'] = round(statistics.stdev(values), 1)
+            # stdev needs at least 2 values, e.g. a field seen only once in the last window
+            result[name]['stdev'] = round(statistics.stdev(values), 1) if len(values) > 1 else 0.0
         return result
 
     def send(self, field2values):
@@ -132,35 +567,73 @@ class MyMqtt:
         :param field2values: collected data, dictionary: fieldname --> [data points]
         :return: Nothing
         """
+        # construct 2-dim dictionary fieldname --> value-type --> value
+        self.send_mqttdata(self.construct_mqttdata(field2values))
+
+    def send_mqttdata(self, mqttdata, trace=None, topic_prefix=None):
+        """Publish (send) already aggregated data to MQTT.
+
+        :param mqttdata: 2-dim dictionary fieldname --> value-type --> value
+        :param trace: optional WindowTrace, gets the publish and acknowledgement times
+        :param topic_prefix: topic prefix, default the configured one (e.g. per meter, see sharding)
+        :return: Nothing
+        """
         if not self.connected:
             self.connect()
 
-        topic_prefix = self.config.get('Mqtt', 'topic_prefix', fallback='tele/smartmeter')
-        single = self.config.getboolean('Mqtt', 'single_topic', fallback='false')
-        retain = self.config.getboolean('Mqtt', 'retain', fallback='false')
-
-        # construct 2-dim dictionary fieldname --> value-type --> value
-        mqttdata = self.construct_mqttdata(field2values)
+        if topic_prefix is None:
+            topic_prefix = self.config.get('Mqtt', 'topic_prefix', fallback='tele/smartmeter')
+        single = self.config.getboolean('Mqtt', 'single_topic', fallback=False)
+        retain = self.config.getboolean('Mqtt', 'retain', fallback=False)
 
         if single:
-            # single-topic sending, i.e. everything as one single topic and JSON payload
-            self.client.publish(topic_prefix, json.dumps(mqttdata), retain=retain)
+            # single-topic sending, i.e. everything as one single topic and one payload
+            # (JSON by default, see payload_codec)
+            if trace and self.trace_payload:
+                # copy, the other sinks get the same mqttdata
+                mqttdata = dict(mqttdata, trace=trace.to_payload())
+            self.publish(topic_prefix, self.encoder.encode(mqttdata), retain=retain,
+                         qos=self.qos_totals, trace=trace)
         else:
             # multi-topic sending, i.e. each data entry as one unique topic, multiple messages
-            for name, subname_value in mqttdata.items():
+            if self.coalesce:
+                with self.batch():
+                    self._send_multi(mqttdata, topic_prefix, retain, trace)
+            else:
+                self._send_multi(mqttdata, topic_prefix, retain, trace)
+        if trace:
+            self._trace_published(trace)
+
+    def _trace_published(self, trace):
+        """Record the end of publishing a window, complete its trace if all messages are acknowledged."""
+        with self._inflight_cond:
+            trace.published = time.monotonic()
+            if not trace.n_pending:
+                if trace.n_sent:
+                    # all acknowledged already (or QoS 0, written to the socket)
+                    trace.acked = trace.published
+                trace.complete()
+
+    def _send_multi(self, mqttdata, topic_prefix, retain, trace=None):
+        """Publish each data entry as one unique topic."""
+        for name, subname_value in mqttdata.items():
+            # name = e.g. total / actual
+            # subname_value = dict e.g. {"first": 123) / {"mean": 56.5} / ...
+            for subname, value in subname_value.items():
                 # name = e.g. total / actual
-                # subname_value = dict e.g. {"first": 123) / {"mean": 56.5} / ...
-                for subname, value in subname_value.items():
-                    # name = e.g. total / actual
-                    # subname = e.g. value / min / max / first / last / ...
-
-                    # by default do not set the MQTT retain flag but only for specific fields
-                    myretain = False
-                    if retain and name in ('total', 'time') and subname == 'value':
-                        # only retain for .../total/value and .../time/value
-                        myretain = True
-
-                    # construct topic, e.g., 'tele/smartmeter/time/value'
-                    topic = "%s/%s/%s" % (topic_prefix, name, subname)  # pylint: disable=consider-using-f-string
-                    # MQTT publish
-                    self.client.publish(topic, value, retain=myretain)
+                # subname = e.g. value / min / max / first / last / ...
+
+                # by default do not set the MQTT retain flag but only for specific fields
+                myretain = False
+                if retain and name in ('total', 'time') and subname == 'value':
+                    # only retain for .../total/value and .../time/value
+                    myretain = True
+                elif retain and subname in DAILY_STATS:
+                    # and the in-process daily values, e.g. .../total/d0
+                    myretain = True
+
+                # construct topic, e.g., 'tele/smartmeter/time/value'
+                topic = "%s/%s/%s" % (topic_prefix, name, subname)  # pylint: disable=consider-using-f-string
+                # MQTT publish
+                qos = self.qos_totals if name.startswith('total') else self.qos_stats
+                self.publish(topic, value, retain=myretain, qos=qos, trace=trace)
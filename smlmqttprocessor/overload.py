@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Overload handling: shed load while the processing lags behind the meter (section [Overload]).
+
+The lag is the larger one of
+- input: how far the reading of the frames lags behind the meter, from the
+  meter's sensor time (act_sensor_time) against the local monotonic clock,
+  relative to the smallest offset seen (i.e. the processing kept up then);
+  e.g. the aggregation cannot keep up and the pipe from sml_server_time fills
+- sinks: the age of the oldest window waiting for a sink, e.g. a slow MQTT broker
+Above lag_threshold seconds the configured policies are active, until the
+lag is below half of it again:
+- value_only: publish only the value of each field, skip the statistics
+- merge: merge up to merge_windows consecutive windows into one, i.e. fewer
+  aggregations and fewer MQTT messages
+- drop_frames: of each keep_every frames only one is kept completely, only
+  the counters (totals, i.e. cumulative) and sensor time of the others, so
+  the totals and d0/d1 stay exact while e.g. the power statistics get fewer samples
+"""
+import logging
+import time
+
+from smlmqttprocessor.tracing import Window
+
+# pylint: disable=consider-using-f-string
+
+OVERLOAD_POLICIES = ('value_only', 'merge', 'drop_frames')
+
+
+class LagEstimator:
+    """Lag of reading the frames behind the meter, from the meter's sensor time.
+
+    The offset local monotonic time - sensor time is smallest for frames read
+    as soon as they were written; the lag of a frame is its offset minus the
+    smallest one. The baseline follows the offset slowly (drift seconds per
+    second), i.e. a meter clock running slower than the local one does not
+    accumulate to a lag. A sensor time going backwards (meter restart) resets it.
+
+    :param drift: max. clock drift, seconds per second
+    """
+
+    def __init__(self, drift=0.001):
+        """Lag of reading the frames behind the meter."""
+        self.drift = drift
+        self.lag = 0.0
+        self._baseline = None
+        self._sensor_time = None
+        self._updated = None
+
+    def update(self, sensor_time, now=None):
+        """Add the sensor time of a frame just read, return the lag (seconds).
+
+        :param sensor_time: meter's sensor time (seconds)
+        :param now: monotonic time the frame was read, default now
+        """
+        now = time.monotonic() if now is None else now
+        offset = now - sensor_time
+        if self._baseline is None or sensor_time < self._sensor_time:
+            self._baseline = offset
+        else:
+            self._baseline = min(offset, self._baseline + self.drift * (now - self._updated))
+        self._sensor_time = sensor_time
+        self._updated = now
+        self.lag = offset - self._baseline
+        return self.lag
+
+
+class OverloadPolicy:
+    """Shed load while the lag is above the threshold, see the module's description.
+
+    Shared by a meter's WindowCollector (input lag, drop_frames) and FanOut (sink lag, merge, value_only).
+
+    :param threshold: lag (seconds) above which the policies are active, inactive again below half of it
+    :param policies: active policies, subset of OVERLOAD_POLICIES
+    :param merge_windows: max. number of consecutive windows merged into one (merge)
+    :param keep_every: keep every n-th frame completely, only the counters of the others (drop_frames)
+    """
+
+    def __init__(self, threshold, policies=OVERLOAD_POLICIES, merge_windows=4, keep_every=4):
+        """Shed load while the lag is above the threshold."""
+        unknown = set(policies).difference(OVERLOAD_POLICIES)
+        if unknown:
+            raise ValueError("Unknown overload policies '%s'! (valid: %s)"
+                             % (", ".join(sorted(unknown)), ", ".join(OVERLOAD_POLICIES)))
+        self.threshold = threshold
+        self.policies = frozenset(policies)
+        self.merge_windows = max(1, merge_windows)
+        self.keep_every = max(1, keep_every)
+        self.input_lag = LagEstimator()
+        self.sink_lag = 0.0
+        self.active = False
+        self.n_activations = 0
+        # shed counts
+        self.n_frames_shed = 0
+        self.n_windows_merged = 0
+        self.n_windows_value_only = 0
+        self._n_frames = 0
+        self._held = None  # window(s) merged with the next one
+        self._n_held = 0
+
+    @property
+    def lag(self):
+        """Return the current lag in seconds, the larger one of input and sinks."""
+        return max(self.input_lag.lag, self.sink_lag)
+
+    def update_input(self, sensor_time, now=None):
+        """Add the meter's sensor time of a frame just read."""
+        self.input_lag.update(sensor_time, now)
+        self._check()
+
+    def update_sinks(self, lag):
+        """Set the age (seconds) of the oldest window waiting for a sink."""
+        self.sink_lag = lag
+        self._check()
+
+    def _check(self):
+        lag = self.lag
+        if not self.active and lag > self.threshold:
+            self.active = True
+            self.n_activations += 1
+            logging.warning("Overload: lag %.1f s above %.1f s, shedding load (%s)",
+                            lag, self.threshold, ", ".join(sorted(self.policies)))
+        elif self.active and lag < self.threshold / 2:
+            self.active = False
+            logging.warning("Overload ended: lag %.1f s (%s)", lag, self.summary())
+
+    @property
+    def value_only(self):
+        """Return True if only the values are to be published (value_only)."""
+        return self.active and 'value_only' in self.policies
+
+    def shed_frame(self):
+        """Return True if only the counters of the next frame are to be kept (drop_frames)."""
+        if not (self.active and 'drop_frames' in self.policies):
+            return False
+        self._n_frames += 1
+        if self._n_frames % self.keep_every == 0:
+            return False
+        self.n_frames_shed += 1
+        return True
+
+    def merge(self, messages):
+        """Return the window to handle, None while it is held back to be merged with the next one (merge).
+
+        :param messages: Window (or list of messages)
+        """
+        if self._held is not None:
+            merged = Window(self._held)
+            merged.extend(messages)
+            merged.first_read = getattr(self._held, 'first_read', None)
+            merged.last_read = getattr(messages, 'last_read', None)
+            messages = merged
+            self.n_windows_merged += 1
+            self._n_held += 1
+        else:
+            self._n_held = 1
+        self._held = None
+        if self.active and 'merge' in self.policies and self._n_held < self.merge_windows:
+            self._held = messages
+            return None
+        return messages
+
+    def flush(self):
+        """Return the held back window, None if none, e.g. at the end of the input."""
+        messages, self._held = self._held, None
+        return messages
+
+    def summary(self):
+        """Return the shed counts as text."""
+        return "shed: %d frames to counters, %d windows merged, %d windows value-only" % (
+            self.n_frames_shed, self.n_windows_merged, self.n_windows_value_only)
+
+
+def create_overload_policy(config):
+    """Create the OverloadPolicy according to the configuration, None if not enabled.
+
+    :param config: ConfigParser object, e.g. from config.ini
+    """
+    threshold = config.getfloat('Overload', 'lag_threshold', fallback=0)
+    if threshold <= 0:
+        return None
+    policies = [name.strip() for name in
+                config.get('Overload', 'policies', fallback=",".join(OVERLOAD_POLICIES)).split(',') if name.strip()]
+    return OverloadPolicy(threshold, policies,
+                          merge_windows=config.getint('Overload', 'merge_windows', fallback=4),
+                          keep_every=config.getint('Overload', 'keep_every', fallback=4))
@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Payload encodings (codecs) for single-topic MQTT sending.
+
+Besides the default JSON payload, the 2-dim dictionary
+fieldname --> value-type --> value (see MyMqtt.construct_mqttdata)
+can be encoded as MessagePack, CBOR or as a fixed-layout binary
+record (Python's struct) derived from the SML field profile.
+
+All binary payloads start with a small header:
+  magic (2 bytes, b'SM') | format version (1 byte) | codec id (1 byte) | schema id (2 bytes)
+JSON payloads have no header (backwards compatibility), they start with '{'.
+
+Use decode_payload() on the consumer side, or extract_fields() if only a
+few values are needed (e.g. total.value): it decodes only these fields.
+"""
+import json
+import struct
+import zlib
+from functools import lru_cache
+
+PAYLOAD_MAGIC = b'SM'
+PAYLOAD_VERSION = 1
+HEADER = struct.Struct("!2sBBH")
+
+CODEC_JSON = 'json'
+CODEC_MSGPACK = 'msgpack'
+CODEC_CBOR = 'cbor'
+CODEC_STRUCT = 'struct'
+CODEC_IDS = {CODEC_MSGPACK: 1, CODEC_CBOR: 2, CODEC_STRUCT: 3}
+
+# value-types (statistics) per field, cf. MyMqtt.construct_mqttdata
+STATS_SIMPLE = ('value', 'first', 'last')
+STATS_FULL = STATS_SIMPLE + ('median', 'mean', 'min', 'max', 'stdev')
+FIELDS_SIMPLE = ('time', 'total')
+NAN = float('nan')
+
+
+class StructSchema:
+    """Fixed binary layout for the struct codec, derived from the field names.
+
+    Layout: presence bitmap (uint32, bit i = field i present), followed by
+    the values (float64) of all value-types of each present field.
+    Note: integer values are decoded as float, missing value-types as NaN.
+    """
+
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, field_names):
+        """Derive the fixed binary layout for the struct codec.
+
+        :param field_names: ordered field names, e.g. list(SML_FIELDS)
+        """
+        if len(field_names) > 32:
+            raise ValueError("Too many fields for the struct codec (max. 32)!")
+        self.fields = tuple((name, STATS_SIMPLE if name in FIELDS_SIMPLE else STATS_FULL)
+                            for name in field_names)
+        layout = ";".join("%s:%s" % (name, ",".join(stats)) for name, stats in self.fields)
+        # schema id, to detect producer/consumer mismatches
+        self.schema_id = zlib.crc32(layout.encode()) & 0xFFFF
+        # pre-compiled struct per field (all value-types of one field)
+        self._structs = tuple(struct.Struct("!%dd" % len(stats)) for _, stats in self.fields)
+        self._index = {name: i for i, (name, _) in enumerate(self.fields)}
+
+    def pack(self, mqttdata):
+        """Pack the 2-dim dictionary to bytes."""
+        bitmap = 0
+        chunks = []
+        for i, (name, stats) in enumerate(self.fields):
+            values = mqttdata.get(name)
+            if not values:
+                continue
+            bitmap |= 1 << i
+            # value-types not in the window (e.g. value-only, see overload) as NaN
+            chunks.append(self._structs[i].pack(*(values.get(stat, NAN) for stat in stats)))
+        return struct.pack("!I", bitmap) + b''.join(chunks)
+
+    def unpack(self, data):
+        """Unpack bytes to the 2-dim dictionary."""
+        bitmap, = struct.unpack_from("!I", data)
+        pos = 4
+        result = {}
+        for i, (name, stats) in enumerate(self.fields):
+            if not bitmap & (1 << i):
+                continue
+            values = self._structs[i].unpack_from(data, pos)
+            pos += self._structs[i].size
+            result[name] = dict(zip(stats, values))
+        return result
+
+    def unpack_fields(self, data, names, stat='value'):
+        """Unpack one value-type of some fields only, skipping all others.
+
+        :return: dictionary fieldname --> value, missing fields are left out
+        """
+        bitmap, = struct.unpack_from("!I", data)
+        wanted = {self._index[name] for name in names if name in self._index}
+        pos = 4
+        result = {}
+        for i, (name, stats) in enumerate(self.fields):
+            if not wanted:
+                break
+            if not bitmap & (1 << i):
+                continue
+            if i in wanted:
+                wanted.discard(i)
+                if stat in stats:
+                    result[name] = struct.unpack_from("!d", data, pos + 8 * stats.index(stat))[0]
+            pos += self._structs[i].size
+        return result
+
+
+@lru_cache(maxsize=8)
+def _struct_schema(field_names):
+    """Return the (cached) StructSchema for a tuple of field names."""
+    return StructSchema(field_names)
+
+
+def _import_msgpack():
+    try:
+        # pylint: disable=import-outside-toplevel
+        import msgpack
+    except ImportError as ex:
+        raise RuntimeError("Payload codec 'msgpack' requires the msgpack package!") from ex
+    return msgpack
+
+
+def _import_cbor():
+    try:
+        # pylint: disable=import-outside-toplevel
+        import cbor2
+    except ImportError as ex:
+        raise RuntimeError("Payload codec 'cbor' requires the cbor2 package!") from ex
+    return cbor2
+
+
+class PayloadEncoder:
+    """Encode the 2-dim dictionary fieldname --> value-type --> value.
+
+    :param codec: one of 'json', 'msgpack', 'cbor', 'struct'
+    :param field_names: ordered field names, required for 'struct'
+    """
+
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, codec=CODEC_JSON, field_names=None):
+        """Encode the 2-dim dictionary fieldname --> value-type --> value."""
+        if codec != CODEC_JSON and codec not in CODEC_IDS:
+            raise ValueError("Unknown payload codec '%s'!" % codec)
+        self.codec = codec
+        schema_id = 0
+        if codec == CODEC_MSGPACK:
+            self._dumps = _import_msgpack().packb
+        elif codec == CODEC_CBOR:
+            self._dumps = _import_cbor().dumps
+        elif codec == CODEC_STRUCT:
+            if not field_names:
+                raise ValueError("Payload codec 'struct' requires the field names!")
+            schema = StructSchema(field_names)
+            schema_id = schema.schema_id
+            self._dumps = schema.pack
+        else:
+            self._dumps = json.dumps
+        self.header = b'' if codec == CODEC_JSON else \
+            HEADER.pack(PAYLOAD_MAGIC, PAYLOAD_VERSION, CODEC_IDS.get(codec, 0), schema_id)
+
+    def encode(self, mqttdata):
+        """Encode to the payload (str for JSON, bytes otherwise)."""
+        if self.codec == CODEC_JSON:
+            return self._dumps(mqttdata)
+        return self.header + self._dumps(mqttdata)
+
+
+def decode_payload(payload, field_names=None):
+    """Decode a single-topic payload, i.e. the consumer-side helper.
+
+    :param payload: MQTT payload (bytes or str)
+    :param field_names: ordered field names, required for the 'struct' codec
+    :return: 2-dim dictionary fieldname --> value-type --> value
+    """
+    if isinstance(payload, str):
+        payload = payload.encode()
+    if not payload.startswith(PAYLOAD_MAGIC):
+        return json.loads(payload)
+
+    _, version, codec_id, schema_id = HEADER.unpack_from(payload)
+    if version != PAYLOAD_VERSION:
+        raise ValueError("Unsupported payload format version %d!" % version)
+    body = payload[HEADER.size:]
+    if codec_id == CODEC_IDS[CODEC_MSGPACK]:
+        return _import_msgpack().unpackb(body)
+    if codec_id == CODEC_IDS[CODEC_CBOR]:
+        return _import_cbor().loads(body)
+    if codec_id == CODEC_IDS[CODEC_STRUCT]:
+        if not field_names:
+            raise ValueError("Payload codec 'struct' requires the field names!")
+        schema = _struct_schema(tuple(field_names))
+        if schema.schema_id != schema_id:
+            raise ValueError("Payload schema mismatch (%d != %d)!" % (schema_id, schema.schema_id))
+        return schema.unpack(body)
+    raise ValueError("Unknown payload codec id %d!" % codec_id)
+
+
+@lru_cache(maxsize=8)
+def _json_keys(names, stat):
+    """Return (fieldname, field key, value-type key) as written by json.dumps."""
+    stat_key = json.dumps(stat).encode() + b': '
+    return tuple((name, json.dumps(name).encode() + b': {', stat_key) for name in names)
+
+
+def _extract_json(payload, names, stat):
+    """Decode only the value-type of the fields, None if none of the fields is found.
+
+    The objects of the fields are flat, i.e. end with the next '}'.
+    """
+    result = None
+    for name, key, stat_key in _json_keys(names, stat):
+        start = payload.find(key)
+        if start < 0:
+            continue
+        if result is None:
+            result = {}
+        start += len(key) - 1
+        end = payload.index(b'}', start)
+        pos = payload.find(stat_key, start, end)
+        if pos >= 0:
+            pos += len(stat_key)
+            comma = payload.find(b',', pos, end)
+            try:
+                result[name] = float(payload[pos:end if comma < 0 else comma])
+                continue
+            except ValueError:
+                pass
+        # not a number or formatted differently: decode the field's object
+        values = json.loads(payload[start:end + 1])
+        if stat in values:
+            result[name] = values[stat]
+    return result
+
+
+def extract_fields(payload, names=('total',), stat='value', field_names=None):
+    """Extract one value-type of some fields from a single-topic payload (partial decode).
+
+    JSON payloads (as encoded by PayloadEncoder) are searched for the fields
+    and only their numbers are parsed (as float), a full decode is the fallback
+    (e.g. for compact JSON). Struct payloads only unpack these fields.
+    MessagePack and CBOR payloads are decoded completely.
+
+    :param payload: MQTT payload (bytes or str)
+    :param names: field names, e.g. ('total', 'total_tariff1')
+    :param stat: value-type, e.g. 'value'
+    :param field_names: ordered field names, required for the 'struct' codec
+    :return: dictionary fieldname --> value, missing fields are left out
+    """
+    if isinstance(payload, str):
+        payload = payload.encode()
+    names = tuple(names)
+    if not payload.startswith(PAYLOAD_MAGIC):
+        result = _extract_json(payload, names, stat)
+        if result is not None:
+            return result
+        mqttdata = json.loads(payload)
+    else:
+        _, version, codec_id, schema_id = HEADER.unpack_from(payload)
+        if field_names and version == PAYLOAD_VERSION and codec_id == CODEC_IDS[CODEC_STRUCT]:
+            schema = _struct_schema(tuple(field_names))
+            if schema.schema_id != schema_id:
+                raise ValueError("Payload schema mismatch (%d != %d)!" % (schema_id, schema.schema_id))
+            return schema.unpack_fields(payload[HEADER.size:], names, stat)
+        mqttdata = decode_payload(payload, field_names)
+    return {name: mqttdata[name][stat] for name in names
+            if name in mqttdata and stat in mqttdata[name]}
@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""sharding.py - Process many meters in several worker processes, publish over one MQTT connection.
+
+The meter inputs are hash-partitioned over N worker processes. Each worker
+parses and aggregates its meters' windows (like smltextmqttprocessor, incl.
+delta thresholds, window deadline, in-process d0/d1 and overload policies)
+and writes the aggregated windows into its own shared-memory ring buffer
+(see smlmqttprocessor.utils.shmring). This (main) process is the single
+publisher: it drains the rings and publishes each meter's windows as
+<topic_prefix>/<meter name>/..., over one MQTT connection.
+
+Usage:
+  sharding.py [options] [--config config.ini] <meter>...
+  sharding.py -h | --help
+
+Arguments:
+  meter           Meter input as [name=]input, input like smltextmqttprocessor's
+                  (file, FIFO, tcp:host:port, unix:path), default name meter<index>.
+
+Options:
+  --config <file> Configuration file [default: config.local.ini]
+  --no-mqtt       Do not send over MQTT (mainly for testing).
+  -n --workers=N  Number of worker processes (default: [Sharding] workers).
+  -q --quiet      Be quiet, show only errors.
+  -t --timeout=N  Timeout in seconds [default: 0].
+  -v --verbose    Verbose output (INFO level).
+  -w --window=N   Window size.
+  -h --help       Show this screen.
+
+Run it with:
+`python -m smlmqttprocessor.sharding -n 4 --config config.local.ini tcp:meter1:9000 tcp:meter2:9000 ...`
+"""
+import asyncio
+import configparser
+import io
+import logging
+import marshal
+import multiprocessing
+import re
+import struct
+import sys
+import threading
+import time
+import zlib
+
+from docopt import docopt
+
+from smlmqttprocessor.aio import open_input
+from smlmqttprocessor.daily import create_daily_counters
+from smlmqttprocessor.mqtt import MyMqtt
+from smlmqttprocessor.overload import create_overload_policy
+from smlmqttprocessor.sinks import FanOut, MqttSink, Sink, StdoutSink
+from smlmqttprocessor.smltextmqttprocessor import SML_FIELDS, processing_loop_async, read_config, read_deltas
+from smlmqttprocessor.utils.mylogging import setup_logging
+from smlmqttprocessor.utils.shmring import ShmRing
+
+# pylint: disable=consider-using-f-string
+
+# record header: meter index, timestamp; followed by the marshalled mqttdata
+_RECORD = struct.Struct("<Hd")
+# seconds the publisher sleeps if all rings are empty
+POLL_INTERVAL = 0.01
+
+
+def pack_window(meter, timestamp, mqttdata):
+    """Pack an aggregated window into a ring record.
+
+    marshal keeps the value types (int, float) and all value-types (e.g. d0/d1) as they are.
+
+    :param meter: meter index
+    :param timestamp: wall-clock time of the window (seconds since epoch)
+    :param mqttdata: 2-dim dictionary fieldname --> value-type --> value
+    """
+    return _RECORD.pack(meter, timestamp) + marshal.dumps(mqttdata)
+
+
+def unpack_window(record):
+    """Unpack a ring record, return (meter index, timestamp, mqttdata)."""
+    meter, timestamp = _RECORD.unpack_from(record)
+    return meter, timestamp, marshal.loads(record[_RECORD.size:])
+
+
+def shard_of(name, n_workers):
+    """Return the worker index of a meter, stable across runs (unlike hash()).
+
+    :param name: meter name
+    :param n_workers: number of worker processes
+    """
+    return zlib.crc32(name.encode('utf8')) % n_workers
+
+
+def parse_meters(args):
+    """Parse the meter arguments [name=]input, return a list of (name, input)."""
+    meters = []
+    for index, arg in enumerate(args):
+        match = re.match(r'^([\w.-]+)=(.+)$', arg)
+        meters.append((match.group(1), match.group(2)) if match else ('meter%d' % index, arg))
+    names = [name for name, _ in meters]
+    if len(set(names)) != len(names):
+        raise ValueError("Meter names must be unique! (%s)" % ", ".join(names))
+    return meters
+
+
+class RingSink(Sink):
+    """Write the aggregated windows of a meter into a worker's ring (worker process).
+
+    :param ring: ShmRing
+    :param meter: meter index
+    :param lock: lock of the ring's producer side, shared by the worker's meters
+    """
+
+    name = 'ring'
+
+    def __init__(self, ring, meter, lock):
+        """Write the aggregated windows of a meter into a ring."""
+        self.ring = ring
+        self.meter = meter
+        self.lock = lock
+
+    def write(self, mqttdata, timestamp):
+        """Write one aggregated window, dropped if the ring is full (publisher too slow)."""
+        record = pack_window(self.meter, timestamp, mqttdata)
+        with self.lock:
+            if not self.ring.put(record):
+                logging.warning("Ring full, dropped window of meter #%d (#%d dropped)",
+                                self.meter, self.ring.n_dropped)
+
+
+async def _process_meters(ring, meters, config, window_size, deltas, timeout):
+    """Process the meters concurrently in one event loop, see smltextmqttprocessor.run()."""
+    lock = threading.Lock()
+    queue_size = config.getint('Sinks', 'queue_size', fallback=100)
+    deadline = config.getfloat(configparser.DEFAULTSECT, 'window_deadline', fallback=0)
+    readers = []
+    fanouts = []
+    try:
+        for meter, _, spec in meters:
+            readers.append(await open_input(spec))
+            fanouts.append(FanOut([RingSink(ring, meter, lock)], queue_size, daily=create_daily_counters(config),
+                                  overload=create_overload_policy(config)))
+        await asyncio.gather(*(processing_loop_async(reader, window_size, fanout, timeout, deltas,
+                                                     deadline=deadline, overload=fanout.overload)
+                               for reader, fanout in zip(readers, fanouts)))
+    finally:
+        for reader in readers:
+            reader.close()
+        for fanout in fanouts:
+            fanout.close()
+
+
+def run_worker(ring_name, meters, config_text, window_size, deltas=None, timeout=0, log_level=logging.WARNING):
+    """Worker process: parse and aggregate the meters' inputs, write the windows into the ring.
+
+    :param ring_name: name of the ShmRing
+    :param meters: list of (meter index, name, input)
+    :param config_text: configuration (INI text)
+    :param window_size: rolling window size, size of aggregation window
+    :param deltas: dictionary fieldname->float with difference (delta) thresholds
+    :param timeout: timeout in seconds, 0 for no timeout
+    :param log_level: logging level
+    """
+    setup_logging(level=log_level)
+    config = configparser.ConfigParser()
+    config.read_string(config_text)
+    ring = ShmRing(name=ring_name)
+    logging.info("Worker for meters %s", ", ".join(name for _, name, _ in meters))
+    try:
+        asyncio.run(_process_meters(ring, meters, config, window_size, deltas, timeout))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        ring.close()
+
+
+class ShardedProcessor:
+    """Hash-partition the meters over worker processes, publish their windows from this process.
+
+    :param meters: list of (name, input), see parse_meters()
+    :param config: ConfigParser object
+    :param window_size: rolling window size, size of aggregation window
+    :param n_workers: number of worker processes, default [Sharding] workers
+    :param deltas: dictionary fieldname->float with difference (delta) thresholds
+    :param timeout: timeout in seconds, 0 for no timeout
+    :param no_mqtt: print to STDOUT instead of publishing via MQTT
+    """
+
+    def __init__(self, meters, config, window_size, n_workers=None, deltas=None, timeout=0, no_mqtt=False):
+        """Hash-partition the meters over worker processes."""
+        self.meters = meters
+        self.config = config
+        self.window_size = window_size
+        self.n_workers = n_workers or config.getint('Sharding', 'workers', fallback=2)
+        self.deltas = deltas
+        self.timeout = timeout
+        self.ring_size = config.getint('Sharding', 'ring_size', fallback=1 << 20)
+        self.rings = []
+        self.processes = []
+        self.n_published = 0
+        self.n_errors = 0
+        # one MQTT connection for all meters, each meter with its own topic prefix
+        self.mymqtt = None
+        if no_mqtt:
+            self.sinks = [StdoutSink(title=name) for name, _ in meters]
+        else:
+            self.mymqtt = MyMqtt(config, field_names=list(SML_FIELDS))
+            topic_prefix = config.get('Mqtt', 'topic_prefix', fallback='tele/smartmeter')
+            self.sinks = [MqttSink(self.mymqtt, topic_prefix='%s/%s' % (topic_prefix, name)) for name, _ in meters]
+
+    def shards(self):
+        """Return the meters of each worker, lists of (meter index, name, input)."""
+        shards = [[] for _ in range(self.n_workers)]
+        for index, (name, spec) in enumerate(self.meters):
+            shards[shard_of(name, self.n_workers)].append((index, name, spec))
+        return shards
+
+    def start(self):
+        """Create the rings and start the worker processes (one per non-empty shard)."""
+        config_text = io.StringIO()
+        self.config.write(config_text)
+        # clean processes, i.e. without the threads and sockets of this one
+        context = multiprocessing.get_context('spawn')
+        for shard in self.shards():
+            if not shard:
+                continue
+            ring = ShmRing(self.ring_size)
+            process = context.Process(target=run_worker, name="shard-%d" % len(self.processes),
+                                      args=(ring.name, shard, config_text.getvalue(), self.window_size,
+                                            self.deltas, self.timeout, logging.getLogger().getEffectiveLevel()))
+            process.start()
+            self.rings.append(ring)
+            self.processes.append(process)
+        logging.info("%d meters, %d worker processes", len(self.meters), len(self.processes))
+
+    def drain(self):
+        """Publish all windows in the rings, return their number."""
+        n_windows = 0
+        for ring in self.rings:
+            while True:
+                record = ring.get()
+                if record is None:
+                    break
+                n_windows += 1
+                meter, timestamp, mqttdata = unpack_window(record)
+                try:
+                    self.sinks[meter].write(mqttdata, timestamp)
+                    self.n_published += 1
+                except Exception as ex:  # pylint: disable=broad-exception-caught
+                    self.n_errors += 1
+                    logging.error("Publishing meter '%s' failed! %s: %s", self.meters[meter][0], type(ex).__name__, ex)
+        return n_windows
+
+    def run(self):
+        """Start the workers, publish their windows until all of them ended.
+
+        :return: number of failed worker processes
+        """
+        if not self.processes:
+            self.start()
+        try:
+            while any(process.is_alive() for process in self.processes):
+                if not self.drain():
+                    time.sleep(POLL_INTERVAL)
+        finally:
+            self.close()
+        return sum(1 for process in self.processes if process.exitcode)
+
+    def close(self, timeout=10.0):
+        """Wait for the workers (max. timeout seconds), publish the remaining windows, release all resources."""
+        for process in self.processes:
+            process.join(timeout)
+            if process.is_alive():
+                logging.warning("Worker '%s' did not end in time, terminating it!", process.name)
+                process.terminate()
+                process.join()
+            elif process.exitcode:
+                logging.error("Worker '%s' failed! (exit code %d)", process.name, process.exitcode)
+        self.drain()
+        for ring in self.rings:
+            if ring.n_dropped:
+                logging.warning("%d windows dropped, ring full!", ring.n_dropped)
+            ring.close()
+        self.rings = []
+        if self.mymqtt and self.mymqtt.client:
+            self.mymqtt.disconnect()
+
+
+def main(argv=None):
+    """Run the sharded processor.
+
+    :return: exit/return code
+    """
+    arguments = docopt(__doc__, argv=argv)
+    log_level = logging.WARNING
+    if arguments['--verbose']:
+        log_level = logging.INFO
+    if arguments['--quiet']:
+        log_level = logging.ERROR
+    setup_logging(level=log_level)
+
+    config = read_config(arguments['--config'])
+    window_size = int(arguments['--window'] or config.getint(configparser.DEFAULTSECT, 'block_size', fallback=30))
+    try:
+        meters = parse_meters(arguments['<meter>'])
+    except ValueError as ex:
+        print(ex, file=sys.stderr)
+        return 2
+    processor = ShardedProcessor(meters, config, window_size,
+                                 n_workers=int(arguments['--workers'] or 0),
+                                 deltas=read_deltas(config), timeout=int(arguments['--timeout']),
+                                 no_mqtt=arguments['--no-mqtt'])
+    try:
+        n_failed = processor.run()
+    except KeyboardInterrupt:
+        # the workers got the SIGINT, too
+        n_failed = 0
+    return 1 if n_failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
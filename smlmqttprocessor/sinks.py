@@ -0,0 +1,431 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Output sinks for the aggregated window data.
+
+The processing loop's callback (FanOut) aggregates a window once and hands
+the result, the 2-dim dictionary fieldname --> value-type --> value, to all
+configured sinks. Each sink runs in its own thread with its own bounded
+queue, so a slow sink (e.g. a stalled MQTT broker) cannot stall the others.
+"""
+import csv
+import json
+import logging
+import os
+import queue
+import socket
+import sys
+import threading
+import time
+from abc import ABC, abstractmethod
+from urllib.parse import urlparse
+
+from smlmqttprocessor.mqtt import MyMqtt
+from smlmqttprocessor.payload import STATS_FULL
+from smlmqttprocessor.tracing import WindowTrace
+from smlmqttprocessor.utils.message_utils import convert_messages2records
+from smlmqttprocessor.utils.metrics import Histogram
+
+SINK_NAMES = ('mqtt', 'stdout', 'influxdb', 'csv', 'jsonl', 'prometheus')
+
+
+class Sink(ABC):
+    """Base class for sinks."""
+
+    name = 'sink'
+
+    @abstractmethod
+    def write(self, mqttdata, timestamp):
+        """Write one aggregated window.
+
+        :param mqttdata: 2-dim dictionary fieldname --> value-type --> value
+        :param timestamp: wall-clock time of the window (seconds since epoch)
+        """
+
+    def write_traced(self, mqttdata, timestamp, trace):
+        """Write one aggregated window, with its WindowTrace (see smlmqttprocessor.tracing).
+
+        Only sinks contributing to the trace (MQTT) override this.
+        """
+        self.write(mqttdata, timestamp)
+
+    def close(self):
+        """Release resources."""
+
+
+class StdoutSink(Sink):
+    """Pretty-print to STDOUT (mainly for testing)."""
+
+    name = 'stdout'
+
+    def __init__(self, title='mqttdata'):
+        """Pretty-print to STDOUT.
+
+        :param title: printed before each window
+        """
+        self.title = title
+        # imported only when needed (--no-mqtt), saves startup time and memory otherwise
+        from pprint import pprint  # pylint: disable=import-outside-toplevel
+        self._pprint = pprint
+
+    def write(self, mqttdata, timestamp):
+        """Pretty-print one aggregated window."""
+        print('%s:' % self.title)
+        self._pprint(mqttdata)
+        sys.stdout.flush()
+
+
+class MqttSink(Sink):
+    """Publish via MQTT (MyMqtt)."""
+
+    name = 'mqtt'
+
+    def __init__(self, mymqtt, topic_prefix=None):
+        """Publish via MQTT.
+
+        :param mymqtt: MyMqtt instance
+        :param topic_prefix: topic prefix, default the configured one
+        """
+        self.mymqtt = mymqtt
+        self.topic_prefix = topic_prefix
+
+    def write(self, mqttdata, timestamp):
+        """Publish one aggregated window."""
+        self.mymqtt.send_mqttdata(mqttdata, topic_prefix=self.topic_prefix)
+
+    def write_traced(self, mqttdata, timestamp, trace):
+        """Publish one aggregated window, MyMqtt records the publish times in the trace."""
+        trace.handoff = time.monotonic()
+        self.mymqtt.send_mqttdata(mqttdata, trace=trace, topic_prefix=self.topic_prefix)
+
+    def close(self):
+        """Disconnect from the MQTT server."""
+        if self.mymqtt.client:
+            self.mymqtt.disconnect()
+
+
+def _float(value):
+    return repr(float(value))
+
+
+class InfluxDbSink(Sink):
+    """Send InfluxDB line protocol, via UDP or HTTP.
+
+    One line per field, the field name as tag and the value-types as
+    (always float) fields, e.g.:
+      smartmeter,field=actual value=168.0,first=168.0,...,stdev=2.3 1700000000000000000
+
+    :param url: udp://host:port or http(s)://host:port/write?db=... (InfluxDB v1 or v2 write URL)
+    :param measurement: measurement name
+    :param timeout: HTTP timeout in seconds
+    """
+
+    name = 'influxdb'
+
+    def __init__(self, url, measurement='smartmeter', timeout=10):
+        """Send InfluxDB line protocol, via UDP or HTTP."""
+        self.url = url
+        self.measurement = measurement
+        self.timeout = timeout
+        parsed = urlparse(url)
+        self._udp_address = None
+        self._sock = None
+        if parsed.scheme == 'udp':
+            self._udp_address = (parsed.hostname, parsed.port or 8089)
+            self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        elif parsed.scheme not in ('http', 'https'):
+            raise ValueError("Unsupported InfluxDB URL '%s'!" % url)
+        else:
+            # imported only when needed (with http.client, email, ssl)
+            import urllib.request  # pylint: disable=import-outside-toplevel
+            self._urllib_request = urllib.request
+
+    def format_lines(self, mqttdata, timestamp):
+        """Format one aggregated window as line protocol."""
+        timestamp_ns = int(timestamp * 1e9)
+        lines = []
+        for name, values in mqttdata.items():
+            fields = ",".join("%s=%s" % (stat, _float(value)) for stat, value in values.items())
+            lines.append("%s,field=%s %s %d" % (self.measurement, name, fields, timestamp_ns))
+        return "\n".join(lines) + "\n"
+
+    def write(self, mqttdata, timestamp):
+        """Send one aggregated window."""
+        data = self.format_lines(mqttdata, timestamp).encode()
+        if self._sock:
+            self._sock.sendto(data, self._udp_address)
+            return
+        request = self._urllib_request.Request(self.url, data=data, method='POST',
+                                               headers={'Content-Type': 'text/plain; charset=utf-8'})
+        with self._urllib_request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+    def close(self):
+        """Close the UDP socket."""
+        if self._sock:
+            self._sock.close()
+
+
+class CsvSink(Sink):
+    """Append to a CSV file, one row per field.
+
+    Columns: timestamp, field, and all value-types (empty if not available).
+    """
+
+    name = 'csv'
+    columns = ('timestamp', 'field') + STATS_FULL
+
+    def __init__(self, path):
+        """Append to a CSV file, one row per field."""
+        self.path = path
+        # pylint: disable=consider-using-with
+        self._file = open(path, 'a', newline='', encoding='utf8')
+        self._writer = csv.writer(self._file)
+        if self._file.tell() == 0:
+            self._writer.writerow(self.columns)
+
+    def write(self, mqttdata, timestamp):
+        """Append one aggregated window."""
+        for name, values in mqttdata.items():
+            self._writer.writerow([timestamp, name] + [values.get(stat, '') for stat in STATS_FULL])
+        self._file.flush()
+
+    def close(self):
+        """Close the file."""
+        self._file.close()
+
+
+class JsonlSink(Sink):
+    """Append to a JSON Lines file, one line per window."""
+
+    name = 'jsonl'
+
+    def __init__(self, path):
+        """Append to a JSON Lines file, one line per window."""
+        self.path = path
+        # pylint: disable=consider-using-with
+        self._file = open(path, 'a', encoding='utf8')
+
+    def write(self, mqttdata, timestamp):
+        """Append one aggregated window."""
+        self._file.write(json.dumps({'timestamp': timestamp, 'data': mqttdata}) + "\n")
+        self._file.flush()
+
+    def close(self):
+        """Close the file."""
+        self._file.close()
+
+
+class PrometheusSink(Sink):
+    """Write the latest window as Prometheus text file (node_exporter textfile collector).
+
+    The file is replaced atomically, e.g.:
+      smartmeter_mean{field="actual"} 169.6
+    """
+
+    name = 'prometheus'
+
+    def __init__(self, path, prefix='smartmeter'):
+        """Write the latest window as Prometheus text file."""
+        self.path = path
+        self.prefix = prefix
+
+    def format_text(self, mqttdata, timestamp):
+        """Format one aggregated window in the Prometheus text format."""
+        lines = []
+        stats = {}
+        for name, values in mqttdata.items():
+            for stat, value in values.items():
+                stats.setdefault(stat, []).append('%s_%s{field="%s"} %s' % (
+                    self.prefix, stat, name, _float(value)))
+        for stat, samples in stats.items():
+            lines.append("# TYPE %s_%s gauge" % (self.prefix, stat))
+            lines.extend(samples)
+        lines.append("# TYPE %s_timestamp_seconds gauge" % self.prefix)
+        lines.append("%s_timestamp_seconds %s" % (self.prefix, _float(timestamp)))
+        return "\n".join(lines) + "\n"
+
+    def write(self, mqttdata, timestamp):
+        """Replace the text file with the latest window."""
+        tmp_path = "%s.tmp" % self.path
+        with open(tmp_path, 'w', encoding='utf8') as fout:
+            fout.write(self.format_text(mqttdata, timestamp))
+        os.replace(tmp_path, self.path)
+
+
+class SinkWorker:
+    """Run a sink in its own thread, fed by a bounded queue.
+
+    If the queue is full, the oldest window is dropped.
+
+    :param sink: Sink instance
+    :param queue_size: max. number of queued windows
+    """
+
+    def __init__(self, sink, queue_size=100):
+        """Run a sink in its own thread, fed by a bounded queue."""
+        self.sink = sink
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.n_written = 0
+        self.n_dropped = 0
+        self.n_errors = 0
+        self.write_time = Histogram()
+        self._thread = threading.Thread(target=self._run, name="sink-%s" % sink.name, daemon=True)
+        self._thread.start()
+
+    def submit(self, mqttdata, timestamp, trace=None):
+        """Queue one aggregated window, never blocks.
+
+        :param trace: optional WindowTrace
+        """
+        while True:
+            try:
+                self.queue.put_nowait((mqttdata, timestamp, trace))
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                    self.queue.task_done()
+                    self.n_dropped += 1
+                    logging.warning("Sink '%s' too slow, dropped oldest window (#%d dropped)",
+                                    self.sink.name, self.n_dropped)
+                except queue.Empty:
+                    pass
+
+    def lag(self):
+        """Return the age (seconds) of the oldest queued window, 0 if none."""
+        with self.queue.mutex:
+            oldest = self.queue.queue[0] if self.queue.queue else None
+        return time.time() - oldest[1] if oldest else 0.0
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                mqttdata, timestamp, trace = item
+                start = time.perf_counter()
+                if trace is None:
+                    self.sink.write(mqttdata, timestamp)
+                else:
+                    self.sink.write_traced(mqttdata, timestamp, trace)
+                self.write_time.observe(time.perf_counter() - start)
+                self.n_written += 1
+            except Exception as ex:  # pylint: disable=broad-exception-caught
+                self.n_errors += 1
+                logging.error("Sink '%s' failed! %s: %s", self.sink.name, type(ex).__name__, ex)
+            finally:
+                self.queue.task_done()
+
+    def close(self, timeout=10.0):
+        """Write all queued windows (max. timeout seconds), then stop the thread and the sink."""
+        try:
+            self.queue.put(None, timeout=timeout)
+        except queue.Full:
+            logging.warning("Sink '%s' did not drain in time!", self.sink.name)
+        self._thread.join(timeout)
+        self.sink.close()
+
+
+class FanOut:
+    """Processing loop callback: aggregate a window once, fan out to all sinks.
+
+    :param sinks: list of Sink instances
+    :param queue_size: max. number of queued windows per sink
+    :param daily: optional DailyCounters, adds d0/d1 to the total fields
+    :param metrics: optional ProcessorMetrics, records the aggregation time
+    :param trace: trace the windows until published (WindowTrace), default if metrics are enabled
+    :param overload: optional OverloadPolicy (sink lag, merge and value_only policies)
+    """
+
+    def __init__(self, sinks, queue_size=100, daily=None, metrics=None, trace=None, overload=None):
+        """Aggregate each window once and fan it out to all sinks (processing loop callback)."""
+        self.workers = [SinkWorker(sink, queue_size) for sink in sinks]
+        self.daily = daily
+        self.metrics = metrics
+        self.trace = bool(metrics) if trace is None else trace
+        self.overload = overload
+
+    def __call__(self, messages):
+        """Handle the messages of one window (a list, or a Window with its read times)."""
+        if self.overload:
+            self.overload.update_sinks(max((worker.lag() for worker in self.workers), default=0.0))
+            messages = self.overload.merge(messages)
+            if messages is None:
+                # merged with the next window
+                return
+        self._handle(messages)
+
+    def _handle(self, messages):
+        trace = None
+        if self.trace:
+            trace = WindowTrace(getattr(messages, 'first_read', None), getattr(messages, 'last_read', None),
+                                self.metrics)
+            trace.aggregation_start = time.monotonic()
+        if self.metrics:
+            start = time.perf_counter()
+        records = convert_messages2records(messages)
+        value_only = self.overload is not None and self.overload.value_only
+        if value_only:
+            self.overload.n_windows_value_only += 1
+        mqttdata = MyMqtt.construct_mqttdata(records, value_only=value_only)
+        if self.metrics:
+            self.metrics.aggregation_time.observe(time.perf_counter() - start)
+        timestamp = time.time()
+        if self.daily:
+            self.daily.update(records, mqttdata, timestamp)
+        if trace:
+            trace.aggregation_end = time.monotonic()
+            if self.metrics:
+                for stage, seconds in trace.stages().items():
+                    self.metrics.stage_time[stage].observe(seconds)
+        for worker in self.workers:
+            worker.submit(mqttdata, timestamp, trace)
+
+    def close(self, timeout=10.0):
+        """Drain and close all sinks."""
+        if self.overload:
+            messages = self.overload.flush()
+            if messages is not None:
+                self._handle(messages)
+            if self.overload.n_activations:
+                logging.warning("Overload: %d times, %s", self.overload.n_activations, self.overload.summary())
+        for worker in self.workers:
+            worker.close(timeout)
+
+
+def create_sinks(config, no_mqtt=False, field_names=None, loop=None):
+    """Create the sinks according to the configuration.
+
+    :param config: ConfigParser object, e.g. from config.ini
+    :param no_mqtt: replace the MQTT sink by the STDOUT sink
+    :param field_names: ordered SML field names (for MyMqtt)
+    :param loop: asyncio event loop for MyMqtt's network I/O, default paho's own thread
+    :return: list of Sink instances
+    """
+    names = [name.strip() for name in
+             config.get('Sinks', 'sinks', fallback='mqtt').split(',') if name.strip()]
+    if no_mqtt:
+        names = ['stdout' if name == 'mqtt' else name for name in names]
+        if 'stdout' not in names:
+            names.append('stdout')
+    sinks = []
+    for name in names:
+        if name == 'mqtt':
+            sinks.append(MqttSink(MyMqtt(config, field_names=field_names, loop=loop)))
+        elif name == 'stdout':
+            sinks.append(StdoutSink())
+        elif name == 'influxdb':
+            sinks.append(InfluxDbSink(
+                config.get('Sinks', 'influxdb_url', fallback='udp://localhost:8089'),
+                config.get('Sinks', 'influxdb_measurement', fallback='smartmeter')))
+        elif name == 'csv':
+            sinks.append(CsvSink(config.get('Sinks', 'csv_file', fallback='smartmeter.csv')))
+        elif name == 'jsonl':
+            sinks.append(JsonlSink(config.get('Sinks', 'jsonl_file', fallback='smartmeter.jsonl')))
+        elif name == 'prometheus':
+            sinks.append(PrometheusSink(
+                config.get('Sinks', 'prometheus_file', fallback='smartmeter.prom')))
+        else:
+            raise ValueError("Unknown sink '%s'! (valid: %s)" % (name, ", ".join(SINK_NAMES)))
+    return sinks
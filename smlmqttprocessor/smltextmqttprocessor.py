@@ -15,7 +15,8 @@ Usage:
   smltextmqttprocessor.py --version
 
 Arguments:
-  input           SML input, file or '-' for STDIN (e.g., from libsml-binary).
+  input           SML input, file or '-' for STDIN (e.g., from libsml-binary),
+                  also a FIFO, tcp:host:port or unix:path.
 
 Options:
   --config <file> Configuration file [default: config.local.ini]
@@ -45,26 +46,24 @@ Options:
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
+import asyncio
 import configparser
 import logging
 import os
 import sys
 import time
-# pylint: disable=redefined-builtin
-from codecs import open
 from pathlib import Path
-from pprint import pprint
 
-# https://pypi.org/project/paho-mqtt/#usage-and-api
-# PySML, https://pypi.org/project/pysml/
-# noinspection PyUnresolvedReferences,PyPackageRequirements
-# pylint: disable=import-error,unused-import
-import sml  # noqa: F401
 from docopt import docopt
 
-from smlmqttprocessor.mqtt import MyMqtt
-from smlmqttprocessor.utils.message_utils import convert_messages2records
+from smlmqttprocessor.aio import FileLineReader, open_input
+from smlmqttprocessor.daily import create_daily_counters
+from smlmqttprocessor.instrumentation import create_instrumentation
+from smlmqttprocessor.overload import create_overload_policy
+from smlmqttprocessor.sinks import FanOut, create_sinks
+from smlmqttprocessor.tracing import Window
 from smlmqttprocessor.utils.mylogging import setup_logging
+from smlmqttprocessor.utils.profiling import install_profiling
 
 __version__ = "1.17.0"
 __date__ = "2020-04-21"
@@ -110,6 +109,10 @@ SML_HEADERS = ('1-0:96.50.1*1#', '129-129:199.130.3*255#')
 ##
 ########################################################################
 
+# OBIS codes of the meter's counters (totals, cumulative) and of the sensor time,
+# kept of frames shed under overload (see smlmqttprocessor.overload)
+COUNTER_CODES = frozenset(code for name, code in SML_FIELDS.items() if name.startswith('total') or name == 'time')
+
 # Python 3.5 is the version of my Raspian 8 (Jessie) which has Python 3.5
 # f-string does not work with Python 3.5
 # pylint: disable=consider-using-f-string
@@ -156,58 +159,106 @@ def parse_line(line):
     return None
 
 
-def processing_loop(input_stream, window_size, callback, timeout=0, deltas=None):
-    """Run the main processing loop on the input stream.
+def handle_window(callback, messages, metrics=None):
+    """Call the messages handling callback, record the window metrics if enabled.
 
-    If size of rolling window is reached then call handler function mqtt_or_println.
-    A timeout can be specified to stop after n seconds of no data (e.g. for STDIN).
+    :param callback: reference to messages handling callback function
+    :param messages: Window, list of messages of the window
+    :param metrics: optional ProcessorMetrics
+    """
+    if not metrics:
+        callback(messages)
+        return
+    start = time.perf_counter()
+    callback(messages)
+    metrics.flush_time.observe(time.perf_counter() - start)
+    metrics.windows.inc()
+    metrics.window_messages.set(len(messages))
+
+
+class WindowCollector:
+    """Collect the messages (SML frames) of text lines into windows, hand each window to the callback.
+
+    A window is handled when it is full (window_size), when a field changed by
+    more than its delta threshold, or at the latest deadline seconds after its
+    first message (timer in the running asyncio event loop, 0 to disable).
 
-    :param input_stream: input stream
     :param window_size: rolling window size, size of aggregation window
     :param callback: reference to messages handling callback function
-    :param timeout: timeout in seconds, 0 for no timeout
     :param deltas: dictionary fieldname->float with difference (delta) thresholds
-    :return: Nothing
+    :param metrics: optional ProcessorMetrics
+    :param deadline: max. age (seconds) of a window, 0 for none
+    :param overload: optional OverloadPolicy (input lag, drop_frames policy)
     """
-    message = {}
-    messages = []
-    n_nodata = 0
-    while True:
-        line = input_stream.readline().strip()
-        if not line:
-            n_nodata += 1
-            if timeout and n_nodata >= timeout:
-                logging.warning("#%d times no data observed, timeout hit, aborting!",
-                                n_nodata)
-                messages.append(message)
-                callback(messages)
-                break
-            logging.debug("no data observed...waiting 1 second...")
-            time.sleep(1)
-
-        if isinstance(line, bytes):
-            # make sure line is a string, not bytes
-            line = line.decode()
 
+    def __init__(self, window_size, callback, deltas=None, metrics=None, deadline=0, overload=None):
+        """Collect the messages of text lines into windows."""
+        self.window_size = window_size
+        self.callback = callback
+        self.deltas = deltas
+        self.metrics = metrics
+        self.deadline = deadline
+        self.overload = overload
+        self.shed = False  # only the counters of the current message (overload)
+        self.message = {}
+        self.message_read = None  # monotonic time the header of the current message was read
+        self.messages = Window()
+        self._timer = None  # deadline of the current window
+
+    def handle(self):
+        """Handle the collected messages as window, start a new one."""
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        handle_window(self.callback, self.messages, self.metrics)  # handle all messages
+        self.messages = Window()  # start a new collection
+
+    def flush(self):
+        """Handle the collected messages incl. the current one, e.g. at the end of the input."""
+        self.messages.append(self.message)
+        self.message = {}
+        self.handle()
+
+    def _expired(self, messages):
+        if messages is self.messages:
+            logging.info("window deadline (%.1f s) reached, handling #%d messages...",
+                         self.deadline, len(messages))
+            self.handle()
+
+    def add_line(self, line):
+        """Process one (stripped) input line."""
         # check if this is a header line, i.e. beginning of new message block
         if check_stream_packet_begin(line):
-            if message:  # initial loops have empty message...
+            now = time.monotonic()
+            if self.metrics:
+                self.metrics.messages.inc()
+            messages = self.messages
+            if self.message:  # initial loops have empty message...
                 # record current message
-                messages.append(message)
-                logging.debug("message: %s", message)
+                if not messages:
+                    messages.first_read = self.message_read
+                    if self.deadline:
+                        self._timer = asyncio.get_running_loop().call_later(self.deadline, self._expired, messages)
+                messages.last_read = now
+                messages.append(self.message)
+                logging.debug("message: %s", self.message)
+                if self.overload and isinstance(self.message.get('time'), (int, float)):
+                    self.overload.update_input(self.message['time'], self.message_read)
 
             # new header line, new message
-            message = {}
+            self.message = {}
+            self.message_read = now
+            if self.overload:
+                self.shed = self.overload.shed_frame()
 
             n_msgs = len(messages)
-            if n_msgs >= window_size:
+            if n_msgs >= self.window_size:
                 logging.info("window (%d) filled, handling #%d messages...",
-                             window_size, n_msgs)
-                callback(messages)  # handle all messages
-                messages = []  # start a new collection
-            elif deltas and n_msgs >= 2:
+                             self.window_size, n_msgs)
+                self.handle()
+            elif self.deltas and n_msgs >= 2:
                 # dynamic checking of all fields in message according to declared delta-thresholds
-                for field_name, delta_value in deltas.items():
+                for field_name, delta_value in self.deltas.items():
                     if field_name not in messages[-2] or field_name not in messages[-1]:
                         logging.warning("No such field with name '%s' in message!",
                                         field_name)
@@ -228,58 +279,155 @@ def processing_loop(input_stream, window_size, callback, timeout=0, deltas=None)
                     if is_change:
                         logging.info("field '%s', delta: %d, above threshold (%d), handling...",
                                      field_name, delta, delta_value)
-                        callback(messages)  # handle all messages
-                        messages = []  # start a new collection
+                        self.handle()
                         # stop delta stuff, i.e., only 1 handling when delta event happens
                         break
 
             # current header-line is done, proceed to next line
-            continue
+            return
+
+        if self.shed and line.split('#', 1)[0] not in COUNTER_CODES:
+            # overload, skip the raw values
+            return
 
         # try to parse the next incoming line (from sml_server_time)
         try:
             # parse libSML text line
-            result = parse_line(line)
+            if self.metrics:
+                start = time.perf_counter()
+                result = parse_line(line)
+                self.metrics.parse_time.observe(time.perf_counter() - start)
+            else:
+                result = parse_line(line)
             if result:
                 field_name, value = result
                 # add to message
                 # NOTE: duplicate lines of same type would overwrite old values
                 # until a new header line occurs (i.e., next SML message block)
-                message[field_name] = value
+                self.message[field_name] = value
         except ValueError as ex:
+            if self.metrics:
+                self.metrics.malformed.inc()
             logging.error("Invalid message '%s': %s", line, ex)
 
-        time.sleep(0.01)
 
+async def processing_loop_async(reader, window_size, callback, timeout=0, deltas=None, metrics=None,
+                                deadline=0, overload=None):
+    """Run the main processing loop on an asynchronous line reader.
 
-def main():
-    """Run the main program entry point.
+    If size of rolling window is reached then call handler function (e.g. FanOut).
+    A timeout can be specified to stop after n seconds of no data (e.g. for STDIN).
+    The callback gets a Window, i.e. a list of messages with the read times
+    of its first and last frame (see smlmqttprocessor.tracing).
 
-    :return: exit/return code
+    :param reader: LineReader (smlmqttprocessor.aio), e.g. from open_input()
+    :param window_size: rolling window size, size of aggregation window
+    :param callback: reference to messages handling callback function
+    :param timeout: timeout in seconds, 0 for no timeout
+    :param deltas: dictionary fieldname->float with difference (delta) thresholds
+    :param metrics: optional ProcessorMetrics (input, parsing and window metrics)
+    :param deadline: max. age (seconds) of a window, 0 for none
+    :param overload: optional OverloadPolicy, see smlmqttprocessor.overload
+    :return: Nothing
     """
-    version_string = "SmlTextMqttProcessor %s (%s)" % (__version__, __updated__)
-    arguments = docopt(__doc__, version=version_string)
-    arg_input = arguments['<input>']
-    arg_configfile = arguments['--config']
-    arg_verbose = arguments['--verbose']
-    arg_quiet = arguments['--quiet']
-    arg_no_mqtt = arguments['--no-mqtt']
-    arg_timeout = int(arguments['--timeout'])
-    arg_window_size = arguments['--window']
+    collector = WindowCollector(window_size, callback, deltas, metrics, deadline, overload)
+    n_nodata = 0
+    while True:
+        if metrics:
+            start = time.perf_counter()
+        line = (await reader.readline()).strip()
+        if metrics:
+            metrics.read_time.observe(time.perf_counter() - start)
+            if line:
+                metrics.lines.inc()
+        if not line:
+            n_nodata += 1
+            if timeout and n_nodata >= timeout:
+                logging.warning("#%d times no data observed, timeout hit, aborting!",
+                                n_nodata)
+                collector.flush()
+                break
+            logging.debug("no data observed...waiting...")
+            await reader.idle()
+            continue
+        collector.add_line(line)
 
-    log_level = logging.WARNING
-    if arg_verbose:
-        log_level = logging.INFO
-    if arg_quiet:
-        log_level = logging.ERROR
-    if DEBUG:
-        log_level = logging.DEBUG
-    setup_logging(level=log_level)
 
-    logging.info(version_string)
-    logging.debug("arguments: %s", arguments)
+def processing_loop(input_stream, window_size, callback, timeout=0, deltas=None, metrics=None):
+    """Run the main processing loop on the input stream.
 
-    # Configuration
+    Synchronous wrapper of processing_loop_async(), e.g. for files.
+
+    :param input_stream: input stream (readline())
+    :param window_size: rolling window size, size of aggregation window
+    :param callback: reference to messages handling callback function
+    :param timeout: timeout in seconds, 0 for no timeout
+    :param deltas: dictionary fieldname->float with difference (delta) thresholds
+    :param metrics: optional ProcessorMetrics (input, parsing and window metrics)
+    :return: Nothing
+    """
+    asyncio.run(processing_loop_async(FileLineReader(input_stream), window_size, callback, timeout, deltas,
+                                      metrics))
+
+
+async def run(arg_input, config, window_size, deltas=None, timeout=0, no_mqtt=False):
+    """Run the processor in an asyncio event loop: input, windows, MQTT network I/O.
+
+    :param arg_input: input, see open_input()
+    :param config: ConfigParser object
+    :param window_size: rolling window size, size of aggregation window
+    :param deltas: dictionary fieldname->float with difference (delta) thresholds
+    :param timeout: timeout in seconds, 0 for no timeout
+    :param no_mqtt: replace the MQTT sink by the STDOUT sink
+    """
+    loop = asyncio.get_running_loop()
+    reader = await open_input(arg_input)
+    logging.info("Input: %s", arg_input)
+
+    # optional metrics (Prometheus endpoint and/or MQTT), None if disabled
+    instrumentation = create_instrumentation(config)
+    metrics = instrumentation.metrics if instrumentation else None
+
+    # optional load shedding while the processing lags behind, None if disabled
+    overload = create_overload_policy(config)
+
+    # output sinks (MQTT, InfluxDB, CSV, ...), each in its own thread
+    # optional in-process d0/d1 (instead of generate_d0_d1.py)
+    fanout = FanOut(create_sinks(config, no_mqtt=no_mqtt, field_names=list(SML_FIELDS), loop=loop),
+                    queue_size=config.getint('Sinks', 'queue_size', fallback=100),
+                    daily=create_daily_counters(config), metrics=metrics,
+                    # window latency tracing (line read --> MQTT publish), for the metrics and/or the payload
+                    trace=bool(metrics) or config.getboolean('Mqtt', 'trace_payload', fallback=False),
+                    overload=overload)
+    if instrumentation:
+        instrumentation.start(fanout)
+
+    # optional on-demand profiling (SIGUSR1: cProfile, SIGUSR2: tracemalloc)
+    profiling = install_profiling(config, 'smltextmqttprocessor')
+
+    # main processing loop on input stream
+    # IF (size of rolling window is reached) THEN call fanout, i.e. handle all sinks
+    try:
+        await processing_loop_async(reader, window_size, fanout, deltas=deltas, timeout=timeout, metrics=metrics,
+                                    deadline=config.getfloat(configparser.DEFAULTSECT, 'window_deadline',
+                                                             fallback=0),
+                                    overload=overload)
+    finally:
+        reader.close()
+        if profiling:
+            profiling.close()
+        if instrumentation:
+            instrumentation.close()
+        # drain the sinks without blocking the event loop, it does the MQTT network I/O
+        await loop.run_in_executor(None, fanout.close)
+
+
+def read_config(arg_configfile):
+    """Read the configuration file.
+
+    :param arg_configfile: path, relative to the project root, None for an empty configuration
+    :return: ConfigParser object
+    """
     config = configparser.ConfigParser()
     if arg_configfile:
         configfile = Path(arg_configfile)
@@ -292,8 +440,14 @@ def main():
         config.read(configfile)  # does not fail by itself when configfile is not accessible
         # combine all config dicts, and mask password
         logging.info("Configuration: %s", {**config.defaults(), **dict(config.items())})
+    return config
 
-    # set the threshold deltas from config
+
+def read_deltas(config):
+    """Return the threshold deltas from the configuration, dictionary fieldname->float.
+
+    :param config: ConfigParser object
+    """
     deltas = {}
     if config.has_section("DeltaThresholds"):
         for name, value in config.items("DeltaThresholds"):
@@ -306,6 +460,41 @@ def main():
             else:
                 logging.warning("Invalid value for DeltaThresholds '%s'!", name)
         logging.info("DeltaThresholds: %s", deltas)
+    return deltas
+
+
+def main():
+    """Run the main program entry point.
+
+    :return: exit/return code
+    """
+    version_string = "SmlTextMqttProcessor %s (%s)" % (__version__, __updated__)
+    arguments = docopt(__doc__, version=version_string)
+    arg_input = arguments['<input>']
+    arg_configfile = arguments['--config']
+    arg_verbose = arguments['--verbose']
+    arg_quiet = arguments['--quiet']
+    arg_no_mqtt = arguments['--no-mqtt']
+    arg_timeout = int(arguments['--timeout'])
+    arg_window_size = arguments['--window']
+
+    log_level = logging.WARNING
+    if arg_verbose:
+        log_level = logging.INFO
+    if arg_quiet:
+        log_level = logging.ERROR
+    if DEBUG:
+        log_level = logging.DEBUG
+    setup_logging(level=log_level)
+
+    logging.info(version_string)
+    logging.debug("arguments: %s", arguments)
+
+    # Configuration
+    config = read_config(arg_configfile)
+
+    # set the threshold deltas from config
+    deltas = read_deltas(config)
 
     # rolling window period
     window_size = config.getint(configparser.DEFAULTSECT, 'block_size', fallback=30)
@@ -314,27 +503,7 @@ def main():
         window_size = int(arg_window_size)
     logging.info('Aggregation/rolling window size: %d', window_size)
 
-    # input stream
-    # pylint: disable=consider-using-with
-    istream = sys.stdin if arg_input == "-" else open(arg_input)
-    logging.info("Input stream: %s", istream)
-
-    # MQTT
-    mymqtt = MyMqtt(config)
-
-    # this callback will be called when a message has arrived and has been parsed
-    def mqtt_or_println(messages):
-        records = convert_messages2records(messages)
-        if arg_no_mqtt:
-            mqttdata = MyMqtt.construct_mqttdata(records)
-            print('mqttdata:')
-            pprint(mqttdata)
-        else:
-            mymqtt.send(records)
-
-    # main processing loop on input stream
-    # IF (size of rolling window is reached) THEN call handler function mqtt_or_println
-    processing_loop(istream, window_size, mqtt_or_println, deltas=deltas, timeout=arg_timeout)
+    asyncio.run(run(arg_input, config, window_size, deltas=deltas, timeout=arg_timeout, no_mqtt=arg_no_mqtt))
 
     return 0
 
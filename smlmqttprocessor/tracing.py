@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""End-to-end latency tracing of windows, from line read to MQTT publish.
+
+processing_loop() hands a Window (a list of messages) to its callback, with
+the monotonic times its first and last frame were read. FanOut adds a
+WindowTrace with the aggregation times, the MQTT sink the publish handoff,
+the end of publishing and the acknowledgement of all messages of the window
+(QoS 0: written to the socket).
+
+Stages (seconds):
+- read: first frame read --> last frame read, i.e. the window's span
+- aggregate: last frame read --> aggregation done
+- queue: aggregation done --> handed to the MQTT client (sink queue)
+- publish: handoff --> all messages published
+- ack: published --> all messages acknowledged
+The end-to-end latency is measured from the first and from the last frame
+read until acknowledged, i.e. the age of the oldest and newest frame at the broker.
+"""
+import time
+
+TRACE_STAGES = ('read', 'aggregate', 'queue', 'publish', 'ack')
+# histogram buckets (seconds), the end-to-end latency includes the window's span
+TRACE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+class Window(list):
+    """The messages of a window, with the monotonic read times of its first and last frame."""
+
+    __slots__ = ('first_read', 'last_read')
+
+    def __init__(self, *args):
+        """Hold the messages of a window."""
+        super().__init__(*args)
+        self.first_read = None
+        self.last_read = None
+
+
+class WindowTrace:
+    """Monotonic timestamps of a window on its way to the MQTT server.
+
+    :param first_read: monotonic time the first frame was read, None if unknown
+    :param last_read: monotonic time the last frame was read, None if unknown
+    :param metrics: optional ProcessorMetrics, gets the stage latencies when complete
+    """
+
+    __slots__ = ('first_read', 'last_read', 'aggregation_start', 'aggregation_end', 'handoff',
+                 'published', 'acked', 'n_sent', 'n_pending', 'metrics')
+
+    def __init__(self, first_read=None, last_read=None, metrics=None):
+        """Monotonic timestamps of a window."""
+        self.first_read = first_read
+        self.last_read = last_read
+        self.aggregation_start = None
+        self.aggregation_end = None
+        self.handoff = None
+        self.published = None
+        self.acked = None
+        self.n_sent = 0  # published messages of this window (not queued while disconnected)
+        self.n_pending = 0  # of these not acknowledged yet
+        self.metrics = metrics
+
+    def stages(self):
+        """Return stage --> duration (seconds) of the known stages, see TRACE_STAGES."""
+        points = (self.first_read, self.last_read, self.aggregation_end, self.handoff, self.published, self.acked)
+        return {stage: end - start for stage, start, end in zip(TRACE_STAGES, points, points[1:])
+                if start is not None and end is not None}
+
+    def end_to_end(self):
+        """Return frame ('first', 'last') --> seconds from its read until acknowledged."""
+        if self.acked is None:
+            return {}
+        return {frame: self.acked - read for frame, read in (('first', self.first_read), ('last', self.last_read))
+                if read is not None}
+
+    def complete(self):
+        """Record the latencies of the publishing stages (all messages are acknowledged)."""
+        if not self.metrics:
+            return
+        stages = self.stages()
+        for stage in ('queue', 'publish', 'ack'):
+            if stage in stages:
+                self.metrics.stage_time[stage].observe(stages[stage])
+        for frame, latency in self.end_to_end().items():
+            self.metrics.end_to_end[frame].observe(latency)
+
+    def to_payload(self):
+        """Return the timestamps as POSIX timestamps (ms resolution), e.g. for the single-topic payload.
+
+        The publish time ('sent') is now.
+        """
+        now = time.monotonic()
+        offset = time.time() - now
+        points = (('first_read', self.first_read), ('last_read', self.last_read),
+                  ('aggregated', self.aggregation_end), ('handoff', self.handoff), ('sent', now))
+        return {name: round(point + offset, 3) for name, point in points if point is not None}
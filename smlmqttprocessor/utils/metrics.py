@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Simple metrics primitives and a registry rendering the Prometheus text format."""
+import bisect
+
+# default histogram buckets for latencies (seconds)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# default histogram buckets for outages, e.g. broker unavailable (seconds)
+OUTAGE_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+# default histogram buckets for short per-line/per-window timings (seconds)
+FAST_BUCKETS = (1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 0.001, 0.01, 0.1)
+
+# quantiles of the histograms in the flat snapshot (e.g. for MQTT)
+SNAPSHOT_QUANTILES = (0.5, 0.9, 0.99)
+
+
+class Counter:
+    """Monotonically increasing counter."""
+
+    __slots__ = ('value',)
+
+    def __init__(self):
+        """Monotonically increasing counter."""
+        self.value = 0
+
+    def inc(self, amount=1):
+        """Increase the counter."""
+        self.value += amount
+
+
+class Gauge:
+    """Value that can go up and down."""
+
+    __slots__ = ('value',)
+
+    def __init__(self):
+        """Value that can go up and down."""
+        self.value = 0
+
+    def set(self, value):
+        """Set the current value."""
+        self.value = value
+
+
+class Histogram:
+    """Fixed-bucket histogram (cumulative buckets like Prometheus).
+
+    :param buckets: sorted upper bounds, an implicit +Inf bucket is added
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        """Fixed-bucket histogram."""
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        """Record a single observation."""
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        """Return list of (upper bound, cumulative count), last bound is +Inf."""
+        result = []
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+    def quantile(self, q):
+        """Estimate the quantile q, 0..1, as the upper bound of the bucket it falls into."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        for bound, total in self.cumulative():
+            if total >= rank:
+                return bound
+        return float('inf')  # pragma: no cover
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                             for key, value in labels)
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class MetricsRegistry:
+    """Named counters, gauges and histograms with optional labels.
+
+    Values owned by other objects (e.g. MyMqtt.n_reconnects) are registered
+    as functions, they are only evaluated when the metrics are collected.
+
+    :param namespace: prefix of all metric names
+    """
+
+    TYPES = ('counter', 'gauge', 'histogram')
+
+    def __init__(self, namespace='smlmqttprocessor'):
+        """Named counters, gauges and histograms with optional labels."""
+        self.namespace = namespace
+        self._families = {}  # name --> (type, help text, {labels --> metric})
+
+    def _register(self, kind, name, help_text, metric, labels):
+        family = self._families.setdefault(name, (kind, help_text, {}))
+        if family[0] != kind:
+            raise ValueError("Metric '%s' is already registered as %s!" % (name, family[0]))
+        family[2][tuple((labels or {}).items())] = metric
+        return metric
+
+    def counter(self, name, help_text, function=None, labels=None):
+        """Register a counter, or a function returning the current count.
+
+        :param name: metric name (without namespace), e.g. 'input_lines_total'
+        :param help_text: description
+        :param function: callable returning the value, default a new Counter
+        :param labels: optional dictionary label name --> value
+        :return: the Counter (or function)
+        """
+        return self._register('counter', name, help_text, function or Counter(), labels)
+
+    def gauge(self, name, help_text, function=None, labels=None):
+        """Register a gauge, or a function returning the current value, see counter()."""
+        return self._register('gauge', name, help_text, function or Gauge(), labels)
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS, histogram=None, labels=None):
+        """Register a histogram.
+
+        :param name: metric name (without namespace), e.g. 'parse_line_seconds'
+        :param help_text: description
+        :param buckets: buckets of a new Histogram
+        :param histogram: existing Histogram instance (e.g. MyMqtt.publish_latency)
+        :param labels: optional dictionary label name --> value
+        :return: the Histogram
+        """
+        return self._register('histogram', name, help_text, histogram or Histogram(buckets), labels)
+
+    def collect(self):
+        """Yield (full name, type, help text, [(labels, metric or value)]) per metric."""
+        for name, (kind, help_text, series) in self._families.items():
+            samples = []
+            for labels, metric in series.items():
+                if kind != 'histogram':
+                    metric = metric() if callable(metric) else metric.value
+                samples.append((labels, metric))
+            yield "%s_%s" % (self.namespace, name), kind, help_text, samples
+
+    def render_prometheus(self):
+        """Return all metrics in the Prometheus text exposition format."""
+        lines = []
+        for name, kind, help_text, samples in self.collect():
+            lines.append("# HELP %s %s" % (name, help_text))
+            lines.append("# TYPE %s %s" % (name, kind))
+            for labels, metric in samples:
+                if kind != 'histogram':
+                    lines.append("%s%s %s" % (name, _format_labels(labels), _format_value(metric)))
+                    continue
+                for bound, count in metric.cumulative():
+                    bucket_labels = _format_labels(labels + (('le', _format_value(bound)),))
+                    lines.append("%s_bucket%s %d" % (name, bucket_labels, count))
+                lines.append("%s_sum%s %s" % (name, _format_labels(labels), repr(metric.sum)))
+                lines.append("%s_count%s %d" % (name, _format_labels(labels), metric.count))
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        """Return the metrics as flat dictionary, e.g. for MQTT.
+
+        The keys are the metric names (without namespace) followed by the label
+        values, histograms are summarized by count, sum and SNAPSHOT_QUANTILES,
+        e.g. 'sink_write_seconds/mqtt/p99'.
+        """
+        result = {}
+        prefix_length = len(self.namespace) + 1
+        for name, kind, _, samples in self.collect():
+            name = name[prefix_length:]
+            for labels, metric in samples:
+                key = '/'.join((name,) + tuple(str(value) for _, value in labels))
+                if kind != 'histogram':
+                    result[key] = metric
+                    continue
+                result[key + '/count'] = metric.count
+                result[key + '/sum'] = metric.sum
+                for q in SNAPSHOT_QUANTILES:
+                    result['%s/p%d' % (key, round(q * 100))] = metric.quantile(q)
+        return result
@@ -5,11 +5,15 @@ import logging
 import sys
 from os import PathLike
 
-import colorlog
+FORMAT = "%(asctime)s %(levelname)-8s %(message)s"
+DATEFMT = "%Y-%m-%d %H:%M:%S"
 
 
 def setup_logging(level: int = logging.INFO, log_file: PathLike = None, color=True):
-    """Set up the logging framework."""
+    """Set up the logging framework.
+
+    Colored output (colorlog, imported only then) if color is enabled and STDOUT is a terminal.
+    """
     # logging.basicConfig(level=logging.WARNING if not DEBUG else logging.DEBUG,
     #                    stream=LOGGING_STREAM,
     #                    format="%(asctime)s %(levelname)-8s %(message)s",
@@ -20,10 +24,13 @@ def setup_logging(level: int = logging.INFO, log_file: PathLike = None, color=Tr
         color = False
     else:
         stream = sys.stdout
-    handler = colorlog.StreamHandler(stream=stream)
-    format_string = "%(log_color)s%(asctime)s %(levelname)-8s %(message)s"
-    formatter = colorlog.ColoredFormatter(format_string,
-                                          datefmt="%Y-%m-%d %H:%M:%S",
-                                          no_color=not color)
+    if color and stream.isatty():
+        import colorlog  # pylint: disable=import-outside-toplevel
+        handler = colorlog.StreamHandler(stream=stream)
+        formatter = colorlog.ColoredFormatter("%(log_color)s" + FORMAT, datefmt=DATEFMT)
+    else:
+        # e.g. systemd/journald, no escape sequences
+        handler = logging.StreamHandler(stream=stream)
+        formatter = logging.Formatter(FORMAT, datefmt=DATEFMT)
     handler.setFormatter(formatter)
     logging.basicConfig(level=level, handlers=[handler])
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""On-demand profiling, triggered by signals (e.g. `kill -USR1 <pid>`).
+
+- SIGUSR1 toggles a cProfile session (of the main thread, i.e. the processing
+  loop), stopping it writes profile-<name>-<timestamp>.pstats,
+  e.g. for `python -m pstats` or snakeviz.
+- SIGUSR2 starts tracemalloc on the first signal, each further signal writes
+  the top allocations (and the difference to the previous snapshot) to
+  tracemalloc-<name>-<timestamp>.txt.
+
+Python runs signal handlers in the main thread, between two bytecodes, so
+the handlers do not interfere with the other threads (e.g. sinks, paho).
+
+cProfile and tracemalloc are imported on first use only, they are not
+needed at startup.
+"""
+import logging
+import signal
+import tempfile
+import time
+from pathlib import Path
+
+# pylint: disable=import-outside-toplevel
+
+
+class ProfilingHooks:
+    """cProfile and tracemalloc, toggled by signals.
+
+    :param name: program name, part of the file names
+    :param directory: output directory, default the system temp. directory
+    :param top: number of entries of the tracemalloc statistics
+    :param frames: number of frames of the tracemalloc tracebacks
+    """
+
+    def __init__(self, name, directory=None, top=25, frames=1):
+        """Set up cProfile and tracemalloc, toggled by signals."""
+        self.name = name
+        self.directory = Path(directory or tempfile.gettempdir())
+        self.top = top
+        self.frames = frames
+        self.profile = None  # running cProfile.Profile
+        self.snapshot = None  # last tracemalloc snapshot
+
+    def install(self, profile_signal='SIGUSR1', tracemalloc_signal='SIGUSR2'):
+        """Install the signal handlers (only possible in the main thread).
+
+        :return: False if the signals are not supported (e.g. on Windows)
+        """
+        if not (hasattr(signal, profile_signal) and hasattr(signal, tracemalloc_signal)):
+            logging.warning("Profiling signals %s/%s are not supported on this platform!",
+                            profile_signal, tracemalloc_signal)
+            return False
+        signal.signal(getattr(signal, profile_signal), lambda signum, frame: self.toggle_profile())
+        signal.signal(getattr(signal, tracemalloc_signal), lambda signum, frame: self.dump_tracemalloc())
+        logging.info("Profiling: %s toggles cProfile, %s dumps tracemalloc snapshots, output to %s",
+                     profile_signal, tracemalloc_signal, self.directory)
+        return True
+
+    def _filename(self, kind, suffix):
+        return self.directory.joinpath("%s-%s-%s.%s" % (kind, self.name, time.strftime('%Y%m%d-%H%M%S'), suffix))
+
+    def toggle_profile(self):
+        """Start a cProfile session, or stop the running one and write it.
+
+        :return: file name of the written profile, None if started
+        """
+        if self.profile is None:
+            import cProfile
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+            logging.warning("Profiling started")
+            return None
+        self.profile.disable()
+        filename = self._filename('profile', 'pstats')
+        self.profile.dump_stats(str(filename))
+        self.profile = None
+        logging.warning("Profiling stopped, written to %s", filename)
+        return filename
+
+    def dump_tracemalloc(self):
+        """Start tracemalloc, or write the top allocations of a new snapshot.
+
+        :return: file name of the written statistics, None if started
+        """
+        import tracemalloc
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self.snapshot = None
+            logging.warning("tracemalloc started")
+            return None
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        ))
+        current, peak = tracemalloc.get_traced_memory()
+        lines = ["traced memory: current %d bytes, peak %d bytes" % (current, peak), "",
+                 "top %d allocations:" % self.top]
+        lines.extend(str(stat) for stat in snapshot.statistics('lineno')[:self.top])
+        if self.snapshot is not None:
+            lines.extend(["", "top %d differences to the previous snapshot:" % self.top])
+            lines.extend(str(stat) for stat in snapshot.compare_to(self.snapshot, 'lineno')[:self.top])
+        self.snapshot = snapshot
+        filename = self._filename('tracemalloc', 'txt')
+        filename.write_text("\n".join(lines) + "\n")
+        logging.warning("tracemalloc snapshot written to %s", filename)
+        return filename
+
+    def close(self):
+        """Stop a running cProfile session (writing it) and tracemalloc."""
+        if self.profile is not None:
+            self.toggle_profile()
+        import tracemalloc
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self.snapshot = None
+
+
+def install_profiling(config, name):
+    """Install the profiling signal handlers if enabled in the configuration.
+
+    :param config: ConfigParser object, e.g. from config.ini
+    :param name: program name, part of the file names
+    :return: ProfilingHooks instance, None if not enabled
+    """
+    if not config.getboolean('Profiling', 'signals', fallback=False):
+        return None
+    hooks = ProfilingHooks(name, config.get('Profiling', 'directory', fallback='') or None,
+                           top=config.getint('Profiling', 'top', fallback=25))
+    if not hooks.install():
+        return None
+    return hooks
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Calendar rollup: bucket boundaries (hour, day, week, month, year) in a time zone.
+
+The boundaries are local wall-clock instants, e.g. local midnight, so a day
+is 23 or 25 hours long at a DST changeover. The end of the current bucket is
+precomputed as POSIX timestamp, i.e. checking a reading is a single float
+comparison, the calendar arithmetic only runs on a rollover.
+"""
+import time
+from datetime import date, datetime, time as daytime, timedelta
+from zoneinfo import ZoneInfo
+
+UNITS = ('hour', 'day', 'week', 'month', 'year')
+
+
+def get_timezone(name: str):
+    """Return the tzinfo of an IANA time zone name, None (system local time) if empty."""
+    return ZoneInfo(name) if name else None
+
+
+def _midnight(day: date, tz):
+    """Return the local midnight at the start of the day."""
+    return datetime.combine(day, daytime(), tzinfo=tz)
+
+
+def bucket_bounds(timestamp: float, unit: str = 'day', tz=None):
+    """Return the bucket containing the timestamp.
+
+    :param timestamp: POSIX timestamp
+    :param unit: one of UNITS
+    :param tz: tzinfo, None for the system local time
+    :return: (start as local datetime, end as POSIX timestamp)
+    """
+    moment = datetime.fromtimestamp(timestamp, tz)
+    if unit == 'hour':
+        # fromtimestamp() sets fold, i.e. the repeated hour of a 25 h day is a bucket of its own
+        start = moment.replace(minute=0, second=0, microsecond=0)
+        return start, start.timestamp() + 3600
+    day = moment.date()
+    if unit == 'day':
+        first, following = day, day + timedelta(days=1)
+    elif unit == 'week':
+        # ISO week, starting on Monday
+        first = day - timedelta(days=day.weekday())
+        following = first + timedelta(days=7)
+    elif unit == 'month':
+        first = day.replace(day=1)
+        following = (first + timedelta(days=32)).replace(day=1)
+    elif unit == 'year':
+        first, following = date(day.year, 1, 1), date(day.year + 1, 1, 1)
+    else:
+        raise ValueError("Unknown unit '%s'! (valid: %s)" % (unit, ", ".join(UNITS)))
+    return _midnight(first, tz), _midnight(following, tz).timestamp()
+
+
+class CalendarClock:
+    """The current bucket of a calendar unit, advanced by POSIX timestamps.
+
+    Time going backwards (e.g. the system clock is set back) does not
+    roll back the bucket.
+
+    :param unit: one of UNITS
+    :param tz: tzinfo (e.g. ZoneInfo('Europe/Berlin')), None for the system local time
+    :param timestamp: initial POSIX timestamp, default now
+    """
+
+    __slots__ = ('unit', 'tz', 'start', 'end', 'day')
+
+    def __init__(self, unit: str = 'day', tz=None, timestamp: float = None):
+        """Track the current bucket of a calendar unit, advanced by POSIX timestamps."""
+        if unit not in UNITS:
+            raise ValueError("Unknown unit '%s'! (valid: %s)" % (unit, ", ".join(UNITS)))
+        self.unit = unit
+        self.tz = tz
+        self.start = self.end = self.day = None
+        self._set(time.time() if timestamp is None else timestamp)
+
+    def _set(self, timestamp: float):
+        self.start, self.end = bucket_bounds(timestamp, self.unit, self.tz)
+        # local date of the bucket start, precomputed as it is needed per reading
+        self.day = self.start.date()
+
+    def advance(self, timestamp: float):
+        """Move to the bucket containing the timestamp, return True on a rollover."""
+        if timestamp < self.end:
+            return False
+        self._set(timestamp)
+        return True
+
+    @property
+    def duration(self):
+        """Length of the current bucket in seconds, e.g. 82800 for a 23 h day."""
+        return self.end - self.start.timestamp()
+
+
+class DayCounter:
+    """Meter readings of one day: first, last, min, max and number of readings.
+
+    Updated in O(1) per reading, the raw readings are not kept.
+    """
+
+    __slots__ = ('date', 'first', 'last', 'min', 'max', 'count')
+
+    def __init__(self, day: date):
+        """Meter readings of one day."""
+        self.date = day
+        self.first = None
+        self.last = None
+        self.min = None
+        self.max = None
+        self.count = 0
+
+    def add(self, value: float):
+        """Add a meter reading."""
+        if not self.count:
+            self.first = self.min = self.max = value
+        elif value < self.min:
+            self.min = value
+        elif value > self.max:
+            self.max = value
+        self.last = value
+        self.count += 1
+
+    @property
+    def consumption(self):
+        """Consumption (last - first), None if there are less than 2 readings."""
+        if self.count > 1:
+            return self.last - self.first
+        return None
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Ring buffer of variable-length records in shared memory, between two processes.
+
+Single producer, single consumer: one process put()s, another one get()s.
+Layout:
+  header: head (uint64, written by the producer) | tail (uint64, written by the consumer)
+          | dropped (uint64, producer) | capacity (uint64, size of the data area)
+  data:   records, each one length (uint32) | bytes, a record never wraps
+          around, a length of WRAP (or less than 4 bytes left) marks a jump
+          to the start of the data area
+head and tail are ever increasing positions (modulo the data size gives the
+offset). The producer writes the record before it updates head, the consumer
+reads it before it updates tail, so neither side reads a half-written value.
+"""
+import struct
+from multiprocessing import shared_memory
+
+_HEADER = struct.Struct("<QQQQ")
+_LENGTH = struct.Struct("<I")
+_POSITION = struct.Struct("<Q")
+WRAP = 0xFFFFFFFF
+
+
+class ShmRing:
+    """Ring buffer of variable-length records in shared memory.
+
+    :param size: size of the data area in bytes (new ring)
+    :param name: name of an existing ring to attach to, None to create a new one
+    """
+
+    def __init__(self, size=1 << 20, name=None):
+        """Create or attach to a ring buffer in shared memory."""
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=_HEADER.size + size)
+            _HEADER.pack_into(self.shm.buf, 0, 0, 0, 0, size)
+            self.owner = True
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            self.owner = False
+        # the size of the creator, the OS might round up the size of the shared memory block
+        self.capacity = self._position(3)
+        self._data = self.shm.buf[_HEADER.size:_HEADER.size + self.capacity]
+
+    @property
+    def name(self):
+        """Name of the shared memory block, to attach from another process."""
+        return self.shm.name
+
+    def _position(self, index):
+        return _POSITION.unpack_from(self.shm.buf, index * 8)[0]
+
+    def _set_position(self, index, value):
+        _POSITION.pack_into(self.shm.buf, index * 8, value)
+
+    @property
+    def n_dropped(self):
+        """Records dropped as the ring was full."""
+        return self._position(2)
+
+    def __len__(self):
+        """Return the number of used bytes."""
+        return self._position(0) - self._position(1)
+
+    def put(self, record):
+        """Append a record (producer), drop it if the ring is full.
+
+        :param record: bytes
+        :return: False if dropped
+        """
+        size = _LENGTH.size + len(record)
+        if size > self.capacity:
+            raise ValueError("Record too large for the ring (%d > %d bytes)!" % (size, self.capacity))
+        head = self._position(0)
+        offset = head % self.capacity
+        skip = self.capacity - offset if self.capacity - offset < size else 0
+        if head + skip + size - self._position(1) > self.capacity:
+            self._set_position(2, self.n_dropped + 1)
+            return False
+        if skip:
+            if skip >= _LENGTH.size:
+                _LENGTH.pack_into(self._data, offset, WRAP)
+            head += skip
+            offset = 0
+        _LENGTH.pack_into(self._data, offset, len(record))
+        self._data[offset + _LENGTH.size:offset + size] = record
+        # publish the record
+        self._set_position(0, head + size)
+        return True
+
+    def get(self):
+        """Remove and return the oldest record (consumer), None if the ring is empty."""
+        head = self._position(0)
+        tail = self._position(1)
+        while tail != head:
+            offset = tail % self.capacity
+            left = self.capacity - offset
+            if left < _LENGTH.size:
+                tail += left
+                continue
+            length, = _LENGTH.unpack_from(self._data, offset)
+            if length == WRAP:
+                tail += left
+                continue
+            record = bytes(self._data[offset + _LENGTH.size:offset + _LENGTH.size + length])
+            self._set_position(1, tail + _LENGTH.size + length)
+            return record
+        self._set_position(1, tail)
+        return None
+
+    def close(self):
+        """Detach from the shared memory, the creator also removes it."""
+        self._data.release()
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Shared test helpers: SML text frames, windows and connected MyMqtt instances."""
+from configparser import ConfigParser
+
+from smlmqttprocessor.mqtt import MyMqtt
+from smlmqttprocessor.tracing import Window
+from tests.mqttbroker import wait_for
+
+HEADER = "1-0:96.50.1*1#ISK#\n"
+
+
+def sml_frames(totals, actuals=None, sensor_times=None):
+    """Return SML text frames (Iskra), one per total, closed by the header of the next one.
+
+    :param totals: total values (Wh)
+    :param actuals: optional actual power values (W), one per frame
+    :param sensor_times: optional sensor times (act_sensor_time), one per frame
+    """
+    text = ""
+    for i, total in enumerate(totals):
+        text += HEADER + "1-0:1.8.0*255#%s#Wh\n" % total
+        if actuals is not None:
+            text += "1-0:16.7.0*255#%s#W\n" % actuals[i]
+        if sensor_times is not None:
+            text += "act_sensor_time#%s#\n" % sensor_times[i]
+    return text + HEADER
+
+
+def make_window(*messages, first_read=None, last_read=None):
+    """Return a Window of the messages, with the monotonic read times of its first and last frame."""
+    window = Window(messages)
+    window.first_read = first_read
+    window.last_read = last_read
+    return window
+
+
+def connected_mymqtt(port, **options):
+    """Return a MyMqtt instance connected to the broker (stand-in) on localhost:port.
+
+    :param options: further [Mqtt] options, e.g. qos='1'
+    """
+    config = ConfigParser()
+    config.read_dict({'Mqtt': dict(port=str(port), **options)})
+    mymqtt = MyMqtt(config)
+    mymqtt.connect()
+    assert wait_for(lambda: mymqtt.connected)
+    return mymqtt
@@ -0,0 +1,455 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Lightweight local MQTT broker stand-in for tests and benchmarks.
+
+This is *not* a full broker, but enough to run real MQTT clients against:
+- MQTT 3.1.1 (and the MQTT v5 bits used by MyMqtt: topic aliases, CONNACK properties)
+- PUBLISH with QoS 0/1/2 (acknowledged), delivery to subscribers with QoS 0
+- SUBSCRIBE/UNSUBSCRIBE with wildcards, retained messages
+- every received packet is recorded with a timestamp (time.monotonic())
+- forced disconnects and refused connections, to simulate broker drops
+
+Run it in-process:
+    with MqttBrokerStandIn() as broker:
+        ... broker.port ... broker.received ...
+
+Or as subprocess, printing every received PUBLISH as JSON line:
+    python -m tests.mqttbroker --port 1883
+"""
+import argparse
+import json
+import socket
+import socketserver
+import struct
+import sys
+import threading
+import time
+
+from paho.mqtt.client import topic_matches_sub
+
+CONNECT = 0x10
+CONNACK = 0x20
+PUBLISH = 0x30
+PUBACK = 0x40
+PUBREC = 0x50
+PUBREL = 0x60
+PUBCOMP = 0x70
+SUBSCRIBE = 0x80
+SUBACK = 0x90
+UNSUBSCRIBE = 0xA0
+UNSUBACK = 0xB0
+PINGREQ = 0xC0
+PINGRESP = 0xD0
+DISCONNECT = 0xE0
+
+# MQTT v5 property identifiers
+PROPERTY_MESSAGE_EXPIRY_INTERVAL = 0x02
+PROPERTY_TOPIC_ALIAS = 0x23
+PROPERTY_TOPIC_ALIAS_MAXIMUM = 0x22
+
+
+def _read_exactly(sock, size):
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("connection closed")
+        data += chunk
+    return data
+
+
+def _read_varint(sock):
+    """Read an MQTT variable byte integer, return (value, number of bytes)."""
+    value = 0
+    multiplier = 1
+    for i in range(4):
+        byte = _read_exactly(sock, 1)[0]
+        value += (byte & 0x7F) * multiplier
+        if not byte & 0x80:
+            return value, i + 1
+        multiplier *= 128
+    raise ValueError("malformed remaining length")
+
+
+def _decode_varint(data, pos):
+    value = 0
+    multiplier = 1
+    while True:
+        byte = data[pos]
+        pos += 1
+        value += (byte & 0x7F) * multiplier
+        if not byte & 0x80:
+            return value, pos
+        multiplier *= 128
+
+
+def _encode_varint(value):
+    result = b''
+    while True:
+        byte = value % 128
+        value //= 128
+        if value:
+            result += bytes((byte | 0x80,))
+        else:
+            return result + bytes((byte,))
+
+
+def _encode_string(value):
+    data = value.encode()
+    return struct.pack("!H", len(data)) + data
+
+
+def _decode_string(data, pos):
+    length = struct.unpack("!H", data[pos:pos + 2])[0]
+    return data[pos + 2:pos + 2 + length].decode(), pos + 2 + length
+
+
+class ReceivedPacket:
+    """A recorded packet (of any type)."""
+
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, packet_type, size, timestamp):
+        """Store packet type, size on the wire and receive timestamp."""
+        self.packet_type = packet_type
+        self.size = size
+        self.timestamp = timestamp
+
+
+class ReceivedPublish:
+    """A recorded PUBLISH packet."""
+
+    # pylint: disable=too-few-public-methods, too-many-arguments
+    def __init__(self, topic, payload, retain, size, topic_alias=None, qos=0, mid=None,
+                 timestamp=None):
+        """Store the decoded packet fields."""
+        self.topic = topic
+        self.payload = payload
+        self.retain = retain
+        self.qos = qos
+        self.mid = mid
+        self.size = size  # total packet size in bytes (fixed header included)
+        self.topic_alias = topic_alias
+        self.timestamp = timestamp  # time.monotonic() when received
+
+    def as_dict(self):
+        """Return as JSON-serializable dictionary."""
+        return {'topic': self.topic, 'payload': self.payload.decode(errors='replace'),
+                'retain': self.retain, 'qos': self.qos, 'size': self.size,
+                'timestamp': self.timestamp}
+
+    def __repr__(self):
+        """Return a readable representation."""
+        return "ReceivedPublish(%r, %r, retain=%r, size=%d)" % (
+            self.topic, self.payload, self.retain, self.size)
+
+
+class _Session:
+    """One client connection."""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.protocol_level = 4
+        self.subscriptions = set()
+        self.aliases = {}
+        self._lock = threading.Lock()
+
+    def send(self, data):
+        with self._lock:
+            self.sock.sendall(data)
+
+    def deliver(self, topic, payload, retain=False):
+        """Send a PUBLISH with QoS 0."""
+        body = _encode_string(topic)
+        if self.protocol_level == 5:
+            body += b'\x00'  # no properties
+        body += payload
+        self.send(bytes((PUBLISH | int(retain),)) + _encode_varint(len(body)) + body)
+
+
+class _Handler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        broker = self.server.broker
+        # no Nagle, acknowledgements must not be delayed
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        session = _Session(self.request)
+        if broker.refuse_connections:
+            # simulate a broker which is down
+            return
+        broker.add_session(session)
+        try:
+            while True:
+                header = _read_exactly(session.sock, 1)[0]
+                length, length_size = _read_varint(session.sock)
+                body = _read_exactly(session.sock, length) if length else b''
+                if not self._handle_packet(broker, session, header, body, 1 + length_size + length):
+                    return
+        except (ConnectionError, OSError):
+            return
+        finally:
+            broker.remove_session(session)
+
+    def _handle_packet(self, broker, session, header, body, size):
+        """Handle one packet, return False to close the connection."""
+        packet_type = header & 0xF0
+        broker.record_packet(ReceivedPacket(packet_type, size, time.monotonic()))
+        if packet_type == CONNECT:
+            # skip protocol name (2-byte length + "MQTT"), read level
+            name_length = struct.unpack("!H", body[:2])[0]
+            session.protocol_level = body[2 + name_length]
+            if session.protocol_level not in broker.protocol_levels:
+                # 0x01 = unacceptable protocol version (MQTT 3.1.1)
+                session.send(bytes((CONNACK, 2, 0, 1)))
+                return False
+            broker.connects.append(self._decode_connect(body, 2 + name_length, session))
+            session.send(broker.connack(session.protocol_level))
+        elif packet_type == PUBLISH:
+            publish = self._decode_publish(header, body, session)
+            publish.size = size
+            broker.handle_publish(publish)
+            if publish.qos and broker.ack_publishes:
+                ack = PUBACK if publish.qos == 1 else PUBREC
+                session.send(struct.pack("!BBH", ack, 2, publish.mid))
+        elif packet_type == PUBREL:
+            session.send(bytes((PUBCOMP, 2)) + body[:2])
+        elif packet_type == SUBSCRIBE:
+            self._handle_subscribe(broker, session, body)
+        elif packet_type == UNSUBSCRIBE:
+            mid, filters = self._decode_filters(body, session, has_options=False)
+            session.subscriptions.difference_update(filters)
+            if session.protocol_level == 5:
+                reason_codes = bytes(len(filters))
+                session.send(bytes((UNSUBACK, 3 + len(filters))) + mid + b'\x00' + reason_codes)
+            else:
+                session.send(bytes((UNSUBACK, 2)) + mid)
+        elif packet_type == PINGREQ:
+            session.send(bytes((PINGRESP, 0)))
+        elif packet_type == DISCONNECT:
+            return False
+        return True
+
+    def _handle_subscribe(self, broker, session, body):
+        mid, filters = self._decode_filters(body, session, has_options=True)
+        session.subscriptions.update(filters)
+        # granted QoS 0 for all
+        payload = mid + (b'\x00' if session.protocol_level == 5 else b'') + bytes(len(filters))
+        session.send(bytes((SUBACK,)) + _encode_varint(len(payload)) + payload)
+        for topic, payload in broker.retained_messages(filters):
+            session.deliver(topic, payload, retain=True)
+
+    @staticmethod
+    def _decode_filters(body, session, has_options):
+        """Decode (UN)SUBSCRIBE, return (packet identifier bytes, topic filters)."""
+        mid = body[:2]
+        pos = 2
+        if session.protocol_level == 5:
+            props_length, pos = _decode_varint(body, pos)
+            pos += props_length
+        filters = []
+        while pos < len(body):
+            topic_filter, pos = _decode_string(body, pos)
+            if has_options:
+                pos += 1
+            filters.append(topic_filter)
+        return mid, filters
+
+    @staticmethod
+    def _decode_connect(body, pos, session):
+        """Decode the relevant CONNECT fields: client id and clean session (v5: clean start)."""
+        flags = body[pos + 1]
+        pos += 4  # level, flags, keep alive
+        if session.protocol_level == 5:
+            props_length, pos = _decode_varint(body, pos)
+            pos += props_length
+        client_id, _ = _decode_string(body, pos)
+        return {'client_id': client_id, 'clean_session': bool(flags & 0x02),
+                'protocol_level': session.protocol_level}
+
+    @staticmethod
+    def _decode_publish(header, body, session):
+        qos = (header >> 1) & 0x03
+        topic, pos = _decode_string(body, 0)
+        mid = None
+        if qos:
+            mid = struct.unpack("!H", body[pos:pos + 2])[0]
+            pos += 2
+        alias = None
+        if session.protocol_level == 5:
+            props_length, pos = _decode_varint(body, pos)
+            props = body[pos:pos + props_length]
+            pos += props_length
+            i = 0
+            while i < len(props):
+                identifier = props[i]
+                if identifier == PROPERTY_TOPIC_ALIAS:
+                    alias = struct.unpack("!H", props[i + 1:i + 3])[0]
+                    i += 3
+                elif identifier == PROPERTY_MESSAGE_EXPIRY_INTERVAL:
+                    i += 5
+                else:
+                    break
+            if alias is not None:
+                if topic:
+                    session.aliases[alias] = topic
+                else:
+                    topic = session.aliases[alias]
+        return ReceivedPublish(topic, body[pos:], bool(header & 0x01), 0, alias, qos, mid,
+                               time.monotonic())
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class MqttBrokerStandIn:
+    """Local, in-process MQTT broker stand-in.
+
+    :param protocol_levels: accepted MQTT protocol levels (4 = 3.1.1, 5 = 5.0)
+    :param topic_alias_maximum: topic alias maximum announced to v5 clients
+    :param port: TCP port, 0 for any free port
+    """
+
+    def __init__(self, protocol_levels=(4, 5), topic_alias_maximum=10, port=0):
+        """Local, in-process MQTT broker stand-in."""
+        self.protocol_levels = protocol_levels
+        self.topic_alias_maximum = topic_alias_maximum
+        self.received = []  # ReceivedPublish
+        self.packets = []  # ReceivedPacket, all types
+        self.retained = {}  # topic --> payload
+        self.connects = []  # dict of client_id, clean_session, protocol_level
+        self.ack_publishes = True  # send PUBACK/PUBREC for QoS>0
+        self.refuse_connections = False  # close new connections immediately
+        self.on_publish = None  # optional callback(ReceivedPublish)
+        self._sessions = set()
+        self._lock = threading.Lock()
+        self._server = _Server(('127.0.0.1', port), _Handler)
+        self._server.broker = self
+        self._thread = None
+
+    @property
+    def port(self):
+        """TCP port the stand-in listens on."""
+        return self._server.server_address[1]
+
+    @property
+    def n_connections(self):
+        """Number of currently connected clients."""
+        with self._lock:
+            return len(self._sessions)
+
+    def connack(self, protocol_level):
+        """Build the CONNACK packet for the given protocol level."""
+        if protocol_level != 5:
+            return bytes((CONNACK, 2, 0, 0))
+        properties = b''
+        if self.topic_alias_maximum:
+            properties = struct.pack("!BH", PROPERTY_TOPIC_ALIAS_MAXIMUM,
+                                     self.topic_alias_maximum)
+        return bytes((CONNACK, 3 + len(properties), 0, 0, len(properties))) + properties
+
+    def record_packet(self, packet):
+        """Record a received packet."""
+        with self._lock:
+            self.packets.append(packet)
+
+    def handle_publish(self, publish):
+        """Record a received PUBLISH packet, store retained, deliver to subscribers."""
+        with self._lock:
+            self.received.append(publish)
+            if publish.retain:
+                if publish.payload:
+                    self.retained[publish.topic] = publish.payload
+                else:
+                    self.retained.pop(publish.topic, None)
+            sessions = [session for session in self._sessions
+                        if any(topic_matches_sub(sub, publish.topic) for sub in session.subscriptions)]
+        for session in sessions:
+            try:
+                session.deliver(publish.topic, publish.payload)
+            except OSError:
+                pass
+        if self.on_publish:
+            self.on_publish(publish)
+
+    def retained_messages(self, topic_filters):
+        """Return list of retained (topic, payload) matching any of the filters."""
+        with self._lock:
+            return [(topic, payload) for topic, payload in self.retained.items()
+                    if any(topic_matches_sub(sub, topic) for sub in topic_filters)]
+
+    def add_session(self, session):
+        """Register a client connection."""
+        with self._lock:
+            self._sessions.add(session)
+
+    def remove_session(self, session):
+        """Unregister a client connection."""
+        with self._lock:
+            self._sessions.discard(session)
+
+    def disconnect_clients(self):
+        """Forcibly close all client connections (simulate a broker drop)."""
+        with self._lock:
+            sessions = list(self._sessions)
+        for session in sessions:
+            try:
+                session.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def start(self):
+        """Start serving in a background thread."""
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        kwargs={'poll_interval': 0.05}, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving."""
+        self.disconnect_clients()
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        """Start serving."""
+        return self.start()
+
+    def __exit__(self, *_):
+        """Stop serving."""
+        self.stop()
+
+
+def wait_for(predicate, timeout=5.0, interval=0.01):
+    """Wait until predicate() is true, return its last result."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(interval)
+    return predicate()
+
+
+def main():
+    """Run the stand-in as a (sub)process, print received PUBLISH packets as JSON lines."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=1883)
+    args = parser.parse_args()
+
+    def print_publish(publish):
+        print(json.dumps(publish.as_dict()), flush=True)
+
+    broker = MqttBrokerStandIn(port=args.port)
+    broker.on_publish = print_publish
+    with broker:
+        print(json.dumps({'port': broker.port}), flush=True)
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
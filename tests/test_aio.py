@@ -0,0 +1,191 @@
+#!pytest
+# -*- coding: utf-8 -*-
+"""Unit tests for the asyncio processing core."""
+import asyncio
+import io
+import os
+import time
+from configparser import ConfigParser
+
+import pytest
+
+import smlmqttprocessor.aio as aio
+from smlmqttprocessor.aio import FileLineReader, StreamLineReader, open_input
+from smlmqttprocessor.mqtt import MyMqtt
+from smlmqttprocessor.smltextmqttprocessor import processing_loop_async
+from tests.helpers import sml_frames
+from tests.mqttbroker import MqttBrokerStandIn
+
+# do not complain about missing docstring for tests
+# pylint: disable=missing-function-docstring,  missing-class-docstring
+# pylint: disable=line-too-long, too-few-public-methods
+# noqa: D102
+
+FRAMES = sml_frames([100.5, 100.6])
+
+
+async def _async_wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline and not predicate():
+        await asyncio.sleep(0.01)
+    return predicate()
+
+
+class TestReaders:
+
+    @staticmethod
+    def test_file_reader():
+        async def read():
+            reader = FileLineReader(io.BytesIO(b"foo\nbar\n"), yield_every=1)
+            return [await reader.readline() for _ in range(3)]
+
+        assert asyncio.run(read()) == ["foo\n", "bar\n", ""]
+
+    @staticmethod
+    def test_abstract():
+        with pytest.raises(TypeError, match="abstract method"):
+            aio.LineReader()
+
+    @staticmethod
+    def test_stream_reader(monkeypatch):
+        monkeypatch.setattr(aio, 'IDLE_INTERVAL', 0.05)
+
+        async def read():
+            stream = asyncio.StreamReader()
+            reader = StreamLineReader(stream)
+            stream.feed_data(b"foo\n")
+            lines = [await reader.readline(), await reader.readline()]  # 2nd: no data
+            stream.feed_eof()
+            start = time.monotonic()
+            lines.append(await reader.readline())
+            await reader.idle()
+            return lines, time.monotonic() - start
+
+        lines, idle = asyncio.run(read())
+        assert lines == ["foo\n", "", ""]
+        assert idle >= 0.05
+
+    @staticmethod
+    def test_open_input_file(tmp_path):
+        path = tmp_path.joinpath("input.txt")
+        path.write_text(FRAMES)
+
+        async def run():
+            reader = await open_input(str(path))
+            line = await reader.readline()
+            reader.close()
+            return reader, line
+
+        reader, line = asyncio.run(run())
+        assert isinstance(reader, FileLineReader)
+        assert line == "1-0:96.50.1*1#ISK#\n"
+
+    @staticmethod
+    def test_open_input_fifo(tmp_path):
+        path = tmp_path.joinpath("input.fifo")
+        os.mkfifo(path)
+
+        async def run():
+            windows = []
+            reader = await open_input(str(path))
+            # writer opens after the reader, no end of file meanwhile
+            with open(path, 'w', encoding='utf8') as fout:
+                fout.write(FRAMES)
+            await processing_loop_async(reader, 1, windows.append, timeout=1)
+            reader.close()
+            return windows
+
+        assert asyncio.run(run())[:2] == [[{'total': 100.5}], [{'total': 100.6}]]
+
+    @staticmethod
+    def test_many_meters_tcp_and_unix(tmp_path):
+        async def serve(reader, writer):  # pylint: disable=unused-argument
+            writer.write(FRAMES.encode())
+            await writer.drain()
+            writer.close()
+
+        async def run():
+            tcp_server = await asyncio.start_server(serve, '127.0.0.1', 0)
+            unix_server = await asyncio.start_unix_server(serve, str(tmp_path.joinpath("meter.sock")))
+            port = tcp_server.sockets[0].getsockname()[1]
+            windows = {'tcp': [], 'unix': []}
+            readers = [await open_input('tcp:127.0.0.1:%d' % port),
+                       await open_input('unix:%s' % tmp_path.joinpath("meter.sock"))]
+            # both meters concurrently in one event loop
+            await asyncio.gather(processing_loop_async(readers[0], 1, windows['tcp'].append, timeout=1),
+                                 processing_loop_async(readers[1], 1, windows['unix'].append, timeout=1))
+            for reader in readers:
+                reader.close()
+            tcp_server.close()
+            unix_server.close()
+            return windows
+
+        windows = asyncio.run(run())
+        assert windows['tcp'][:2] == windows['unix'][:2] == [[{'total': 100.5}], [{'total': 100.6}]]
+
+
+class TestWindowDeadline:
+
+    @staticmethod
+    def test_deadline():
+        async def run():
+            windows = []
+            stream = asyncio.StreamReader()
+            stream.feed_data(FRAMES.encode())
+            task = asyncio.ensure_future(processing_loop_async(StreamLineReader(stream), 99, windows.append,
+                                                               deadline=0.2))
+            # both complete messages, handled before the window is full
+            assert await _async_wait_for(lambda: windows, timeout=2)
+            task.cancel()
+            return windows
+
+        start = time.monotonic()
+        assert asyncio.run(run()) == [[{'total': 100.5}, {'total': 100.6}]]
+        assert time.monotonic() - start >= 0.2
+
+    @staticmethod
+    def test_no_deadline_when_full():
+        async def run():
+            windows = []
+            stream = asyncio.StreamReader()
+            stream.feed_data(FRAMES.encode())
+            stream.feed_eof()
+            await processing_loop_async(StreamLineReader(stream), 1, windows.append, timeout=1, deadline=0.1)
+            await asyncio.sleep(0.2)
+            return windows
+
+        # full windows, the final flush at the timeout, no (extra) deadline windows
+        assert asyncio.run(run()) == [[{'total': 100.5}], [{'total': 100.6}], [{}]]
+
+
+class TestAsyncioMqttAdapter:
+
+    @staticmethod
+    def test_publish_and_reconnect():
+        data = {'total': [1.1, 2.2], 'actual': [10, 20]}
+
+        async def run(broker):
+            loop = asyncio.get_running_loop()
+            config = ConfigParser()
+            config.read_dict({'Mqtt': {'port': str(broker.port), 'qos': '1'}})
+            mymqtt = MyMqtt(config, loop=loop)
+            mymqtt.connect()
+            assert await _async_wait_for(lambda: mymqtt.connected)
+            assert mymqtt.client._thread is None  # pylint: disable=protected-access
+            # from the event loop (does not block) and from a sink thread
+            mymqtt.send(data)
+            await loop.run_in_executor(None, mymqtt.send, data)
+            assert await _async_wait_for(lambda: len(broker.received) == 2 * (3 + 8))
+            assert await _async_wait_for(lambda: not mymqtt.inflight)
+            # broker drops the connection, reconnected by the adapter
+            broker.disconnect_clients()
+            assert await _async_wait_for(lambda: not mymqtt.connected)
+            assert await _async_wait_for(lambda: mymqtt.connected)
+            mymqtt.send(data)
+            assert await _async_wait_for(lambda: len(broker.received) == 3 * (3 + 8))
+            assert mymqtt.n_reconnects == 2
+            mymqtt.disconnect()
+            await asyncio.sleep(0.1)
+
+        with MqttBrokerStandIn() as broker:
+            asyncio.run(run(broker))
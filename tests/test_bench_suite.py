@@ -0,0 +1,61 @@
+#!pytest
+# -*- coding: utf-8 -*-
+"""Unit tests for the benchmark suite (benchmarks/bench_suite.py)."""
+import json
+
+import pytest
+
+import smlmqttprocessor.smltextmqttprocessor as stmp
+from benchmarks import bench_suite
+
+# do not complain about missing docstring for tests
+# pylint: disable=missing-function-docstring,  missing-class-docstring
+# noqa: D102
+
+
+class TestBenchSuite:
+
+    @staticmethod
+    @pytest.mark.parametrize('name', list(bench_suite.BENCHMARKS))
+    def test_run_benchmark(name):
+        frames = bench_suite.load_capture_frames()
+        result = bench_suite.run_benchmark(name, frames, 60, window_size=15, memory_frames=30)
+        assert result['frames'] == 60
+        assert result['frames_per_s'] > 0
+        assert 0 < result['p50_us'] <= result['p90_us'] <= result['p99_us']
+        assert result['peak_kib'] > 0
+
+    @staticmethod
+    def test_synthetic_frames():
+        frames = bench_suite.synthetic_frames(3)
+        assert len(frames) == 3
+        assert all(stmp.check_stream_packet_begin(frame[0]) for frame in frames)
+        times = [bench_suite._parse_frame(frame)['time'] for frame in frames]  # pylint: disable=protected-access
+        assert times == [times[0], times[0] + 1, times[0] + 2]
+
+    @staticmethod
+    def test_compare():
+        baseline = {'parse_line': {'frames_per_s': 1000, 'p50_us': 10.0, 'peak_kib': 100}}
+        assert not bench_suite.compare({'parse_line': {'frames_per_s': 900, 'p50_us': 11.0, 'peak_kib': 90}},
+                                       baseline, threshold=0.2)
+        regressions = bench_suite.compare(
+            {'parse_line': {'frames_per_s': 700, 'p50_us': 13.0, 'peak_kib': 100},
+             'daily': {'frames_per_s': 1}},  # no baseline
+            baseline, threshold=0.2)
+        assert regressions == ["parse_line frames_per_s: 700 (baseline 1000, -30%)",
+                               "parse_line p50_us: 13.0 (baseline 10.0, +30%)"]
+
+    @staticmethod
+    def test_main(tmp_path, capsys):
+        baseline_file = tmp_path / "baseline.json"
+        argv = ['--frames=30', '--memory-frames=15', '--baseline=%s' % baseline_file, 'daily']
+        assert bench_suite.main(argv) == 0
+        assert "No baseline" in capsys.readouterr().out
+        assert bench_suite.main(argv + ['--save']) == 0
+        assert list(json.loads(baseline_file.read_text())['captures/window=15']) == ['daily']
+        # fake a much faster baseline
+        baselines = json.loads(baseline_file.read_text())
+        baselines['captures/window=15']['daily']['frames_per_s'] *= 100
+        baseline_file.write_text(json.dumps(baselines))
+        assert bench_suite.main(argv) == 1
+        assert "REGRESSION daily frames_per_s" in capsys.readouterr().out
@@ -0,0 +1,80 @@
+#!pytest
+# -*- coding: utf-8 -*-
+"""Unit tests for the in-process daily counters."""
+from configparser import ConfigParser
+from datetime import datetime, timedelta
+
+import pytest
+
+from smlmqttprocessor.daily import DailyCounters, create_daily_counters
+from smlmqttprocessor.mqtt import MyMqtt
+from smlmqttprocessor.utils.rollup import get_timezone
+
+# do not complain about missing docstring for tests
+# pylint: disable=missing-function-docstring,  missing-class-docstring
+# pylint: disable=line-too-long, too-few-public-methods
+# noqa: D102
+
+BERLIN = get_timezone('Europe/Berlin')
+
+
+def _window(daily, timestamp, **records):
+    """Aggregate one window like FanOut, return the d0/d1 of the total fields."""
+    mqttdata = MyMqtt.construct_mqttdata(records)
+    daily.update(records, mqttdata, timestamp)
+    return {name: {stat: value for stat, value in values.items() if stat in ('d0', 'd1')}
+            for name, values in mqttdata.items() if name.startswith('total')}
+
+
+class TestDailyCounters:
+
+    @staticmethod
+    def test_d0_d1():
+        start = datetime(2024, 3, 1, 23, 58, tzinfo=BERLIN).timestamp()
+        daily = DailyCounters(('total', 'total_export'), BERLIN, start)
+        assert _window(daily, start, total=[100.0]) == {'total': {}}
+        assert _window(daily, start + 30, total=[100.5, 101.0], total_export=[5.0, 5.5]) == \
+            {'total': {'d0': 1.0}, 'total_export': {'d0': 0.5}}
+        # next day (local midnight)
+        assert _window(daily, start + 120, total=[101.5, 102.0], total_export=[6.0, 6.25]) == \
+            {'total': {'d0': 0.5, 'd1': 1.0}, 'total_export': {'d0': 0.25, 'd1': 0.5}}
+        assert _window(daily, start + 150, total=[102.25], total_export=[6.5, 6.75]) == \
+            {'total': {'d0': 0.75, 'd1': 1.0}, 'total_export': {'d0': 0.75, 'd1': 0.5}}
+
+    @staticmethod
+    def test_gap():
+        start = datetime(2024, 3, 1, 12, 0, tzinfo=BERLIN).timestamp()
+        daily = DailyCounters(tz=BERLIN, timestamp=start)
+        _window(daily, start, total=[100.0, 101.0])
+        # no readings yesterday
+        assert _window(daily, start + 2 * 86400, total=[110.0, 110.5]) == {'total': {'d0': 0.5}}
+
+    @staticmethod
+    def test_not_configured_fields():
+        daily = DailyCounters(('total',))
+        records = {'actual': [1, 2], 'total_tariff1': [1.0, 2.0]}
+        mqttdata = MyMqtt.construct_mqttdata(records)
+        daily.update(records, mqttdata, datetime.now().timestamp())
+        assert 'd0' not in mqttdata['total_tariff1']
+        assert not daily.today
+
+    @staticmethod
+    def test_create_daily_counters():
+        config = ConfigParser()
+        assert create_daily_counters(config) is None
+        config.read_dict({'Daily': {'in_process': 'true', 'totals': 'total, total_export',
+                                    'timezone': 'Europe/Berlin'}})
+        daily = create_daily_counters(config)
+        assert daily.fields == ('total', 'total_export')
+        assert str(daily.calendar.tz) == 'Europe/Berlin'
+        assert daily.calendar.end - datetime.now().timestamp() <= timedelta(hours=25).total_seconds()
+
+    @staticmethod
+    def test_create_daily_counters_struct():
+        config = ConfigParser()
+        config.read_dict({'Daily': {'in_process': 'true'}, 'Mqtt': {'payload_codec': 'struct'}})
+        # multi-topic, the codec is not used
+        assert create_daily_counters(config)
+        config.set('Mqtt', 'single_topic', 'true')
+        with pytest.raises(ValueError, match="not supported with the single-topic payload_codec=struct"):
+            create_daily_counters(config)
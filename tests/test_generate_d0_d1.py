@@ -2,13 +2,15 @@
 # -*- coding: utf-8 -*-
 """Unit tests."""
 import logging
+from configparser import ConfigParser
 from pathlib import Path
 
 import paho.mqtt.client as mqtt
 import pytest
 
 import generate_d0_d1
-from generate_d0_d1 import main
+from generate_d0_d1 import create_client, main
+from tests.mqttbroker import MqttBrokerStandIn, wait_for
 
 
 # do not complain about missing docstring for tests
@@ -57,3 +59,87 @@ class TestMain:
         stdout, stderr = capsys.readouterr()
         assert stdout == ''
         assert stderr == ''
+
+
+class TestEndToEnd:
+    """Run against the local MQTT broker stand-in."""
+
+    @staticmethod
+    def test_d0_retained_offset():
+        with MqttBrokerStandIn() as broker:
+            broker.retained[generate_d0_d1.MQTT_TOPIC_D0] = b'1.5'
+            config = ConfigParser()
+            config.read_dict({'Mqtt': {'port': str(broker.port)}})
+            client = create_client(config)
+            client.loop_start()
+            monitor = client._userdata  # pylint: disable=protected-access
+            assert wait_for(lambda: monitor.d0_retained == 1.5)
+
+            publisher = mqtt.Client()
+            publisher.connect('127.0.0.1', broker.port)
+            publisher.loop_start()
+            for value in (100.0, 100.25, 101.0):
+                publisher.publish(generate_d0_d1.MQTT_TOPIC_SMARTMETER_TOTAL, str(value))
+            assert wait_for(lambda: broker.retained.get(generate_d0_d1.MQTT_TOPIC_D0) == b'2.5')
+            d0 = [p for p in broker.received if p.topic == generate_d0_d1.MQTT_TOPIC_D0]
+            assert [p.payload for p in d0] == [b'1.75', b'2.5']
+            assert all(p.retain for p in d0)
+            for mqtt_client in (publisher, client):
+                mqtt_client.disconnect()
+                mqtt_client.loop_stop()
+
+    @staticmethod
+    def test_checkpoint(tmp_path):
+        checkpoint_file = tmp_path.joinpath("state.json")
+        monitor = generate_d0_d1.DailyEnergyMonitor(checkpoint_file=checkpoint_file)
+        monitor.add_value(100.0)
+        monitor.add_value(101.0)
+        monitor.checkpoint(force=True)
+        with MqttBrokerStandIn() as broker:
+            # outdated retained value, must not be used as offset
+            broker.retained[generate_d0_d1.MQTT_TOPIC_D0] = b'0.5'
+            config = ConfigParser()
+            config.read_dict({'Mqtt': {'port': str(broker.port)},
+                              'Daily': {'checkpoint_file': str(checkpoint_file)}})
+            client = create_client(config)
+            client.loop_start()
+            restored = client._userdata  # pylint: disable=protected-access
+            assert restored.d0 == 1.0
+            publisher = mqtt.Client()
+            publisher.connect('127.0.0.1', broker.port)
+            publisher.loop_start()
+            publisher.publish(generate_d0_d1.MQTT_TOPIC_SMARTMETER_TOTAL, '102.5')
+            assert wait_for(lambda: broker.retained.get(generate_d0_d1.MQTT_TOPIC_D0) == b'2.5')
+            assert restored.d0_retained is None
+            for mqtt_client in (publisher, client):
+                mqtt_client.disconnect()
+                mqtt_client.loop_stop()
+
+    @staticmethod
+    def test_wildcard_meters():
+        with MqttBrokerStandIn() as broker:
+            config = ConfigParser()
+            config.read_dict({'Mqtt': {'port': str(broker.port)},
+                              'Daily': {'source_topic': 'tele/+/total/value', 'checkpoint_file': ''}})
+            client = create_client(config)
+            subscribed = []
+            client.on_subscribe = lambda *args: subscribed.append(args)
+            client.loop_start()
+            registry = client._userdata  # pylint: disable=protected-access
+            assert wait_for(lambda: subscribed)
+
+            publisher = mqtt.Client()
+            publisher.connect('127.0.0.1', broker.port)
+            publisher.loop_start()
+            for topic, value in (('tele/meter1/total/value', 100.0), ('tele/meter2/total/value', 7.0),
+                                 ('tele/meter1/total/value', 100.5), ('tele/meter2/total/value', 9.0)):
+                publisher.publish(topic, str(value))
+            assert wait_for(lambda: {'tele/meter1/total/d0', 'tele/meter2/total/d0'} <= set(broker.retained))
+            assert broker.retained['tele/meter1/total/d0'] == b'0.5'
+            assert broker.retained['tele/meter2/total/d0'] == b'2.0'
+            assert sorted(registry.monitors) == ['tele/meter1/total/value', 'tele/meter2/total/value']
+            # no retained offsets in multi-meter mode
+            assert not any(p.topic == generate_d0_d1.MQTT_TOPIC_D0 for p in broker.received)
+            for mqtt_client in (publisher, client):
+                mqtt_client.disconnect()
+                mqtt_client.loop_stop()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Unit tests."""
+import csv
+import gzip
+import io
+import json
+import logging
+from configparser import ConfigParser
+from datetime import date, datetime, timedelta
+
+import generate_d0_d1
+from generate_d0_d1 import backfill, main, read_records, ReplayClock, run_backfill, write_days_csv
+from smlmqttprocessor.utils.rollup import get_timezone
+from tests.mqttbroker import MqttBrokerStandIn
+
+
+# do not complain about missing docstring for tests
+# pylint: disable=missing-function-docstring,  missing-class-docstring
+# pylint: disable=line-too-long, too-few-public-methods
+# noqa: D102
+
+BERLIN = get_timezone('Europe/Berlin')
+TOPIC = 'tele/smartmeter/total/value'
+
+
+def _dump_lines(start: datetime, days: int, topic: str = TOPIC, step: int = 900, increment: float = 0.25):
+    """MQTT dump (mosquitto_sub -v -F '%U %t %p') of whole local days, one reading per step seconds."""
+    timestamp = start.timestamp()
+    end = datetime.combine(start.date() + timedelta(days=days), start.time(), start.tzinfo).timestamp()
+    value = 1000.0
+    while timestamp < end:
+        yield f"{timestamp:.6f} {topic} {value}"
+        timestamp += step
+        value += increment
+
+
+class TestReadRecords:
+
+    @staticmethod
+    def test_mqtt_dump():
+        lines = ["1700000000.123456 tele/smartmeter/total/value 1234.5\n",
+                 "2024-03-01T12:00:00+01:00 tele/meter2/total/value 7\n",
+                 "\n"]
+        assert list(read_records(lines)) == [
+            (1700000000.123456, 'tele/smartmeter/total/value', 1234.5),
+            (datetime(2024, 3, 1, 11, 0, tzinfo=get_timezone('UTC')).timestamp(), 'tele/meter2/total/value', 7.0)]
+
+    @staticmethod
+    def test_capture():
+        lines = [json.dumps({'timestamp': 1700000000.5, 'data': {'total': {'value': 1234.5, 'first': 1234.4},
+                                                                 'actual': {'mean': 160.0}}}),
+                 json.dumps({'timestamp': 1700000010.5, 'data': {'actual': {'mean': 160.0}}})]
+        assert list(read_records(lines, topic='foo/value')) == [(1700000000.5, 'foo/value', 1234.5)]
+
+    @staticmethod
+    def test_invalid(caplog):
+        lines = ["1700000000 tele/smartmeter/total/value",
+                 "yesterday tele/smartmeter/total/value 1.0",
+                 "1700000000 tele/smartmeter/total/value nan-ish",
+                 '{"timestamp": 1}',
+                 '{"timestamp": 1, "data": {"total": 5}}',
+                 "1700000001 tele/smartmeter/total/value 2.0"]
+        assert list(read_records(lines)) == [(1700000001.0, 'tele/smartmeter/total/value', 2.0)]
+        assert "Skipped 5 invalid lines" in caplog.text
+
+
+class TestBackfill:
+
+    @staticmethod
+    def test_replay_clock():
+        clock = ReplayClock(5.0)
+        assert clock() == 5.0
+        clock.now = 7.5
+        assert clock() == 7.5
+
+    @staticmethod
+    def test_days():
+        start = datetime(2024, 3, 29, tzinfo=BERLIN)
+        days = list(backfill(read_records(_dump_lines(start, 4)), BERLIN))
+        assert [(topic, day.date) for topic, day in days] == [(TOPIC, date(2024, 3, 29) + timedelta(days=i)) for i in range(4)]
+        # every 15 min, 2024-03-31 has 23 h
+        assert [day.count for _, day in days] == [96, 96, 92, 96]
+        assert [day.consumption for _, day in days] == [95 * 0.25, 95 * 0.25, 91 * 0.25, 95 * 0.25]
+
+    @staticmethod
+    def test_topics():
+        start = datetime(2024, 3, 1, tzinfo=BERLIN)
+        # one file after the other, not interleaved
+        lines = list(_dump_lines(start, 2, topic='tele/m1/total/value')) + \
+            list(_dump_lines(start, 1, topic='tele/m2/total/value', increment=1.0))
+        days = [(topic, day.date, day.consumption) for topic, day in backfill(read_records(lines), BERLIN)]
+        assert days == [('tele/m1/total/value', date(2024, 3, 1), 95 * 0.25),
+                        ('tele/m1/total/value', date(2024, 3, 2), 95 * 0.25),
+                        ('tele/m2/total/value', date(2024, 3, 1), 95.0)]
+
+    @staticmethod
+    def test_gap():
+        start = datetime(2024, 3, 1, tzinfo=BERLIN)
+        lines = list(_dump_lines(start, 1)) + list(_dump_lines(start + timedelta(days=3), 1))
+        assert [day.date for _, day in backfill(read_records(lines), BERLIN)] == [date(2024, 3, 1), date(2024, 3, 4)]
+
+    @staticmethod
+    def test_write_days_csv():
+        start = datetime(2024, 3, 1, tzinfo=BERLIN)
+        fout = io.StringIO()
+        write_days_csv(backfill(read_records(_dump_lines(start, 1)), BERLIN), fout)
+        rows = list(csv.reader(io.StringIO(fout.getvalue())))
+        assert rows == [['topic', 'date', 'consumption', 'first', 'last', 'min', 'max', 'count'],
+                        [TOPIC, '2024-03-01', '23.75', '1000.0', '1023.75', '1000.0', '1023.75', '96']]
+
+
+class TestRunBackfill:
+
+    @staticmethod
+    def test_main_csv(monkeypatch, tmp_path, caplog):
+        config_file = tmp_path.joinpath("config.ini")
+        config_file.write_text("[Daily]\ntimezone=Europe/Berlin\n")
+        monkeypatch.setattr(generate_d0_d1, "CONFIG_FILENAME", config_file)
+        dump_file = tmp_path.joinpath("dump.txt.gz")
+        with gzip.open(dump_file, 'wt', encoding='utf8') as fout:
+            fout.write("\n".join(_dump_lines(datetime(2024, 10, 27, tzinfo=BERLIN), 1)))
+        csv_file = tmp_path.joinpath("days.csv")
+        caplog.set_level(logging.DEBUG)
+        main(['backfill', f'--csv={csv_file}', str(dump_file)])
+        rows = list(csv.reader(csv_file.read_text(encoding='utf8').splitlines()))
+        # 25 h, every 15 min
+        assert rows[1][1:3] == ['2024-10-27', '24.75']
+        assert rows[1][-1] == '100'
+        # logging level restored
+        assert logging.getLogger().level == logging.DEBUG
+
+    @staticmethod
+    def test_stdout(tmp_path, capsys):
+        dump_file = tmp_path.joinpath("dump.txt")
+        dump_file.write_text("\n".join(_dump_lines(datetime(2024, 3, 1, tzinfo=BERLIN), 1)))
+        days = run_backfill(ConfigParser(), [str(dump_file)], timezone='Europe/Berlin')
+        assert len(days) == 1
+        stdout, _ = capsys.readouterr()
+        assert stdout.splitlines()[1].startswith(f'{TOPIC},2024-03-01,23.75,')
+
+    @staticmethod
+    def test_publish(tmp_path):
+        dump_file = tmp_path.joinpath("dump.txt")
+        dump_file.write_text("\n".join(_dump_lines(datetime(2024, 3, 1, tzinfo=BERLIN), 2)))
+        with MqttBrokerStandIn() as broker:
+            config = ConfigParser()
+            config.read_dict({'Mqtt': {'port': str(broker.port)}, 'Daily': {'timezone': 'Europe/Berlin'}})
+            run_backfill(config, [str(dump_file)], publish=True)
+            assert broker.retained == {'tele/smartmeter/total/day/2024-03-01': b'23.75',
+                                       'tele/smartmeter/total/day/2024-03-02': b'23.75'}
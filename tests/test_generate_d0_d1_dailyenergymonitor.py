@@ -1,17 +1,33 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 """Unit tests."""
+import configparser
+import json
 import logging
-from datetime import datetime, timedelta
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
 
 import generate_d0_d1
 from generate_d0_d1 import (
+    ChangePublisher,
+    create_monitors,
     DailyEnergyMonitor,
+    DayCounter,
+    handle_meter_message,
     handle_smartmeter_message,
     handle_retained_dx_message,
+    MeterRegistry,
+    parse_total,
     MQTT_TOPIC_D0,
-    MQTT_TOPIC_D1
+    MQTT_TOPIC_D1,
+    SML_FIELD_NAMES
 )
+from smlmqttprocessor.payload import PayloadEncoder
+from smlmqttprocessor.utils.rollup import CalendarClock, get_timezone
 
 
 # do not complain about missing docstring for tests
@@ -27,7 +43,8 @@ class TestDailyEnergyMonitorConstructor:
     def test_constructor():
         instance = DailyEnergyMonitor()
         assert instance.retain
-        assert not instance.data  # it is []
+        assert instance.today.count == 0
+        assert instance.yesterday is None
         assert instance.d0 is None
         assert instance.d1 is None
         assert instance.current_date == datetime.now().date()
@@ -49,7 +66,7 @@ class TestDailyEnergyMonitorAddValue:
         instance.add_value(200)
         instance.add_value(300)
         # check
-        assert len(instance.data) == 3
+        assert instance.today.count == 3
         assert instance.d0 == 300 - 100
         assert not instance.d1
         instance.add_value(330)
@@ -64,11 +81,11 @@ class TestDailyEnergyMonitorAddValue:
             instance = DailyEnergyMonitor()
             instance.add_value(1111)
         # check
-        assert len(instance.data) == 1
+        assert instance.today.count == 1
         assert instance.d0 is None
         assert instance.d1 is None
-        assert caplog.text == ('DEBUG    root:generate_d0_d1.py:74 new size of data[] is 1\n'
-                               'DEBUG    root:generate_d0_d1.py:86 d0 delta: not enough data yet\n')
+        assert caplog.text == ('DEBUG    root:generate_d0_d1.py:237 number of readings today: 1\n'
+                               'DEBUG    root:generate_d0_d1.py:249 d0 delta: not enough data yet\n')
 
     @staticmethod
     def test_retain(caplog):
@@ -80,7 +97,7 @@ class TestDailyEnergyMonitorAddValue:
             instance.add_value(200)
             instance.add_value(300)
         # check
-        assert len(instance.data) == 3
+        assert instance.today.count == 3
         assert instance.d0 == 300 - 100 + 444
         assert not instance.d1
         instance.add_value(330)
@@ -103,24 +120,24 @@ class TestDailyEnergyMonitorAddValue:
         # now mock the new day
         monkeypatch.setattr(DailyEnergyMonitor, "_check_is_new_day", lambda _, __: True)
         # also need to mock the calculation methods because mocking of datetime.now() did not work for me
-        monkeypatch.setattr(DailyEnergyMonitor, "calculate_consumption_today", lambda _: 888)
-        monkeypatch.setattr(DailyEnergyMonitor, "calculate_consumption_yesterday", lambda _: 1234)
+        monkeypatch.setattr(DailyEnergyMonitor, "calculate_consumption_today", lambda _, today=None: 888)
+        monkeypatch.setattr(DailyEnergyMonitor, "calculate_consumption_yesterday", lambda _, today=None: 1234)
         # add further data (now in new day)
         instance.add_value(3000)
         assert instance.d0 == 888
         assert instance.d0_retained == 0  # this is being reset
         assert instance.d1 == 1234
         assert instance.d1_retained == 1234
-        assert caplog.text == ('DEBUG    root:generate_d0_d1.py:74 new size of data[] is 1\n'
-                               'DEBUG    root:generate_d0_d1.py:86 d0 delta: not enough data yet\n'
-                               'DEBUG    root:generate_d0_d1.py:74 new size of data[] is 2\n'
-                               'DEBUG    root:generate_d0_d1.py:79 d0 delta since start: 400.00\n'
-                               'INFO     root:generate_d0_d1.py:84 d0: 400.00\n'
-                               'DEBUG    root:generate_d0_d1.py:74 new size of data[] is 3\n'
-                               'DEBUG    root:generate_d0_d1.py:79 d0 delta since start: 888.00\n'
-                               'INFO     root:generate_d0_d1.py:84 d0: 888.00\n'
-                               'DEBUG    root:generate_d0_d1.py:98 d1 delta since start: 1234.00\n'
-                               'INFO     root:generate_d0_d1.py:104 d1: 1234.00\n')
+        assert caplog.text == ('DEBUG    root:generate_d0_d1.py:237 number of readings today: 1\n'
+                               'DEBUG    root:generate_d0_d1.py:249 d0 delta: not enough data yet\n'
+                               'DEBUG    root:generate_d0_d1.py:237 number of readings today: 2\n'
+                               'DEBUG    root:generate_d0_d1.py:242 d0 delta since start: 400.00\n'
+                               'INFO     root:generate_d0_d1.py:247 d0: 400.00\n'
+                               'DEBUG    root:generate_d0_d1.py:237 number of readings today: 3\n'
+                               'DEBUG    root:generate_d0_d1.py:242 d0 delta since start: 888.00\n'
+                               'INFO     root:generate_d0_d1.py:247 d0: 888.00\n'
+                               'DEBUG    root:generate_d0_d1.py:263 d1 delta since start: 1234.00\n'
+                               'INFO     root:generate_d0_d1.py:268 d1: 1234.00\n')
 
     @staticmethod
     def test_yesterday_noyesterdaydata(monkeypatch):
@@ -129,9 +146,9 @@ class TestDailyEnergyMonitorAddValue:
         # now mock the new day
         monkeypatch.setattr(DailyEnergyMonitor, "_check_is_new_day", lambda _, __: True)
         # also need to mock the calculation methods because mocking of datetime.now() did not work for me
-        monkeypatch.setattr(DailyEnergyMonitor, "calculate_consumption_today", lambda _: 888)
+        monkeypatch.setattr(DailyEnergyMonitor, "calculate_consumption_today", lambda _, today=None: 888)
         # tell that there's no data for yesterday
-        monkeypatch.setattr(DailyEnergyMonitor, "calculate_consumption_yesterday", lambda _: None)
+        monkeypatch.setattr(DailyEnergyMonitor, "calculate_consumption_yesterday", lambda _, today=None: None)
         # add further data (now in new day)
         instance.add_value(3000)
         assert instance.d0 == 888
@@ -145,14 +162,10 @@ class TestDailyEnergyMonitorToday:
 
     @staticmethod
     def test_simple():
-        now = datetime.now()
         instance = DailyEnergyMonitor()
-        instance.data = [
-            {'timestamp': now + timedelta(minutes=0), 'value': 111},
-            {'timestamp': now + timedelta(minutes=1), 'value': 222},
-            {'timestamp': now + timedelta(minutes=2), 'value': 333},
-        ]
-        assert len(instance.data) == 3
+        for value in (111, 222, 333):
+            instance.today.add(value)
+        assert instance.today.count == 3
         actual = instance.calculate_consumption_today()
         assert actual == 333 - 111
 
@@ -160,7 +173,7 @@ class TestDailyEnergyMonitorToday:
     def test_toolittledata():
         instance = DailyEnergyMonitor()
         instance.add_value(11)  # only 1 value
-        assert len(instance.data) == 1
+        assert instance.today.count == 1
         actual = instance.calculate_consumption_today()
         assert actual is None
 
@@ -170,29 +183,269 @@ class TestDailyEnergyMonitorYesterday:
 
     @staticmethod
     def test_simple():
-        yesterday = datetime.now() - timedelta(days=1)
+        yesterday = datetime.now().date() - timedelta(days=1)
         instance = DailyEnergyMonitor()
-        instance.data = [
-            {'timestamp': yesterday, 'value': 111},
-            {'timestamp': yesterday + timedelta(minutes=1), 'value': 222},
-            {'timestamp': yesterday + timedelta(minutes=2), 'value': 333},
-        ]
-        assert len(instance.data) == 3
+        counter = DayCounter(yesterday)
+        for value in (111, 222, 333):
+            counter.add(value)
+        instance.days.insert(0, counter)
         actual = instance.calculate_consumption_yesterday()
         assert actual == 333 - 111
 
     @staticmethod
     def test_only1entry():
-        yesterday = datetime.now() - timedelta(days=1)
+        yesterday = datetime.now().date() - timedelta(days=1)
         instance = DailyEnergyMonitor()
-        instance.data = [
-            {'timestamp': yesterday, 'value': 111},
-        ]
-        assert len(instance.data) == 1
+        counter = DayCounter(yesterday)
+        counter.add(111)
+        instance.days.insert(0, counter)
         actual = instance.calculate_consumption_yesterday()
         assert actual is None
 
 
+class TestDailyEnergyMonitorRollover:
+    """Day change with the real per-day counters (no mocked calculations)."""
+
+    @staticmethod
+    def _mock_now(monkeypatch, now):
+        # now[0] is a naive (system local time) datetime
+        monkeypatch.setattr(generate_d0_d1, "time", SimpleNamespace(time=lambda: now[0].timestamp(),
+                                                                    monotonic=time.monotonic))
+
+    @staticmethod
+    def test_clock_read_once(monkeypatch):
+        calls = []
+        monkeypatch.setattr(generate_d0_d1, "time", SimpleNamespace(time=lambda: calls.append(1) or 1709330400.0,
+                                                                    monotonic=time.monotonic))
+        instance = DailyEnergyMonitor()
+        calls.clear()
+        instance.add_value(100)
+        instance.add_value(110)
+        assert len(calls) == 2
+        assert instance.d0 == 10
+
+    def test_new_day(self, monkeypatch):
+        now = [datetime(2024, 3, 1, 23, 0)]
+        self._mock_now(monkeypatch, now)
+        instance = DailyEnergyMonitor()
+        for value in (100, 150, 170):
+            instance.add_value(value)
+            now[0] += timedelta(minutes=20)
+        assert instance.d0 == 70
+        assert instance.d1 is None
+        # next day
+        instance.add_value(175)
+        assert instance.d1 == 70
+        assert instance.yesterday.date == datetime(2024, 3, 1).date()
+        instance.add_value(185)
+        assert instance.d0 == 10
+        assert instance.today.count == 2
+
+    def test_bounded_memory(self, monkeypatch):
+        now = [datetime(2024, 3, 1, 0, 0)]
+        self._mock_now(monkeypatch, now)
+        instance = DailyEnergyMonitor()
+        value = 1000.0
+        for _ in range(10 * 24 * 4):  # 10 days, every 15 min
+            instance.add_value(value)
+            value += 0.25
+            now[0] += timedelta(minutes=15)
+        # only today and yesterday are kept, no raw readings
+        assert instance.today.count == 96
+        assert instance.yesterday.count == 96
+        assert instance.d0 == 95 * 0.25
+        # no drift
+        assert instance.d1 == 95 * 0.25
+        assert not hasattr(instance, 'data')
+        assert len(instance.days) == 2
+
+    @staticmethod
+    def test_gap_of_days(monkeypatch):
+        now = [datetime(2024, 3, 1, 12, 0)]
+        TestDailyEnergyMonitorRollover._mock_now(monkeypatch, now)
+        instance = DailyEnergyMonitor()
+        instance.add_value(100)
+        instance.add_value(110)
+        now[0] += timedelta(days=3)
+        instance.add_value(200)
+        # no readings yesterday
+        assert instance.yesterday is None
+        assert instance.calculate_consumption_yesterday() is None
+
+    @staticmethod
+    def test_dst_25h_day(monkeypatch):
+        berlin = get_timezone('Europe/Berlin')
+        now = [datetime(2024, 10, 26, 12, 0, tzinfo=berlin)]
+        TestDailyEnergyMonitorRollover._mock_now(monkeypatch, now)
+        instance = DailyEnergyMonitor(calendar=CalendarClock('day', berlin, now[0].timestamp()))
+        value = 100.0
+        end = datetime(2024, 10, 28, 0, 0, tzinfo=berlin).timestamp()
+        while now[0].timestamp() < end:
+            instance.add_value(value)
+            value += 0.25
+            # absolute time, i.e. 15 min in UTC
+            now[0] = (now[0].astimezone(timezone.utc) + timedelta(minutes=15)).astimezone(berlin)
+        # the day of the changeover to CET (2024-10-27) has 25 h
+        assert instance.today.date == datetime(2024, 10, 27).date()
+        assert instance.today.count == 25 * 4
+        assert instance.d0 == (25 * 4 - 1) * 0.25
+        # rollover at local midnight
+        instance.add_value(value)
+        assert instance.d1 == (25 * 4 - 1) * 0.25
+
+
+class TestDailyEnergyMonitorHistory:
+    """d2..dN and week-/month-/year-to-date."""
+
+    def test_history_days(self, monkeypatch):
+        now = [datetime(2024, 2, 26, 0, 0)]  # Monday
+        TestDailyEnergyMonitorRollover._mock_now(monkeypatch, now)
+        instance = DailyEnergyMonitor(history_days=7, periods=('week', 'month', 'year'))
+        value = 1000.0
+        for _ in range(10 * 24):  # 10 days, hourly, 1 kWh per hour
+            instance.add_value(value)
+            value += 1
+            now[0] += timedelta(hours=1)
+        # 2024-03-07 00:00, first reading today
+        instance.add_value(value)
+        assert len(instance.days) == 8
+        actual = instance.history_values()
+        assert actual == {'d2': 23, 'd3': 23, 'd4': 23, 'd5': 23, 'd6': 23, 'd7': 23,
+                          'wtd': 10 * 24 - 7 * 24,  # since Monday 2024-03-04 00:00
+                          'mtd': 6 * 24,  # since 2024-03-01 00:00
+                          'ytd': 10 * 24}  # since program start
+
+    @staticmethod
+    def test_defaults():
+        instance = DailyEnergyMonitor()
+        instance.add_value(100)
+        instance.add_value(110)
+        assert instance.history_values() == {}
+        assert instance.history_days == 1
+
+    @staticmethod
+    def test_unknown_period():
+        with pytest.raises(ValueError, match="Unknown period"):
+            DailyEnergyMonitor(periods=('decade',))
+
+    @staticmethod
+    def test_gap(monkeypatch):
+        now = [datetime(2024, 3, 1, 12, 0)]
+        TestDailyEnergyMonitorRollover._mock_now(monkeypatch, now)
+        instance = DailyEnergyMonitor(history_days=3)
+        instance.add_value(100)
+        instance.add_value(110)
+        now[0] += timedelta(days=2)
+        instance.add_value(200)
+        assert instance.history_values() == {'d2': 10}
+        now[0] += timedelta(days=2)
+        instance.add_value(300)
+        assert instance.history_values() == {}
+
+
+class TestDailyEnergyMonitorCheckpoint:
+    """Checkpoints of the state."""
+
+    @staticmethod
+    def test_restart_stale_d1(monkeypatch, tmp_path):
+        now = [datetime(2024, 3, 1, 22, 0)]
+        TestDailyEnergyMonitorRollover._mock_now(monkeypatch, now)
+        checkpoint_file = tmp_path.joinpath("state.json")
+        instance = DailyEnergyMonitor(checkpoint_file=checkpoint_file, checkpoint_interval=0)
+        for value in (100, 120, 150, 160):
+            instance.add_value(value)
+            now[0] += timedelta(hours=1)
+        assert instance.d1 == 20
+        # restart two days later
+        now[0] += timedelta(days=2)
+        restarted = DailyEnergyMonitor(checkpoint_file=checkpoint_file)
+        assert restarted.load_checkpoint()
+        assert restarted.d1 == 0
+        restarted.add_value(200)
+        assert restarted.d1 == 0
+        # restart the next day: yesterday's counter is there
+        now[0] = datetime(2024, 3, 3, 1, 0)
+        restarted = DailyEnergyMonitor(checkpoint_file=checkpoint_file)
+        assert restarted.load_checkpoint()
+        assert restarted.d1 == 20
+
+    @staticmethod
+    def test_abstract():
+        class Incomplete(generate_d0_d1._Checkpointing):  # pylint: disable=protected-access
+            def get_state(self):
+                return {}
+
+        with pytest.raises(TypeError, match="abstract method"):
+            Incomplete()
+
+    @staticmethod
+    def test_restart_exact(monkeypatch, tmp_path):
+        now = [datetime(2024, 3, 1, 22, 0)]
+        TestDailyEnergyMonitorRollover._mock_now(monkeypatch, now)
+        checkpoint_file = tmp_path.joinpath("state.json")
+        instance = DailyEnergyMonitor(history_days=3, periods=('week', 'year'),
+                                      checkpoint_file=checkpoint_file, checkpoint_interval=0)
+        for value in (100, 120, 150, 160, 200):
+            instance.add_value(value)
+            now[0] += timedelta(hours=1)
+        assert checkpoint_file.is_file()
+        assert not tmp_path.joinpath("state.json.tmp").exists()
+        # restart
+        restarted = DailyEnergyMonitor(history_days=3, periods=('week', 'year'),
+                                       checkpoint_file=checkpoint_file)
+        assert restarted.load_checkpoint()
+        assert restarted.get_state() == instance.get_state()
+        restarted.add_value(210)
+        instance.add_value(210)
+        assert restarted.d0 == instance.d0 == 210 - 150
+        assert restarted.d1 == instance.d1 == 120 - 100
+        assert restarted.history_values() == instance.history_values() == {'ytd': 110, 'wtd': 110}
+
+    @staticmethod
+    def test_interval(tmp_path):
+        checkpoint_file = tmp_path.joinpath("state.json")
+        instance = DailyEnergyMonitor(checkpoint_file=checkpoint_file, checkpoint_interval=3600)
+        instance.add_value(100)
+        assert not checkpoint_file.exists()
+        instance.checkpoint(force=True)
+        assert json.loads(checkpoint_file.read_text())['days'][-1][1:] == [100, 100, 100, 100, 1]
+
+    @staticmethod
+    def test_no_readings(tmp_path):
+        checkpoint_file = tmp_path.joinpath("state.json")
+        instance = DailyEnergyMonitor(checkpoint_file=checkpoint_file, checkpoint_interval=0)
+        instance.checkpoint(force=True)
+        assert not checkpoint_file.exists()
+        assert not instance.load_checkpoint()
+
+    @staticmethod
+    def test_invalid(tmp_path, caplog):
+        checkpoint_file = tmp_path.joinpath("state.json")
+        checkpoint_file.write_text('{"version": 99}')
+        instance = DailyEnergyMonitor(checkpoint_file=checkpoint_file)
+        assert not instance.load_checkpoint()
+        assert "Unsupported checkpoint version 99" in caplog.text
+
+    @staticmethod
+    def test_write_error(tmp_path, caplog):
+        instance = DailyEnergyMonitor(checkpoint_file=tmp_path.joinpath("missing", "state.json"),
+                                      checkpoint_interval=0)
+        instance.add_value(100)
+        assert "Checkpoint failed!" in caplog.text
+
+
+class TestDayCounter:
+
+    @staticmethod
+    def test_add():
+        counter = DayCounter(datetime(2024, 3, 1).date())
+        assert counter.consumption is None
+        for value in (10.0, 9.0, 12.5, 11.0):
+            counter.add(value)
+        assert (counter.first, counter.last, counter.min, counter.max, counter.count) == (10.0, 11.0, 9.0, 12.5, 4)
+        assert counter.consumption == 1.0
+
+
 class TestHandleSmartmeterMessage:
 
     @staticmethod
@@ -212,10 +465,18 @@ class TestHandleSmartmeterMessage:
                 self.d1 = 200.5678
                 self.retain = True
                 self.last_value = None
+                self.current_date = None
 
             def add_value(self, value):
                 self.last_value = value
 
+            @staticmethod
+            def history_values(today=None):
+                return {'d2': 300.123, 'ytd': 5000.0}
+
+            topics = {'ytd': 'foo/ytd'}
+            publisher = ChangePublisher(resolution=0, max_interval=0)
+
         class MockMessage:
             def __init__(self, payload):
                 self.payload = payload
@@ -232,7 +493,9 @@ class TestHandleSmartmeterMessage:
         # checks
         assert mock_userdata.last_value == 50.5
         assert mock_client.published_messages == [('tele/smartmeter/total/d0', 100.12, True),
-                                                  ('tele/smartmeter/total/d1', 200.57, True)]
+                                                  ('tele/smartmeter/total/d1', 200.57, True),
+                                                  ('tele/smartmeter/total/d2', 300.12, True),
+                                                  ('foo/ytd', 5000.0, True)]
 
         # -------------------------------------------------
         # with DEBUG=True -> do not publish
@@ -242,6 +505,236 @@ class TestHandleSmartmeterMessage:
         assert not mock_client.published_messages
 
 
+class TestMeterRegistry:
+
+    class MockClient:
+        def __init__(self):
+            self.published_messages = []
+
+        def publish(self, topic, payload, retain=False):
+            self.published_messages.append((topic, payload, retain))
+
+    class MockMessage:
+        def __init__(self, topic, payload):
+            self.topic = topic
+            self.payload = payload
+
+    @staticmethod
+    def _config(**daily):
+        config = configparser.ConfigParser()
+        config.read_dict({'Daily': daily})
+        return config
+
+    @staticmethod
+    def test_lazy_creation(caplog):
+        caplog.set_level(logging.INFO)
+        registry = MeterRegistry(DailyEnergyMonitor)
+        assert not registry.monitors
+        meter1 = registry.get('tele/meter1/total/value')
+        assert registry.get('tele/meter1/total/value') is meter1
+        assert registry.get('tele/meter2/total/value') is not meter1
+        assert list(registry.monitors) == ['tele/meter1/total/value', 'tele/meter2/total/value']
+        assert 'New meter: tele/meter2/total/value (#2)' in caplog.text
+
+    @staticmethod
+    def test_handle_meter_message():
+        registry = MeterRegistry(lambda: DailyEnergyMonitor(publisher=ChangePublisher(0, 0)))
+        client = TestMeterRegistry.MockClient()
+        for topic, payload in (('tele/meter1/total/value', b"100.0"),
+                               ('tele/meter2/total/value', b"5.0"),
+                               ('tele/meter1/total/value', b"101.5"),
+                               ('tele/meter2/total/value', b"7.25")):
+            handle_meter_message(client, registry, TestMeterRegistry.MockMessage(topic, payload))
+        assert client.published_messages == [('tele/meter1/total/d0', 1.5, True),
+                                             ('tele/meter2/total/d0', 2.25, True)]
+
+    @staticmethod
+    def test_checkpoint(tmp_path):
+        path = tmp_path / 'state.json'
+        registry = MeterRegistry(DailyEnergyMonitor, checkpoint_file=path)
+        registry.get('tele/meter1/total/value').add_value(100.0)
+        registry.get('tele/meter1/total/value').add_value(103.0)
+        registry.get('tele/meter2/total/value').add_value(5.0)
+        registry.checkpoint(force=True)
+        assert set(json.loads(path.read_text())['meters']) == {'tele/meter1/total/value',
+                                                               'tele/meter2/total/value'}
+
+        restored = MeterRegistry(DailyEnergyMonitor, checkpoint_file=path)
+        assert restored.load_checkpoint()
+        assert restored.get('tele/meter1/total/value').today.consumption == 3.0
+        assert restored.get('tele/meter2/total/value').today.count == 1
+
+    @staticmethod
+    def test_create_monitors():
+        monitor, topic = create_monitors(TestMeterRegistry._config())
+        assert isinstance(monitor, DailyEnergyMonitor)
+        assert topic == 'tele/smartmeter/total/value'
+
+        registry, topic = create_monitors(TestMeterRegistry._config(
+            source_topic='tele/+/total/value', history_days='3', publish_resolution='0.5'))
+        assert isinstance(registry, MeterRegistry)
+        assert topic == 'tele/+/total/value'
+        meter1 = registry.get('tele/meter1/total/value')
+        meter2 = registry.get('tele/meter2/total/value')
+        assert meter1.history_days == 3
+        assert meter1.publisher is not meter2.publisher
+        assert meter1.publisher.resolution == 0.5
+
+        with pytest.raises(ValueError):
+            create_monitors(TestMeterRegistry._config(source_topic='tele/meters/#'))
+        with pytest.raises(ValueError):
+            create_monitors(TestMeterRegistry._config(source_topic='tele/+'))
+
+    @staticmethod
+    def test_create_monitors_single_topic():
+        config = configparser.ConfigParser()
+        config.read_dict({'Mqtt': {'single_topic': 'true', 'topic_prefix': 'tele/meter1'}})
+        monitor, topic = create_monitors(config)
+        assert isinstance(monitor, DailyEnergyMonitor)
+        assert topic == 'tele/meter1'
+        # several totals, published below the source topic, i.e. a last level wildcard is fine
+        config.read_dict({'Daily': {'totals': 'total, total_tariff1', 'source_topic': 'tele/+'}})
+        registry, topic = create_monitors(config)
+        assert registry.totals == ('total', 'total_tariff1')
+        assert topic == 'tele/+'
+
+    @staticmethod
+    def test_single_topic_totals():
+        registry = MeterRegistry(lambda: DailyEnergyMonitor(publisher=ChangePublisher(0, 0)),
+                                 totals=('total', 'total_tariff1'))
+        client = TestMeterRegistry.MockClient()
+        encoder = PayloadEncoder()
+        for total, tariff1 in ((100.0, 40.0), (101.5, 40.5)):
+            payload = encoder.encode({'total': {'value': total}, 'total_tariff1': {'value': tariff1},
+                                      'actual': {'value': 160, 'mean': 160.0}})
+            handle_meter_message(client, registry, TestMeterRegistry.MockMessage('tele/meter1', payload.encode()))
+        assert client.published_messages == [('tele/meter1/total/d0', 1.5, True),
+                                             ('tele/meter1/total_tariff1/d0', 0.5, True)]
+        assert list(registry.monitors) == ['tele/meter1/total/value', 'tele/meter1/total_tariff1/value']
+
+    @staticmethod
+    def test_memory_per_meter():
+        registry = MeterRegistry(lambda: DailyEnergyMonitor(publisher=ChangePublisher()))
+        n_meters = 1000
+        topics = [f"tele/meter{i}/total/value" for i in range(n_meters)]  # not part of the budget
+        tracemalloc.start()
+        try:
+            before = tracemalloc.get_traced_memory()[0]
+            for topic in topics:
+                registry.get(topic).add_value(100.0)
+            size = (tracemalloc.get_traced_memory()[0] - before) / n_meters
+        finally:
+            tracemalloc.stop()
+        assert size < 1024
+
+
+class TestParseTotal:
+
+    @staticmethod
+    def test_parse_total():
+        assert parse_total(b"1234.5") == 1234.5
+        payload = PayloadEncoder().encode({'time': {'value': 1}, 'total': {'value': 1234, 'first': 1233}})
+        assert parse_total(payload.encode()) == 1234.0
+        assert isinstance(parse_total(payload.encode()), float)
+        assert parse_total(b'{"actual": {"value": 5}}') is None
+        with pytest.raises(ValueError):
+            parse_total(b"foo")
+
+    @staticmethod
+    def test_handle_single_topic_message():
+        client = TestMeterRegistry.MockClient()
+        instance = DailyEnergyMonitor(publisher=ChangePublisher(0, 0))
+        for payload in (b'{"total": {"value": 100.0}}', b'{"actual": {"value": 5}}', b'{"total": {"value": 100.25}}'):
+            handle_smartmeter_message(client, instance, TestMeterRegistry.MockMessage('tele/smartmeter', payload))
+        assert instance.today.count == 2
+        assert client.published_messages == [(MQTT_TOPIC_D0, 0.25, True)]
+
+    @staticmethod
+    def test_handle_struct_message(caplog):
+        client = TestMeterRegistry.MockClient()
+        instance = DailyEnergyMonitor(publisher=ChangePublisher(0, 0))
+        encoder = PayloadEncoder('struct', SML_FIELD_NAMES)
+        for total in (100.0, 100.5):
+            payload = encoder.encode({'total': {'value': total, 'first': total}, 'actual': {'value': 5}})
+            handle_smartmeter_message(client, instance, TestMeterRegistry.MockMessage('tele/smartmeter', payload))
+        assert client.published_messages == [(MQTT_TOPIC_D0, 0.5, True)]
+        # other field names (schema): skipped, not raised into paho's network loop
+        handle_smartmeter_message(client, instance, TestMeterRegistry.MockMessage('tele/smartmeter', payload),
+                                  field_names=SML_FIELD_NAMES[:-1])
+        # truncated
+        handle_smartmeter_message(client, instance, TestMeterRegistry.MockMessage('tele/smartmeter', payload[:6]))
+        assert caplog.text.count("Cannot decode message of 'tele/smartmeter', skipped!") == 2
+        assert instance.today.count == 2
+
+    @staticmethod
+    def test_handle_struct_meter_message(caplog):
+        registry = MeterRegistry(lambda: DailyEnergyMonitor(publisher=ChangePublisher(0, 0)),
+                                 totals=('total', 'total_tariff1'))
+        client = TestMeterRegistry.MockClient()
+        encoder = PayloadEncoder('struct', SML_FIELD_NAMES)
+        for total, tariff1 in ((100.0, 40.0), (101.5, 40.5)):
+            payload = encoder.encode({'total': {'value': total}, 'total_tariff1': {'value': tariff1}})
+            handle_meter_message(client, registry, TestMeterRegistry.MockMessage('tele/meter1', payload))
+        assert client.published_messages == [('tele/meter1/total/d0', 1.5, True),
+                                             ('tele/meter1/total_tariff1/d0', 0.5, True)]
+        handle_meter_message(client, registry, TestMeterRegistry.MockMessage('tele/meter1', b'SM\x01'))
+        handle_meter_message(client, registry, TestMeterRegistry.MockMessage('tele/meter1/total/value', b'foo'))
+        assert caplog.text.count("Cannot decode message of") == 2
+
+
+class TestChangePublisher:
+
+    @staticmethod
+    def test_running(monkeypatch):
+        now = [1000.0]
+        monkeypatch.setattr(generate_d0_d1.time, "monotonic", lambda: now[0])
+        publisher = ChangePublisher(resolution=0.1, max_interval=60)
+        assert publisher.due('d0', 1.0)
+        assert not publisher.due('d0', 1.05)
+        assert publisher.due('d0', 1.1)
+        now[0] += 59
+        assert not publisher.due('d0', 1.1)
+        now[0] += 1
+        assert publisher.due('d0', 1.1)
+        assert (publisher.n_published, publisher.n_suppressed) == (3, 2)
+
+    @staticmethod
+    def test_completed_day():
+        publisher = ChangePublisher(resolution=0.1, max_interval=0)
+        assert publisher.due('d1', 7.0, running=False)
+        assert not publisher.due('d1', 7.0, running=False)
+        assert publisher.due('d1', 7.01, running=False)
+
+    @staticmethod
+    def test_d1_once_per_day(monkeypatch):
+        now = [datetime(2024, 3, 1, 12, 0)]
+        TestDailyEnergyMonitorRollover._mock_now(monkeypatch, now)
+
+        class MockClient:
+            def __init__(self):
+                self.published_topics = []
+
+            def publish(self, topic, payload, retain=False):  # pylint: disable=unused-argument
+                self.published_topics.append(topic)
+
+        class MockMessage:
+            def __init__(self, payload):
+                self.payload = payload
+
+        client = MockClient()
+        instance = DailyEnergyMonitor()
+        value = 100.0
+        for _ in range(2 * 24 * 4):
+            handle_smartmeter_message(client, instance, MockMessage(str(value).encode()))
+            value += 0.25
+            now[0] += timedelta(minutes=15)
+        # d1 after the rollovers on 2024-03-02 and 2024-03-03 only
+        assert client.published_topics.count(MQTT_TOPIC_D1) == 2
+        assert client.published_topics.count(MQTT_TOPIC_D0) == 2 * 24 * 4 - 3
+        # d1 re-published before: 144 times, d0 unchanged at the first reading of a day: 2 times
+        assert instance.publisher.n_suppressed == 144 - 2 + 2
+
+
 class TestHandleRetainedMessage:
     class MockClient:
         def __init__(self):
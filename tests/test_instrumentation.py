@@ -0,0 +1,141 @@
+#!pytest
+# -*- coding: utf-8 -*-
+"""Unit tests for the built-in metrics."""
+import io
+import urllib.error
+import urllib.request
+from configparser import ConfigParser
+
+import pytest
+
+from smlmqttprocessor.instrumentation import (
+    MetricsHttpServer,
+    MetricsMqttReporter,
+    ProcessorMetrics,
+    create_instrumentation,
+)
+from smlmqttprocessor.mqtt import MyMqtt
+from smlmqttprocessor.sinks import FanOut, MqttSink, StdoutSink
+from smlmqttprocessor.smltextmqttprocessor import processing_loop
+
+# do not complain about missing docstring for tests
+# pylint: disable=missing-function-docstring,  missing-class-docstring
+# pylint: disable=line-too-long, too-few-public-methods
+# noqa: D102
+
+INPUT = """1-0:96.50.1*1#ISK#
+1-0:1.8.0*255#100.5#Wh
+1-0:16.7.0*255#26#W
+1-0:96.50.1*1#ISK#
+1-0:1.8.0*255#100.6#Wh
+1-0:16.7.0*255#invalid#W
+1-0:96.50.1*1#ISK#
+1-0:1.8.0*255#Wh
+1-0:96.50.1*1#ISK#
+"""
+
+
+class TestProcessorMetrics:
+
+    @staticmethod
+    def test_processing_loop():
+        metrics = ProcessorMetrics()
+        windows = []
+        processing_loop(io.StringIO(INPUT), 2, windows.append, timeout=1, metrics=metrics)
+        assert metrics.lines.value == 9
+        assert metrics.messages.value == 4
+        assert metrics.malformed.value == 1
+        assert metrics.parse_time.count == 4  # without the malformed line
+        assert metrics.read_time.count == 10  # incl. the final empty read
+        assert metrics.windows.value == len(windows) == 2
+        assert metrics.window_messages.value == 1
+        assert metrics.flush_time.count == 2
+
+    @staticmethod
+    def test_fanout(capsys):
+        metrics = ProcessorMetrics()
+        fanout = FanOut([StdoutSink(), MqttSink(MyMqtt(ConfigParser()))], metrics=metrics)
+        metrics.add_fanout(fanout)
+        fanout.workers[1].close = lambda timeout: None  # not connected
+        fanout([{'total': 1, 'time': 11}])
+        fanout.workers[0].close()
+        capsys.readouterr()
+        assert metrics.aggregation_time.count == 1
+        snapshot = metrics.registry.snapshot()
+        assert snapshot['sink_windows_written_total/stdout'] == 1
+        assert snapshot['sink_write_seconds/stdout/count'] == 1
+        assert snapshot['mqtt_reconnects_total'] == 0
+        assert snapshot['mqtt_inflight'] == 0
+
+
+class TestExporters:
+
+    @staticmethod
+    def test_http():
+        metrics = ProcessorMetrics()
+        metrics.lines.inc(5)
+        server = MetricsHttpServer(metrics.registry, port=0)
+        try:
+            with urllib.request.urlopen("http://127.0.0.1:%d/metrics" % server.port, timeout=5) as response:
+                body = response.read().decode()
+                assert response.headers['Content-Type'].startswith('text/plain')
+            assert 'smlmqttprocessor_input_lines_total 5\n' in body
+            assert 'smlmqttprocessor_parse_line_seconds_count 0\n' in body
+            with pytest.raises(urllib.error.HTTPError):
+                urllib.request.urlopen("http://127.0.0.1:%d/other" % server.port, timeout=5)
+        finally:
+            server.close()
+
+    @staticmethod
+    def test_mqtt(monkeypatch):
+        class MockMyMqtt:
+            def __init__(self):
+                self.published = {}
+
+            def publish(self, topic, payload):
+                self.published[topic] = payload
+
+        now = [1000.0]
+        monkeypatch.setattr('smlmqttprocessor.instrumentation.time.monotonic', lambda: now[0])
+        metrics = ProcessorMetrics()
+        mymqtt = MockMyMqtt()
+        reporter = MetricsMqttReporter(metrics.registry, mymqtt, 'tele/smartmeter/$SYS/', interval=3600)
+        try:
+            metrics.lines.inc(10)
+            reporter.report()
+            assert mymqtt.published['tele/smartmeter/$SYS/input_lines_total'] == 10
+            assert 'tele/smartmeter/$SYS/input_lines_per_second' not in mymqtt.published
+            assert 'tele/smartmeter/$SYS/parse_line_seconds/p50' not in mymqtt.published  # no observations
+            now[0] += 10
+            metrics.lines.inc(50)
+            reporter.report()
+            assert mymqtt.published['tele/smartmeter/$SYS/input_lines_total'] == 60
+            assert mymqtt.published['tele/smartmeter/$SYS/input_lines_per_second'] == 5.0
+        finally:
+            reporter.close()
+
+
+class TestCreateInstrumentation:
+
+    @staticmethod
+    def test_disabled():
+        assert create_instrumentation(ConfigParser()) is None
+        config = ConfigParser()
+        config.read_string("[Metrics]\nhttp_port=0\nmqtt_interval=0\n")
+        assert create_instrumentation(config) is None
+
+    @staticmethod
+    def test_enabled(caplog):
+        config = ConfigParser()
+        config.read_string("[Mqtt]\ntopic_prefix=tele/meter\n[Metrics]\nhttp_port=9101\nmqtt_interval=30\n")
+        instrumentation = create_instrumentation(config)
+        assert instrumentation.http == ('127.0.0.1', 9101)
+        assert instrumentation.mqtt == ('tele/meter/$SYS', 30)
+        # no MQTT sink, no MQTT reports
+        instrumentation.http = None
+        fanout = FanOut([StdoutSink()])
+        instrumentation.start(fanout)
+        assert not instrumentation.exporters
+        assert "no MQTT sink" in caplog.text
+        instrumentation.close()
+        fanout.close()
@@ -0,0 +1,149 @@
+#!pytest
+# -*- coding: utf-8 -*-
+"""Unit tests for the synthetic load generator."""
+import io
+import random
+from pathlib import Path
+
+import pytest
+from sml import SmlBase
+
+import smlmqttprocessor.smltextmqttprocessor as stmp
+from smlmqttprocessor.loadgen import PROFILES, LoadGenerator, VirtualMeter, crc16, main
+
+# do not complain about missing docstring for tests
+# pylint: disable=missing-function-docstring,  missing-class-docstring
+# noqa: D102
+
+TESTDATA = Path(__file__).parent.joinpath("testdata")
+
+
+def _messages(data):
+    """Parse text frames with processing_loop, return the messages."""
+    windows = []
+    stmp.processing_loop(io.StringIO(data.decode()), 1, windows.extend, timeout=1)
+    return [message for message in windows if message]
+
+
+class TestVirtualMeter:
+
+    @staticmethod
+    @pytest.mark.parametrize('profile', list(PROFILES))
+    def test_text_frame(profile):
+        meter = VirtualMeter(profile, index=2, rng=random.Random(1))
+        meter.step()
+        lines = meter.text_frame()
+        assert stmp.check_stream_packet_begin(lines[0])
+        message = dict(filter(None, map(stmp.parse_line, lines)))
+        assert message['total'] == round(meter.total, 1)
+        assert message['time'] == meter.sensor_time
+        assert message['actual'] == int(round(meter.actual))
+
+    @staticmethod
+    @pytest.mark.parametrize('profile', list(PROFILES))
+    def test_binary_frame(profile):
+        meter = VirtualMeter(profile, rng=random.Random(1))
+        meter.step()
+        data = meter.binary_frame()
+        end, frame = SmlBase.parse_frame(data)
+        assert end == len(data)
+        values = {entry['objName']: entry['value'] for entry in frame[1]['messageBody']['valList']}
+        assert values['1-0:1.8.0*255'] == round(meter.total, 1)
+        assert values['1-0:16.7.0*255'] == int(round(meter.actual))
+        assert frame[1]['messageBody']['actSensorTime'] == meter.sensor_time
+
+    @staticmethod
+    def test_totals_increase():
+        meter = VirtualMeter('iskra', rng=random.Random(1))
+        totals = []
+        for _ in range(3600):
+            meter.step()
+            totals.append(meter.total)
+        assert totals == sorted(totals)
+        assert 100 < totals[-1] - totals[0] < 5000  # Wh of 1 hour
+
+    @staticmethod
+    def test_pv_export():
+        meter = VirtualMeter('pv', rng=random.Random(1))
+        meter.sensor_time = 43200 - 1  # simulated noon
+        meter.step()
+        assert meter.actual < 0
+        assert meter.export > 0
+
+    @staticmethod
+    def test_unknown_profile():
+        with pytest.raises(ValueError):
+            VirtualMeter('unknown')
+
+    @staticmethod
+    def test_crc16():
+        data = TESTDATA.joinpath("ISKRA_MT175_eHZ.bin").read_bytes()
+        # first message (open response) of the capture, followed by its CRC
+        end = data.index(bytes.fromhex('63c4ba00'))
+        assert crc16(data[8:end]) == 0xc4ba
+
+
+class TestLoadGenerator:
+
+    @staticmethod
+    def test_run():
+        meters = [VirtualMeter(profile, i) for i, profile in enumerate(('iskra', 'emh', 'pv'))]
+        output = io.BytesIO()
+        LoadGenerator(meters).run([output], rate=0, n_frames=10)
+        messages = _messages(output.getvalue())
+        assert len(messages) == 30
+        assert {message['total'] for message in messages[-3:]} == {round(meter.total, 1) for meter in meters}
+
+    @staticmethod
+    def test_outputs_per_meter():
+        outputs = [io.BytesIO(), io.BytesIO()]
+        LoadGenerator([VirtualMeter('iskra', 0), VirtualMeter('emh', 1)]).run(outputs, rate=0, n_frames=5)
+        assert b'ISK' in outputs[0].getvalue() and b'EMH' not in outputs[0].getvalue()
+        assert b'EMH' in outputs[1].getvalue()
+
+    @staticmethod
+    def test_rate():
+        generator = LoadGenerator([VirtualMeter()])
+        output = io.BytesIO()
+        start = stmp.time.monotonic()
+        generator.run([output], rate=50, n_frames=10)
+        assert 0.15 < stmp.time.monotonic() - start < 1.0
+
+    @staticmethod
+    def test_dropout_and_garble(caplog):
+        generator = LoadGenerator([VirtualMeter()], dropout=0.2, burst=3, garble=0.2, rng=random.Random(3))
+        output = io.BytesIO()
+        generator.run([output], rate=0, n_frames=200)
+        assert generator.n_frames + generator.n_dropped == 200
+        assert generator.n_dropped > 10
+        assert generator.n_garbled > 10
+        _messages(output.getvalue())
+        assert caplog.text.count("Invalid message") == generator.n_garbled
+
+    @staticmethod
+    def test_binary_garble():
+        generator = LoadGenerator([VirtualMeter()], binary=True, garble=1.0)
+        data = generator.frame(0)
+        assert len(SmlBase.parse_frame(data)) == 1  # no frame, CRC mismatch
+
+
+class TestMain:
+
+    @staticmethod
+    def test_file(tmp_path, capsys):
+        filename = tmp_path / "meters.txt"
+        assert main(['-m', '2', '-p', 'iskra-l3', '-r', '0', '-n', '3', '--format', 'binary', str(filename)]) == 0
+        assert "frames: 6, dropped: 0, garbled: 0" in capsys.readouterr().err
+        data = filename.read_bytes()
+        assert data.count(b'\x1b\x1b\x1b\x1b\x01\x01\x01\x01') == 6
+
+    @staticmethod
+    def test_file_per_meter(tmp_path):
+        assert main(['-m', '2', '-r', '0', '-n', '2', str(tmp_path / "meter{meter}.txt")]) == 0
+        assert len(_messages(tmp_path.joinpath("meter1.txt").read_bytes())) == 2
+
+    @staticmethod
+    def test_invalid(capsys):
+        assert main(['-p', 'unknown']) == 2
+        assert main(['--format', 'xml']) == 2
+        assert "Unknown" in capsys.readouterr().err
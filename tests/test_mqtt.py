@@ -2,10 +2,19 @@
 # -*- coding: utf-8 -*-
 """Unit tests for own MQTT class."""
 import json
+import socket
+import threading
+import time
 from configparser import ConfigParser
 
+import pytest
+
 import smlmqttprocessor.mqtt as mqtt
+from smlmqttprocessor.instrumentation import ProcessorMetrics
 from smlmqttprocessor.mqtt import MyMqtt
+from smlmqttprocessor.tracing import WindowTrace
+from tests.helpers import connected_mymqtt
+from tests.mqttbroker import MqttBrokerStandIn, wait_for
 
 # do not complain about missing docstring for tests
 # pylint: disable=missing-function-docstring,  missing-class-docstring
@@ -99,6 +108,8 @@ class TestMqtt:
             'act_sensor_time': [111, 222, 333]
         }
         config = ConfigParser()
+        config.add_section('Mqtt')
+        config.set('Mqtt', 'retain', 'true')
 
         # run / test
         mymqtt = mqtt.MyMqtt(config)
@@ -106,6 +117,23 @@ class TestMqtt:
         mymqtt.client = mqtt.mqtt_client.Client()
         mymqtt.send(data)
 
+    @staticmethod
+    def test_send_daily(monkeypatch):
+        published = {}
+        monkeypatch.setattr(mqtt.mqtt_client.Client, "publish",
+                            lambda _, topic, payload=None, retain=False, **__: published.update({topic: (payload, retain)}))
+        config = ConfigParser()
+        config.read_dict({'Mqtt': {'retain': 'true'}})
+        mymqtt = mqtt.MyMqtt(config)
+        mymqtt.connected = True
+        mymqtt.client = mqtt.mqtt_client.Client()
+        mymqtt.send_mqttdata({'total': {'value': 3, 'first': 1, 'last': 3, 'd0': 2.5, 'd1': 7.25}})
+        assert published == {'tele/smartmeter/total/value': (3, True),
+                             'tele/smartmeter/total/first': (1, False),
+                             'tele/smartmeter/total/last': (3, False),
+                             'tele/smartmeter/total/d0': (2.5, True),
+                             'tele/smartmeter/total/d1': (7.25, True)}
+
     @staticmethod
     def test_construct_data():
         data = {
@@ -133,6 +161,12 @@ class TestMqtt:
                     }
         assert actual == expected
 
+    @staticmethod
+    def test_construct_data_single_value():
+        actual = mqtt.MyMqtt.construct_mqttdata({'total': [1.5], 'actual': [26]})
+        assert actual['actual'] == {'value': 26, 'first': 26, 'last': 26, 'median': 26, 'mean': 26,
+                                    'min': 26, 'max': 26, 'stdev': 0.0}
+
 
 class TestMqttSingleTopic:
     """Tests for "sending" of data via (mocked) MQTT as one single topic as JSON.
@@ -241,3 +275,403 @@ class TestMqttMultiTopic:
         mymqtt.connected = True
         mymqtt.client = mqtt.mqtt_client.Client()
         mymqtt.send(data)
+
+
+class TestMqttV5:
+    """Tests for MQTT v5 topic aliases, using a local broker stand-in."""
+
+    data = {
+        'total': [1.111, 2.222, 3.333],
+        'actual': [-11.1, -22.2, 11.1, 22.2, 33.3, 99.9],
+        'time': [111.1, 222.2, 333.3]
+    }
+
+    def _send_twice(self, protocol, **broker_args):
+        with MqttBrokerStandIn(**broker_args) as broker:
+            mymqtt = connected_mymqtt(broker.port, protocol=protocol, message_expiry='300')
+            mymqtt.send(self.data)
+            n_topics = sum(len(value) for value in mymqtt.construct_mqttdata(self.data).values())
+            assert wait_for(lambda: len(broker.received) == n_topics)
+            mymqtt.send(self.data)
+            assert wait_for(lambda: len(broker.received) == 2 * n_topics)
+            mymqtt.disconnect()
+            mymqtt.client.loop_stop()
+        return mymqtt, broker.received[:n_topics], broker.received[n_topics:]
+
+    def test_topic_aliases(self):
+        mymqtt, first, second = self._send_twice('5')
+        assert mymqtt.topic_alias_maximum == 10
+        # first window establishes the aliases (up to the maximum)
+        assert all(publish.topic_alias for publish in first[:10])
+        assert all(publish.topic_alias is None for publish in first[10:])
+        # second window sends only the aliases, topics are resolved by the server
+        assert [p.topic for p in second] == [p.topic for p in first]
+        assert [p.payload for p in second] == [p.payload for p in first]
+        assert sum(p.size for p in second) < sum(p.size for p in first)
+
+    def test_byte_savings(self):
+        _, _, v5_second = self._send_twice('5', topic_alias_maximum=100)
+        _, _, v311_second = self._send_twice('3.1.1')
+        v5_bytes = sum(p.size for p in v5_second)
+        v311_bytes = sum(p.size for p in v311_second)
+        # 'tele/smartmeter/actual/median' etc. is replaced by a 2-byte alias
+        assert v5_bytes < 0.6 * v311_bytes
+
+    def test_topic_aliases_config_maximum(self):
+        with MqttBrokerStandIn() as broker:
+            config = ConfigParser()
+            config.read_dict({'Mqtt': {'port': str(broker.port), 'protocol': '5',
+                                       'topic_alias_maximum': '2'}})
+            mymqtt = MyMqtt(config)
+            mymqtt.connect()
+            assert wait_for(lambda: mymqtt.connected)
+            assert mymqtt.topic_alias_maximum == 2
+            mymqtt.client.loop_stop()
+
+    def test_fallback_311(self, caplog):
+        with MqttBrokerStandIn(protocol_levels=(4,)) as broker:
+            config = ConfigParser()
+            config.read_dict({'Mqtt': {'port': str(broker.port), 'protocol': '5'}})
+            mymqtt = MyMqtt(config)
+            mymqtt.connect()
+            assert wait_for(lambda: mymqtt.protocol == mqtt.mqtt_client.MQTTv311)
+            assert "falling back to 3.1.1" in caplog.text
+            # reconnect as 3.1.1
+            mymqtt.send(self.data)
+            assert wait_for(lambda: mymqtt.connected)
+            mymqtt.send(self.data)
+            assert wait_for(lambda: broker.received)
+            assert broker.received[0].topic_alias is None
+            mymqtt.client.loop_stop()
+
+
+class TestMqttQos:
+    """Tests for QoS, in-flight window and retries, using a local broker stand-in."""
+
+    data = {
+        'total': [1.111, 2.222, 3.333],
+        'actual': [-11.1, -22.2, 11.1, 22.2, 33.3, 99.9],
+    }
+
+    def test_qos_per_topic_class(self):
+        with MqttBrokerStandIn() as broker:
+            mymqtt = connected_mymqtt(broker.port, qos_totals='1', qos_stats='0')
+            mymqtt.send(self.data)
+            assert wait_for(lambda: len(broker.received) == 3 + 8)
+            qos = {publish.topic: publish.qos for publish in broker.received}
+            assert qos['tele/smartmeter/total/value'] == 1
+            assert qos['tele/smartmeter/actual/mean'] == 0
+            # all acknowledged (QoS 0: written), latencies recorded
+            assert wait_for(lambda: mymqtt.publish_latency.count == 3 + 8)
+            assert not mymqtt.inflight
+            mymqtt.disconnect()
+            mymqtt.client.loop_stop()
+
+    @staticmethod
+    def test_inflight_qos0(monkeypatch):
+        # QoS 0 messages not yet written to the socket (e.g. corked) are no in-flight messages
+        mids = iter(range(1, 100))
+        monkeypatch.setattr(mqtt.mqtt_client.Client, "publish",
+                            lambda *args, **kwargs: mqtt.mqtt_client.MQTTMessageInfo(next(mids)))
+        config = ConfigParser()
+        config.read_dict({'Mqtt': {'max_inflight': '2', 'inflight_timeout': '1'}})
+        mymqtt = MyMqtt(config)
+        mymqtt.connected = True
+        mymqtt.client = mqtt.mqtt_client.Client()
+        for i in range(5):
+            mymqtt.publish('foo/%d' % i, i)
+        start = time.monotonic()
+        mymqtt.publish('bar', 1, qos=1)
+        assert time.monotonic() - start < 1
+        assert [key[1] for key in mymqtt.inflight] == [6]
+        # written to the socket: latency recorded
+        for mid in range(1, 7):
+            mymqtt._on_publish(mymqtt.client, None, mid)  # pylint: disable=protected-access
+        assert mymqtt.publish_latency.count == 6
+        assert not mymqtt.inflight
+
+    def test_backpressure(self, caplog):
+        with MqttBrokerStandIn() as broker:
+            broker.ack_publishes = False
+            mymqtt = connected_mymqtt(broker.port, max_inflight='2', inflight_timeout='0.2')
+            mymqtt.publish('foo/1', 1, qos=1)
+            mymqtt.publish('foo/2', 2, qos=1)
+            assert len(mymqtt.inflight) == 2
+            start = time.monotonic()
+            mymqtt.publish('foo/3', 3, qos=1)
+            assert time.monotonic() - start >= 0.2
+            assert "in-flight window full (2)" in caplog.text
+            mymqtt.disconnect()
+            mymqtt.client.loop_stop()
+
+    def test_retry_after_reconnect(self):
+        with MqttBrokerStandIn() as broker:
+            broker.ack_publishes = False
+            mymqtt = connected_mymqtt(broker.port, qos='1')
+            mymqtt.publish('foo/1', 1, qos=1)
+            mymqtt.publish('foo/2', 2, qos=1)
+            assert wait_for(lambda: len(broker.received) == 2)
+            # broker drops the connection, nothing has been acknowledged
+            broker.disconnect_clients()
+            assert wait_for(lambda: not mymqtt.connected)
+            broker.ack_publishes = True
+            # reconnected in the background, unacknowledged messages re-sent
+            assert wait_for(lambda: mymqtt.connected)
+            assert wait_for(lambda: not mymqtt.inflight)
+            assert mymqtt.n_retried == 2
+            assert [p.payload for p in broker.received[2:]] == [b'1', b'2']
+            mymqtt.disconnect()
+            mymqtt.client.loop_stop()
+
+    def test_retry_after_reconnect_v5(self):
+        with MqttBrokerStandIn() as broker:
+            broker.ack_publishes = False
+            mymqtt = connected_mymqtt(broker.port, qos='1', protocol='5')
+            for i in range(3):
+                mymqtt.publish('foo/%d' % (i % 2), i, qos=1)
+            assert wait_for(lambda: len(broker.received) == 3)
+            # the 3rd one with the alias only
+            assert [p.topic_alias for p in broker.received] == [1, 2, 1]
+            broker.disconnect_clients()
+            assert wait_for(lambda: not mymqtt.connected)
+            broker.ack_publishes = True
+            # re-sent by paho with the full topic, the aliases of the old connection are unknown
+            assert wait_for(lambda: mymqtt.connected)
+            assert wait_for(lambda: not mymqtt.inflight)
+            assert [(p.topic, p.topic_alias, p.payload) for p in broker.received[3:]] == \
+                [('foo/0', None, b'0'), ('foo/1', None, b'1'), ('foo/0', None, b'2')]
+            mymqtt.disconnect()
+            mymqtt.client.loop_stop()
+
+    def test_latency_under_broker_drop(self):
+        with MqttBrokerStandIn() as broker:
+            mymqtt = connected_mymqtt(broker.port, qos='1')
+            for _ in range(5):
+                mymqtt.send(self.data)
+            assert wait_for(lambda: not mymqtt.inflight)
+            # regular latency, local broker
+            assert mymqtt.publish_latency.quantile(0.99) <= 0.1
+            broker.disconnect_clients()
+            assert wait_for(lambda: not mymqtt.connected)
+            mymqtt.send(self.data)
+            assert wait_for(lambda: mymqtt.connected)
+            assert wait_for(lambda: not mymqtt.inflight)
+            # everything delivered, only the window sent during the drop may be slow
+            assert mymqtt.publish_latency.count == 6 * (3 + 8)
+            assert mymqtt.publish_latency.quantile(0.8) <= 0.1
+            mymqtt.disconnect()
+            mymqtt.client.loop_stop()
+
+    def test_trace(self):
+        with MqttBrokerStandIn() as broker:
+            broker.ack_publishes = False
+            mymqtt = connected_mymqtt(broker.port, qos_totals='1', qos_stats='0')
+            metrics = ProcessorMetrics()
+            trace = WindowTrace(time.monotonic() - 15, time.monotonic() - 1, metrics)
+            trace.aggregation_end = trace.handoff = time.monotonic()
+            mymqtt.send_mqttdata(mymqtt.construct_mqttdata(self.data), trace=trace)
+            assert trace.n_sent == 3 + 8
+            assert wait_for(lambda: trace.n_pending == 3)  # QoS 0 written, QoS 1 not acknowledged
+            assert trace.published is not None and trace.acked is None
+            broker.disconnect_clients()
+            broker.ack_publishes = True
+            # re-published after the reconnect, then acknowledged
+            assert wait_for(lambda: trace.acked is not None)
+            assert trace.n_pending == 0
+            assert metrics.stage_time['ack'].count == 1
+            assert metrics.end_to_end['first'].count == metrics.end_to_end['last'].count == 1
+            assert metrics.end_to_end['first'].sum > 15
+            assert not mymqtt._traces  # pylint: disable=protected-access
+            mymqtt.disconnect()
+            mymqtt.client.loop_stop()
+
+    def test_trace_payload(self):
+        with MqttBrokerStandIn() as broker:
+            mymqtt = connected_mymqtt(broker.port, single_topic='true', trace_payload='true')
+            trace = WindowTrace(time.monotonic() - 15, time.monotonic() - 1)
+            trace.aggregation_end = trace.handoff = time.monotonic()
+            mqttdata = mymqtt.construct_mqttdata(self.data)
+            mymqtt.send_mqttdata(mqttdata, trace=trace)
+            assert wait_for(lambda: trace.acked is not None)  # QoS 0: written to the socket
+            assert wait_for(lambda: broker.received)
+            assert 'trace' not in mqttdata
+            payload = json.loads(broker.received[0].payload)
+            assert sorted(payload['trace']) == ['aggregated', 'first_read', 'handoff', 'last_read', 'sent']
+            assert round(payload['trace']['sent'] - payload['trace']['first_read']) == 15
+            mymqtt.disconnect()
+            mymqtt.client.loop_stop()
+
+
+class TestMqttReconnect:
+    """Tests for non-blocking (re)connect with persistent session, using a local broker stand-in."""
+
+    @staticmethod
+    def _mymqtt(port, **options):
+        config = ConfigParser()
+        config.read_dict({'Mqtt': dict(port=str(port), **options)})
+        return MyMqtt(config)
+
+    def test_persistent_session(self):
+        with MqttBrokerStandIn() as broker:
+            mymqtt = self._mymqtt(broker.port, client_id='meter-1')
+            mymqtt.connect()
+            assert wait_for(lambda: mymqtt.connected)
+            broker.disconnect_clients()
+            assert wait_for(lambda: not mymqtt.connected)
+            assert wait_for(lambda: mymqtt.connected)
+            assert broker.connects == [{'client_id': 'meter-1', 'clean_session': False, 'protocol_level': 4}] * 2
+            assert mymqtt.n_reconnects == 2
+            assert mymqtt.outage_duration.count == 2
+            assert mymqtt.reconnect_time.count == 2
+            mymqtt.disconnect()
+            mymqtt.client.loop_stop()
+
+    def test_persistent_session_v5(self):
+        with MqttBrokerStandIn() as broker:
+            mymqtt = self._mymqtt(broker.port, protocol='5')
+            mymqtt.connect()
+            assert wait_for(lambda: mymqtt.connected)
+            assert broker.connects == [{'client_id': 'SmlTextMqttProcessor', 'clean_session': False, 'protocol_level': 5}]
+            mymqtt.disconnect()
+            mymqtt.client.loop_stop()
+
+    def test_queue_while_reconnecting(self):
+        with MqttBrokerStandIn() as broker:
+            broker.refuse_connections = True
+            mymqtt = self._mymqtt(broker.port, qos_totals='1')
+            start = time.monotonic()
+            mymqtt.send({'total': [1.0, 2.0]})
+            mymqtt.send({'total': [2.0, 3.0]})
+            # neither connecting nor publishing blocks
+            assert time.monotonic() - start < 0.5
+            assert mymqtt.n_queued == 2 * 3
+            time.sleep(0.5)  # first connection attempt(s) refused
+            assert not broker.received
+            broker.refuse_connections = False
+            assert wait_for(lambda: len(broker.received) == 2 * 3, timeout=10)
+            assert [p.payload for p in broker.received if p.topic == 'tele/smartmeter/total/value'] == [b'2.0', b'3.0']
+            assert not mymqtt.pending
+            assert mymqtt.outage_duration.count == 1
+            assert mymqtt.outage_duration.sum >= 0.5
+            assert wait_for(lambda: not mymqtt.inflight)
+            mymqtt.disconnect()
+            mymqtt.client.loop_stop()
+
+    def test_queue_full(self, caplog):
+        mymqtt = self._mymqtt(1, max_queued='2')
+        for i in range(3):
+            mymqtt.publish('foo/%d' % i, i)
+        assert [entry[0] for entry in mymqtt.pending] == ['foo/1', 'foo/2']
+        assert mymqtt.n_queue_dropped == 1
+        assert "queue full, dropped oldest (#1 dropped)" in caplog.text
+
+
+class TestMqttCoalesce:
+    """Tests for coalesced multi-topic publishing, using a local broker stand-in."""
+
+    data = {
+        'total': [1.111, 2.222, 3.333],
+        'actual': [-11.1, -22.2, 11.1, 22.2, 33.3, 99.9],
+        'time': [111.1, 222.2, 333.3]
+    }
+
+    def _socket_writes_per_window(self, coalesce):
+        with MqttBrokerStandIn() as broker:
+            config = ConfigParser()
+            config.read_dict({'Mqtt': {'port': str(broker.port), 'coalesce': coalesce}})
+            mymqtt = MyMqtt(config)
+            mymqtt.connect()
+            assert wait_for(lambda: mymqtt.connected)
+            n_writes = mymqtt.client.n_socket_writes
+            mymqtt.send(self.data)
+            assert wait_for(lambda: len(broker.received) == 3 + 3 + 8)
+            n_writes = mymqtt.client.n_socket_writes - n_writes
+            mymqtt.disconnect()
+            mymqtt.client.loop_stop()
+        return n_writes, broker.received
+
+    def test_coalesce(self):
+        n_writes, received = self._socket_writes_per_window('true')
+        assert n_writes <= 2
+        assert [p.topic for p in received][:4] == ['tele/smartmeter/time/value',
+                                                   'tele/smartmeter/time/first',
+                                                   'tele/smartmeter/time/last',
+                                                   'tele/smartmeter/total/value']
+
+    def test_no_coalesce(self):
+        n_writes, _ = self._socket_writes_per_window('false')
+        assert n_writes == 3 + 3 + 8
+
+    @staticmethod
+    def test_batch_not_connected():
+        mymqtt = MyMqtt(ConfigParser())
+        with mymqtt.batch() as actual:
+            assert actual is mymqtt
+
+    @staticmethod
+    def test_batch_backpressure():
+        with MqttBrokerStandIn() as broker:
+            config = ConfigParser()
+            config.read_dict({'Mqtt': {'port': str(broker.port), 'max_inflight': '2'}})
+            mymqtt = MyMqtt(config)
+            mymqtt.connect()
+            assert wait_for(lambda: mymqtt.connected)
+            with mymqtt.batch():
+                for i in range(5):
+                    # must not wait for acks of held-back messages
+                    mymqtt.publish('foo/%d' % i, i, qos=1)
+            assert wait_for(lambda: len(broker.received) == 5)
+            assert wait_for(lambda: not mymqtt.inflight)
+            mymqtt.disconnect()
+            mymqtt.client.loop_stop()
+
+    @staticmethod
+    def test_flush_timeout(caplog):
+        client = mqtt.CoalescingClient('test')
+        client.flush_timeout = 0.2
+        sock, peer = socket.socketpair()
+        sock.setblocking(False)
+        # the server does not read, the socket buffer is full
+        try:
+            while True:
+                sock.send(b'x' * 65536)
+        except BlockingIOError:
+            pass
+        client._sock = sock  # pylint: disable=protected-access
+        client.cork()
+        client._sock_send(b'y' * 100000)  # pylint: disable=protected-access
+        started = time.monotonic()
+        client.uncork()
+        assert time.monotonic() - started < 2
+        assert "MQTT flush timed out after 0.2 s, 100000 bytes dropped" in caplog.text
+        # shut down, paho's network loop reconnects
+        with pytest.raises(OSError):
+            sock.send(b'z')
+        sock.close()
+        peer.close()
+
+    @staticmethod
+    def test_flush_does_not_block_network_thread():
+        client = mqtt.CoalescingClient('test')
+        client.flush_timeout = 1.0
+        sock, peer = socket.socketpair()
+        sock.setblocking(False)
+        # the server does not read, the socket buffer is full
+        try:
+            while True:
+                sock.send(b'x' * 65536)
+        except BlockingIOError:
+            pass
+        client._sock = sock  # pylint: disable=protected-access
+        client.cork()
+        client._sock_send(b'y' * 100000)  # pylint: disable=protected-access
+        flusher = threading.Thread(target=client.uncork)
+        flusher.start()
+        assert wait_for(lambda: not client._cork_buffer)  # pylint: disable=protected-access
+        # e.g. the event loop writing a PINGREQ meanwhile: buffered, not waiting for the flush
+        started = time.monotonic()
+        assert client._sock_send(b'z') == 1  # pylint: disable=protected-access
+        assert time.monotonic() - started < 0.2
+        flusher.join()
+        sock.close()
+        peer.close()
@@ -0,0 +1,102 @@
+#!pytest
+# -*- coding: utf-8 -*-
+"""Unit tests for the local MQTT broker stand-in (test helper)."""
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+import paho.mqtt.client as mqtt_client
+
+from tests.mqttbroker import PUBLISH, MqttBrokerStandIn, wait_for
+
+# do not complain about missing docstring for tests
+# pylint: disable=missing-function-docstring,  missing-class-docstring
+# pylint: disable=line-too-long, too-few-public-methods
+# noqa: D102
+
+
+def _connected_client(port):
+    client = mqtt_client.Client()
+    received = []
+    client.on_message = lambda _client, _userdata, msg: received.append((msg.topic, msg.payload, msg.retain))
+    client.connect('127.0.0.1', port)
+    client.loop_start()
+    return client, received
+
+
+class TestMqttBrokerStandIn:
+
+    @staticmethod
+    def test_publish_timestamps():
+        with MqttBrokerStandIn() as broker:
+            client, _ = _connected_client(broker.port)
+            client.publish('foo/1', b'1')
+            client.publish('foo/2', b'2', qos=1)
+            assert wait_for(lambda: len(broker.received) == 2)
+            client.disconnect()
+            client.loop_stop()
+        assert [p.topic for p in broker.received] == ['foo/1', 'foo/2']
+        assert broker.received[0].timestamp <= broker.received[1].timestamp
+        assert [p.packet_type for p in broker.packets if p.packet_type == PUBLISH] == [PUBLISH] * 2
+
+    @staticmethod
+    def test_subscribe_retained():
+        with MqttBrokerStandIn() as broker:
+            publisher, _ = _connected_client(broker.port)
+            publisher.publish('foo/retained', b'42', retain=True)
+            publisher.publish('foo/deleted', b'1', retain=True)
+            publisher.publish('foo/deleted', b'', retain=True)
+            assert wait_for(lambda: len(broker.received) == 3)
+            assert broker.retained == {'foo/retained': b'42'}
+
+            subscriber, received = _connected_client(broker.port)
+            subscriber.subscribe('foo/#')
+            assert wait_for(lambda: received)
+            assert received == [('foo/retained', b'42', True)]
+            publisher.publish('foo/live', b'43')
+            publisher.publish('bar/live', b'44')
+            assert wait_for(lambda: len(received) == 2)
+            assert received[1] == ('foo/live', b'43', False)
+
+            unsubscribed = []
+            subscriber.on_unsubscribe = lambda *_: unsubscribed.append(True)
+            subscriber.unsubscribe('foo/#')
+            assert wait_for(lambda: unsubscribed)
+            publisher.publish('foo/live', b'45')
+            assert wait_for(lambda: len(broker.received) == 6)
+            assert len(received) == 2
+            for client in (publisher, subscriber):
+                client.disconnect()
+                client.loop_stop()
+
+    @staticmethod
+    def test_forced_disconnect_refuse():
+        with MqttBrokerStandIn() as broker:
+            client, _ = _connected_client(broker.port)
+            assert wait_for(lambda: broker.n_connections == 1)
+            broker.refuse_connections = True
+            broker.disconnect_clients()
+            assert wait_for(lambda: broker.n_connections == 0)
+            broker.refuse_connections = False
+            # paho reconnects automatically (loop_start)
+            assert wait_for(lambda: broker.n_connections == 1, timeout=10)
+            client.disconnect()
+            client.loop_stop()
+
+    @staticmethod
+    def test_subprocess():
+        with subprocess.Popen([sys.executable, '-m', 'tests.mqttbroker', '--port', '0'],
+                              cwd=Path(__file__).parent.parent, stdout=subprocess.PIPE,
+                              text=True) as process:
+            try:
+                port = json.loads(process.stdout.readline())['port']
+                client, _ = _connected_client(port)
+                client.publish('foo/bar', b'baz')
+                actual = json.loads(process.stdout.readline())
+                client.disconnect()
+                client.loop_stop()
+            finally:
+                process.terminate()
+        assert actual['topic'] == 'foo/bar'
+        assert actual['payload'] == 'baz'
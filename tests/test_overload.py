@@ -0,0 +1,240 @@
+#!pytest
+# -*- coding: utf-8 -*-
+"""Unit tests for the overload handling (load shedding)."""
+import asyncio
+import io
+import threading
+import time
+from configparser import ConfigParser
+
+import pytest
+
+from smlmqttprocessor.aio import FileLineReader
+from smlmqttprocessor.instrumentation import ProcessorMetrics
+from smlmqttprocessor.mqtt import MyMqtt
+from smlmqttprocessor.overload import LagEstimator, OverloadPolicy, create_overload_policy
+from smlmqttprocessor.sinks import FanOut, Sink, SinkWorker
+from smlmqttprocessor.smltextmqttprocessor import processing_loop_async
+from tests.helpers import make_window, sml_frames
+
+# do not complain about missing docstring for tests
+# pylint: disable=missing-function-docstring,  missing-class-docstring
+# pylint: disable=line-too-long, too-few-public-methods
+# noqa: D102
+
+
+def _frames(n):
+    return sml_frames(["%.1f" % (100 + i / 10) for i in range(n)], actuals=[200 + i for i in range(n)],
+                      sensor_times=[1000 + i for i in range(n)])
+
+
+def _active(**kwargs):
+    overload = OverloadPolicy(5, **kwargs)
+    # frames read 10 s late
+    overload.update_input(1000, now=50.0)
+    overload.update_input(1001, now=61.0)
+    assert overload.active
+    return overload
+
+
+class RecordingSink(Sink):
+    name = 'recording'
+
+    def __init__(self):
+        self.written = []
+
+    def write(self, mqttdata, timestamp):
+        self.written.append(mqttdata)
+
+
+class TestLagEstimator:
+
+    @staticmethod
+    def test_lag():
+        lag = LagEstimator()
+        assert lag.update(1000, now=50.0) == 0
+        assert lag.update(1001, now=51.0) == 0
+        # read 8 s late (the baseline follows by max. 1 ms/s)
+        assert lag.update(1002, now=60.0) == pytest.approx(8, abs=0.01)
+        # catching up
+        assert lag.update(1003, now=60.1) == pytest.approx(7.1, abs=0.01)
+
+    @staticmethod
+    def test_replay_faster():
+        lag = LagEstimator()
+        for i in range(100):
+            assert lag.update(1000 + i, now=50.0 + i / 1000) == 0
+
+    @staticmethod
+    def test_meter_restart():
+        lag = LagEstimator()
+        lag.update(1000, now=50.0)
+        assert lag.update(5, now=51.0) == 0
+        assert lag.update(6, now=52.0) == 0
+
+    @staticmethod
+    def test_slow_meter_clock():
+        lag = LagEstimator()
+        # meter clock 0.05% slower than the local one, no lag
+        for i in range(0, 10000, 10):
+            assert lag.update(i * 0.9995, now=float(i)) < 0.01
+
+
+class TestOverloadPolicy:
+
+    @staticmethod
+    def test_hysteresis(caplog):
+        overload = OverloadPolicy(10)
+        overload.update_sinks(11)
+        assert overload.active
+        assert "Overload: lag 11.0 s above 10.0 s" in caplog.text
+        overload.update_sinks(6)
+        assert overload.active
+        overload.update_sinks(4)
+        assert not overload.active
+        assert "Overload ended" in caplog.text
+        overload.update_sinks(11)
+        assert overload.n_activations == 2
+
+    @staticmethod
+    def test_input_lag():
+        overload = OverloadPolicy(5)
+        overload.update_input(1000, now=50.0)
+        overload.update_input(1001, now=58.0)
+        assert overload.lag == pytest.approx(7, abs=0.01)
+        assert overload.active
+
+    @staticmethod
+    def test_inactive():
+        overload = OverloadPolicy(5)
+        window = make_window({'total': 1})
+        assert overload.merge(window) is window
+        assert not overload.shed_frame()
+        assert not overload.value_only
+
+    @staticmethod
+    def test_shed_frame():
+        overload = _active(keep_every=3)
+        assert [overload.shed_frame() for _ in range(6)] == [True, True, False, True, True, False]
+        assert overload.n_frames_shed == 4
+
+    @staticmethod
+    def test_merge():
+        overload = _active(merge_windows=3)
+        assert overload.merge(make_window({'a': 1}, first_read=1.0, last_read=2.0)) is None
+        assert overload.merge(make_window({'a': 2}, first_read=2.0, last_read=3.0)) is None
+        merged = overload.merge(make_window({'a': 3}, first_read=3.0, last_read=4.0))
+        assert merged == [{'a': 1}, {'a': 2}, {'a': 3}]
+        assert (merged.first_read, merged.last_read) == (1.0, 4.0)
+        assert overload.n_windows_merged == 2
+        assert overload.merge([{'a': 4}]) is None
+        assert overload.flush() == [{'a': 4}]
+        assert overload.flush() is None
+
+    @staticmethod
+    def test_merge_ended():
+        overload = _active(merge_windows=3)
+        assert overload.merge([{'a': 1}]) is None
+        # caught up
+        overload.update_input(1011, now=61.0)
+        assert not overload.active
+        # the held window with the next one
+        assert overload.merge([{'a': 2}]) == [{'a': 1}, {'a': 2}]
+
+    @staticmethod
+    def test_policies():
+        overload = _active(policies=('value_only',))
+        assert overload.value_only
+        assert not overload.shed_frame()
+        assert overload.merge([{'a': 1}]) == [{'a': 1}]
+        with pytest.raises(ValueError, match="Unknown overload policies 'foo'"):
+            OverloadPolicy(5, ('merge', 'foo'))
+
+
+class TestCreateOverloadPolicy:
+
+    @staticmethod
+    def test_disabled():
+        assert create_overload_policy(ConfigParser()) is None
+
+    @staticmethod
+    def test_config():
+        config = ConfigParser()
+        config.read_dict({'Overload': {'lag_threshold': '30', 'policies': 'merge, drop_frames',
+                                       'merge_windows': '2', 'keep_every': '10'}})
+        overload = create_overload_policy(config)
+        assert overload.threshold == 30
+        assert overload.policies == {'merge', 'drop_frames'}
+        assert (overload.merge_windows, overload.keep_every) == (2, 10)
+
+
+class TestShedding:
+
+    @staticmethod
+    def test_drop_frames():
+        overload = OverloadPolicy(5, ('drop_frames',), keep_every=2)
+        # slow sink, the frames (replayed as fast as possible) have no input lag
+        overload.update_sinks(10)
+        windows = []
+        asyncio.run(processing_loop_async(FileLineReader(io.StringIO(_frames(4))), 4, windows.append, timeout=1,
+                                          overload=overload))
+        # every 2nd frame complete, only the counters and the sensor time of the others
+        assert windows[0] == [{'total': 100.0, 'time': 1000}, {'total': 100.1, 'actual': 201, 'time': 1001},
+                              {'total': 100.2, 'time': 1002}, {'total': 100.3, 'actual': 203, 'time': 1003}]
+        # incl. the (empty) one after the last header
+        assert overload.n_frames_shed == 3
+
+    @staticmethod
+    def test_value_only():
+        records = {'total': [1.5, 2.5], 'actual': [1, 2, 3], 'time': [10, 11]}
+        assert MyMqtt.construct_mqttdata(records, value_only=True) == \
+            {'total': {'value': 2.5}, 'actual': {'value': 3}, 'time': {'value': 11}}
+        sink = RecordingSink()
+        overload = _active(policies=('value_only',))
+        fanout = FanOut([sink], overload=overload)
+        fanout([{'total': 1.5, 'actual': 1}, {'total': 2.5, 'actual': 2}])
+        fanout.close()
+        assert sink.written == [{'total': {'value': 2.5}, 'actual': {'value': 2}}]
+        assert overload.n_windows_value_only == 1
+
+    @staticmethod
+    def test_fanout_merge(caplog):
+        sink = RecordingSink()
+        overload = _active(policies=('merge',), merge_windows=2)
+        fanout = FanOut([sink], overload=overload)
+        for i in range(3):
+            fanout([{'total': float(i)}])
+        # the 3rd one held, flushed on close
+        fanout.close()
+        assert [mqttdata['total']['first'] for mqttdata in sink.written] == [0.0, 2.0]
+        assert "Overload: 1 times, shed: 0 frames to counters, 1 windows merged" in caplog.text
+
+    @staticmethod
+    def test_sink_lag():
+        release = threading.Event()
+
+        class BlockingSink(RecordingSink):
+            def write(self, mqttdata, timestamp):
+                release.wait()
+
+        worker = SinkWorker(BlockingSink())
+        assert worker.lag() == 0
+        worker.submit({}, time.time())
+        worker.submit({}, time.time() - 5)
+        time.sleep(0.1)
+        assert 5 <= worker.lag() < 6
+        release.set()
+        worker.close()
+        assert worker.lag() == 0
+
+    @staticmethod
+    def test_metrics():
+        metrics = ProcessorMetrics()
+        fanout = FanOut([RecordingSink()], overload=_active(policies=('value_only',)))
+        metrics.add_fanout(fanout)
+        fanout([{'total': 1.0}])
+        fanout.close()
+        text = metrics.registry.render_prometheus()
+        assert 'smlmqttprocessor_processing_lag_seconds 9.98' in text
+        assert 'smlmqttprocessor_overload_active 1' in text
+        assert 'smlmqttprocessor_overload_shed_total{policy="value_only"} 1' in text
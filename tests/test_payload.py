@@ -0,0 +1,157 @@
+#!pytest
+# -*- coding: utf-8 -*-
+"""Unit tests for the single-topic payload codecs."""
+import json
+import math
+import struct
+from configparser import ConfigParser
+
+import pytest
+
+import smlmqttprocessor.mqtt as mqtt
+from smlmqttprocessor.payload import PayloadEncoder, StructSchema, decode_payload, extract_fields, HEADER
+from smlmqttprocessor.smltextmqttprocessor import SML_FIELDS
+
+# do not complain about missing docstring for tests
+# pylint: disable=missing-function-docstring,  missing-class-docstring
+# pylint: disable=line-too-long, too-few-public-methods
+# noqa: D102
+
+FIELD_NAMES = list(SML_FIELDS)
+
+MQTTDATA = {
+    "time": {"value": 333, "first": 111, "last": 333},
+    "total": {"value": 22462414.5, "first": 22462414.1, "last": 22462414.5},
+    "actual": {"value": 99.9, "first": -11.1, "last": 99.9, "median": 16.6,
+               "mean": 22.2, "min": -22.2, "max": 99.9, "stdev": 43.3},
+}
+
+
+class TestCodecs:
+
+    @staticmethod
+    def test_json():
+        encoder = PayloadEncoder()
+        payload = encoder.encode(MQTTDATA)
+        # unchanged, plain JSON without header
+        assert payload == json.dumps(MQTTDATA)
+        assert decode_payload(payload) == MQTTDATA
+
+    @staticmethod
+    @pytest.mark.parametrize("codec,module", [("msgpack", "msgpack"), ("cbor", "cbor2")])
+    def test_roundtrip(codec, module):
+        pytest.importorskip(module)
+        payload = PayloadEncoder(codec).encode(MQTTDATA)
+        assert payload.startswith(b'SM')
+        assert decode_payload(payload) == MQTTDATA
+        assert len(payload) < len(json.dumps(MQTTDATA))
+
+    @staticmethod
+    def test_struct():
+        payload = PayloadEncoder("struct", FIELD_NAMES).encode(MQTTDATA)
+        # header + bitmap + 3 + 3 + 8 doubles
+        assert len(payload) == HEADER.size + 4 + (3 + 3 + 8) * 8
+        actual = decode_payload(payload, FIELD_NAMES)
+        assert actual == MQTTDATA
+        assert isinstance(actual["time"]["value"], float)
+
+    @staticmethod
+    def test_struct_value_only():
+        # e.g. value-only windows under overload
+        payload = PayloadEncoder("struct", FIELD_NAMES).encode({"actual": {"value": 99.9}})
+        actual = decode_payload(payload, FIELD_NAMES)["actual"]
+        assert actual["value"] == 99.9
+        assert all(math.isnan(value) for stat, value in actual.items() if stat != "value")
+
+    @staticmethod
+    def test_struct_schema_mismatch():
+        payload = PayloadEncoder("struct", FIELD_NAMES).encode(MQTTDATA)
+        with pytest.raises(ValueError, match="schema mismatch"):
+            decode_payload(payload, FIELD_NAMES[:-1])
+        with pytest.raises(ValueError, match="requires the field names"):
+            decode_payload(payload)
+
+    @staticmethod
+    def test_struct_too_many_fields():
+        with pytest.raises(ValueError):
+            StructSchema(["f%d" % i for i in range(33)])
+
+    @staticmethod
+    def test_unknown():
+        with pytest.raises(ValueError, match="Unknown payload codec 'foo'"):
+            PayloadEncoder("foo")
+        with pytest.raises(ValueError, match="Unknown payload codec id 9"):
+            decode_payload(HEADER.pack(b'SM', 1, 9, 0))
+        with pytest.raises(ValueError, match="Unsupported payload format version 2"):
+            decode_payload(HEADER.pack(b'SM', 2, 1, 0))
+
+    @staticmethod
+    def test_missing_module(monkeypatch):
+        monkeypatch.setitem(__import__("sys").modules, "msgpack", None)
+        with pytest.raises(RuntimeError, match="requires the msgpack package"):
+            PayloadEncoder("msgpack")
+
+
+class TestExtractFields:
+
+    @staticmethod
+    def test_json():
+        payload = PayloadEncoder().encode(dict(MQTTDATA, total_tariff1={"value": 5.5, "first": 5.0, "last": 5.5}))
+        assert extract_fields(payload) == {'total': 22462414.5}
+        assert extract_fields(payload.encode(), ('total', 'total_tariff1')) == {'total': 22462414.5, 'total_tariff1': 5.5}
+        assert extract_fields(payload, ('actual',), stat='mean') == {'actual': 22.2}
+        # not 'total' of 'total_tariff1'
+        assert extract_fields(payload, ('total_tariff2', 'total_tariff1')) == {'total_tariff1': 5.5}
+        assert extract_fields(payload, ('time',), stat='mean') == {}
+
+    @staticmethod
+    def test_json_fallback():
+        # compact JSON (other producer): full decode
+        payload = json.dumps(MQTTDATA, separators=(',', ':'))
+        assert extract_fields(payload, ('total', 'foo')) == {'total': 22462414.5}
+        # no total in this window
+        assert extract_fields(json.dumps({"actual": MQTTDATA["actual"]})) == {}
+        # not a number
+        assert extract_fields('{"total": {"value": null, "first": 1}}') == {'total': None}
+        assert extract_fields('{"time": {"value": "12:00"}}', ('time',)) == {'time': '12:00'}
+
+    @staticmethod
+    def test_struct():
+        payload = PayloadEncoder("struct", FIELD_NAMES).encode(MQTTDATA)
+        assert extract_fields(payload, ('total', 'actual', 'total_tariff1'), field_names=FIELD_NAMES) == \
+            {'total': 22462414.5, 'actual': 99.9}
+        assert extract_fields(payload, ('actual',), stat='stdev', field_names=FIELD_NAMES) == {'actual': 43.3}
+        with pytest.raises(ValueError, match="schema mismatch"):
+            extract_fields(payload, field_names=FIELD_NAMES[:-1])
+        with pytest.raises(ValueError, match="requires the field names"):
+            extract_fields(payload)
+
+    @staticmethod
+    def test_msgpack():
+        pytest.importorskip("msgpack")
+        payload = PayloadEncoder("msgpack").encode(MQTTDATA)
+        assert extract_fields(payload, ('total', 'foo')) == {'total': 22462414.5}
+
+
+class TestMqttPayloadCodec:
+
+    @staticmethod
+    def test_send_struct(monkeypatch):
+        published = []
+        monkeypatch.setattr(mqtt.mqtt_client.Client, "publish",
+                            lambda _, topic, payload=None, retain=False: published.append((topic, payload)))
+        config = ConfigParser()
+        config.read_dict({'Mqtt': {'single_topic': 'true', 'payload_codec': 'struct'}})
+        mymqtt = mqtt.MyMqtt(config, field_names=FIELD_NAMES)
+        mymqtt.connected = True
+        mymqtt.client = mqtt.mqtt_client.Client()
+        mymqtt.send({'total': [1.5, 2.5], 'actual': [1, 2, 3]})
+        assert len(published) == 1
+        topic, payload = published[0]
+        assert topic == 'tele/smartmeter'
+        assert struct.unpack_from("!2sBBH", payload)[:3] == (b'SM', 1, 3)
+        assert decode_payload(payload, FIELD_NAMES) == {
+            'total': {'value': 2.5, 'first': 1.5, 'last': 2.5},
+            'actual': {'value': 3, 'first': 1, 'last': 3, 'median': 2, 'mean': 2,
+                       'min': 1, 'max': 3, 'stdev': 1},
+        }
@@ -0,0 +1,112 @@
+#!pytest
+# -*- coding: utf-8 -*-
+"""Unit tests for the multiprocess sharding of meters."""
+import threading
+from configparser import ConfigParser
+from pathlib import Path
+
+import pytest
+
+from smlmqttprocessor.sharding import (RingSink, ShardedProcessor, main, pack_window, parse_meters, shard_of,
+                                       unpack_window)
+from smlmqttprocessor.utils.shmring import ShmRing
+from tests.helpers import sml_frames
+from tests.mqttbroker import MqttBrokerStandIn
+
+# do not complain about missing docstring for tests
+# pylint: disable=missing-function-docstring,  missing-class-docstring
+# pylint: disable=line-too-long, too-few-public-methods
+# noqa: D102
+
+TESTDATA = Path(__file__).parent.joinpath("testdata")
+FRAMES = sml_frames([100.5, 100.6], actuals=[170, 180])
+
+
+class TestRecords:
+
+    @staticmethod
+    def test_pack_unpack():
+        mqttdata = {'total': {'value': 100.6, 'd0': 2.5}, 'actual': {'first': 170, 'mean': 175.0}}
+        meter, timestamp, unpacked = unpack_window(pack_window(3, 1700000000.5, mqttdata))
+        assert (meter, timestamp, unpacked) == (3, 1700000000.5, mqttdata)
+        # types kept
+        assert isinstance(unpacked['actual']['first'], int)
+
+    @staticmethod
+    def test_ring_sink(caplog):
+        ring = ShmRing(64)
+        try:
+            sink = RingSink(ring, 1, lock=threading.Lock())
+            sink.write({'total': {'value': 1}}, 2.0)
+            sink.write({'total': {'value': 2}}, 3.0)  # full
+            assert unpack_window(ring.get()) == (1, 2.0, {'total': {'value': 1}})
+            assert ring.n_dropped == 1
+            assert "Ring full" in caplog.text
+        finally:
+            ring.close()
+
+
+class TestPartitioning:
+
+    @staticmethod
+    def test_shard_of():
+        shards = [shard_of('meter%d' % i, 4) for i in range(100)]
+        assert shards == [shard_of('meter%d' % i, 4) for i in range(100)]
+        assert set(shards) == {0, 1, 2, 3}
+
+    @staticmethod
+    def test_parse_meters():
+        assert parse_meters(['a=tcp:host:9000', '/dev/meter', 'b.2=unix:/tmp/x.sock']) == \
+            [('a', 'tcp:host:9000'), ('meter1', '/dev/meter'), ('b.2', 'unix:/tmp/x.sock')]
+        with pytest.raises(ValueError):
+            parse_meters(['a=foo', 'a=bar'])
+
+    @staticmethod
+    def test_shards():
+        meters = [('meter%d' % i, 'input%d' % i) for i in range(10)]
+        processor = ShardedProcessor(meters, ConfigParser(), 1, n_workers=3, no_mqtt=True)
+        shards = processor.shards()
+        assert len(shards) == 3
+        assert sorted(index for shard in shards for index, _, _ in shard) == list(range(10))
+        for worker, shard in enumerate(shards):
+            assert all(shard_of(name, 3) == worker for _, name, _ in shard)
+
+
+class TestShardedProcessor:
+
+    @staticmethod
+    def test_mqtt(tmp_path):
+        meters = []
+        for i in range(5):
+            path = tmp_path.joinpath("meter%d.txt" % i)
+            path.write_text(FRAMES)
+            meters.append(('m%d' % i, str(path)))
+        with MqttBrokerStandIn() as broker:
+            config = ConfigParser()
+            config.read_dict({'Mqtt': {'port': str(broker.port), 'qos': '1'}, 'Daily': {'in_process': 'true'}})
+            processor = ShardedProcessor(meters, config, 2, n_workers=2, timeout=1)
+            assert processor.run() == 0
+            assert len(processor.processes) == 2
+            # full window and the final flush at the timeout
+            assert processor.n_published == 2 * 5
+            topics = {publish.topic: publish.payload for publish in broker.received}
+        for name, _ in meters:
+            assert topics['tele/smartmeter/%s/total/value' % name] == b'100.6'
+            assert topics['tele/smartmeter/%s/total/d0' % name] == b'0.1'
+            assert topics['tele/smartmeter/%s/actual/first' % name] == b'170'
+
+    @staticmethod
+    def test_main(tmp_path, capsys):
+        configfile = tmp_path.joinpath("config.ini")
+        configfile.write_text("[DEFAULT]\nblock_size=5\n")
+        testdata = str(TESTDATA.joinpath("ISKRA_MT175_eHZ.txt"))
+        assert main(['--config', str(configfile), '--no-mqtt', '-t', '1', '-n', '2',
+                     'a=%s' % testdata, 'b=%s' % testdata]) == 0
+        stdout = capsys.readouterr().out
+        assert stdout.count('a:\n') == stdout.count('b:\n') == 2
+
+    @staticmethod
+    def test_main_failed_worker(tmp_path):
+        configfile = tmp_path.joinpath("config.ini")
+        configfile.write_text("")
+        assert main(['--config', str(configfile), '--no-mqtt', '-t', '1', str(tmp_path.joinpath("missing"))]) == 1
@@ -0,0 +1,251 @@
+#!pytest
+# -*- coding: utf-8 -*-
+"""Unit tests for the output sinks."""
+import csv
+import json
+import socket
+import threading
+from configparser import ConfigParser
+
+import pytest
+
+import smlmqttprocessor.sinks as sinks
+from smlmqttprocessor.daily import DailyCounters
+from smlmqttprocessor.sinks import (
+    CsvSink,
+    FanOut,
+    InfluxDbSink,
+    JsonlSink,
+    MqttSink,
+    PrometheusSink,
+    Sink,
+    SinkWorker,
+    StdoutSink,
+    create_sinks,
+)
+
+# do not complain about missing docstring for tests
+# pylint: disable=missing-function-docstring,  missing-class-docstring
+# pylint: disable=line-too-long, too-few-public-methods
+# noqa: D102
+
+MQTTDATA = {
+    'time': {'value': 333, 'first': 111, 'last': 333},
+    'actual': {'value': 99, 'first': -11, 'last': 99, 'median': 16.5,
+               'mean': 22, 'min': -22, 'max': 99, 'stdev': 43.3},
+}
+TIMESTAMP = 1700000000.5
+
+
+class RecordingSink(Sink):
+    name = 'recording'
+
+    def __init__(self, delay=None):
+        self.written = []
+        self.delay = delay
+        self.closed = False
+
+    def write(self, mqttdata, timestamp):
+        if self.delay:
+            self.delay.wait()
+        self.written.append((mqttdata, timestamp))
+
+    def close(self):
+        self.closed = True
+
+
+class TestSinks:
+
+    @staticmethod
+    def test_stdout(capsys):
+        StdoutSink().write({'time': {'value': 1}}, TIMESTAMP)
+        stdout, _ = capsys.readouterr()
+        assert stdout == "mqttdata:\n{'time': {'value': 1}}\n"
+
+    @staticmethod
+    def test_influxdb_format():
+        sink = InfluxDbSink("http://localhost:8086/write?db=test")
+        assert sink.format_lines(MQTTDATA, TIMESTAMP) == (
+            "smartmeter,field=time value=333.0,first=111.0,last=333.0 1700000000500000000\n"
+            "smartmeter,field=actual value=99.0,first=-11.0,last=99.0,median=16.5,"
+            "mean=22.0,min=-22.0,max=99.0,stdev=43.3 1700000000500000000\n")
+
+    @staticmethod
+    def test_influxdb_udp():
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as server:
+            server.bind(('127.0.0.1', 0))
+            server.settimeout(5)
+            sink = InfluxDbSink("udp://127.0.0.1:%d" % server.getsockname()[1], measurement='m')
+            sink.write(MQTTDATA, TIMESTAMP)
+            sink.close()
+            data = server.recv(65535).decode()
+        assert data.startswith("m,field=time value=333.0,")
+        assert data.count("\n") == 2
+
+    @staticmethod
+    def test_influxdb_invalid_url():
+        with pytest.raises(ValueError, match="Unsupported InfluxDB URL"):
+            InfluxDbSink("ftp://localhost")
+
+    @staticmethod
+    def test_csv(tmp_path):
+        path = tmp_path.joinpath("out.csv")
+        sink = CsvSink(path)
+        sink.write(MQTTDATA, TIMESTAMP)
+        sink.close()
+        # append, no second header
+        sink = CsvSink(path)
+        sink.write(MQTTDATA, TIMESTAMP)
+        sink.close()
+        with open(path, encoding="utf8") as fin:
+            rows = list(csv.reader(fin))
+        assert rows[0] == ['timestamp', 'field', 'value', 'first', 'last', 'median', 'mean', 'min', 'max', 'stdev']
+        assert rows[1] == ['1700000000.5', 'time', '333', '111', '333', '', '', '', '', '']
+        assert rows[2] == ['1700000000.5', 'actual', '99', '-11', '99', '16.5', '22', '-22', '99', '43.3']
+        assert len(rows) == 5
+
+    @staticmethod
+    def test_jsonl(tmp_path):
+        path = tmp_path.joinpath("out.jsonl")
+        sink = JsonlSink(path)
+        sink.write(MQTTDATA, TIMESTAMP)
+        sink.write(MQTTDATA, TIMESTAMP + 1)
+        sink.close()
+        lines = path.read_text(encoding="utf8").splitlines()
+        assert len(lines) == 2
+        assert json.loads(lines[1]) == {'timestamp': TIMESTAMP + 1, 'data': MQTTDATA}
+
+    @staticmethod
+    def test_prometheus(tmp_path):
+        path = tmp_path.joinpath("out.prom")
+        sink = PrometheusSink(str(path))
+        sink.write(MQTTDATA, TIMESTAMP)
+        text = path.read_text(encoding="utf8")
+        assert '# TYPE smartmeter_mean gauge\nsmartmeter_mean{field="actual"} 22.0\n' in text
+        assert 'smartmeter_value{field="time"} 333.0\nsmartmeter_value{field="actual"} 99.0\n' in text
+        assert text.endswith("smartmeter_timestamp_seconds 1700000000.5\n")
+        assert not tmp_path.joinpath("out.prom.tmp").exists()
+
+    @staticmethod
+    def test_mqtt():
+        class MockMyMqtt:
+            client = None
+
+            def __init__(self):
+                self.sent = []
+
+            def send_mqttdata(self, mqttdata, topic_prefix=None):
+                self.sent.append((mqttdata, topic_prefix))
+
+        mymqtt = MockMyMqtt()
+        MqttSink(mymqtt).write(MQTTDATA, TIMESTAMP)
+        MqttSink(mymqtt, topic_prefix='tele/meter1').write(MQTTDATA, TIMESTAMP)
+        assert mymqtt.sent == [(MQTTDATA, None), (MQTTDATA, 'tele/meter1')]
+
+
+class TestSinkWorker:
+
+    @staticmethod
+    def test_close_drains():
+        sink = RecordingSink()
+        worker = SinkWorker(sink)
+        for i in range(10):
+            worker.submit({'i': i}, TIMESTAMP)
+        worker.close()
+        assert [mqttdata['i'] for mqttdata, _ in sink.written] == list(range(10))
+        assert sink.closed
+
+    @staticmethod
+    def test_drop_oldest(caplog):
+        release = threading.Event()
+        sink = RecordingSink(delay=release)
+        worker = SinkWorker(sink, queue_size=2)
+        for i in range(6):
+            worker.submit({'i': i}, TIMESTAMP)
+        release.set()
+        worker.close()
+        # the first one was taken by the (blocked) sink, then only the newest 2 are kept
+        assert worker.n_dropped >= 3
+        assert [mqttdata['i'] for mqttdata, _ in sink.written][-2:] == [4, 5]
+        assert "Sink 'recording' too slow" in caplog.text
+
+    @staticmethod
+    def test_abstract():
+        class IncompleteSink(Sink):
+            name = 'incomplete'
+
+        with pytest.raises(TypeError, match="abstract method"):
+            IncompleteSink()
+
+    @staticmethod
+    def test_errors(caplog):
+        class FailingSink(Sink):
+            name = 'failing'
+
+            def write(self, mqttdata, timestamp):
+                raise OSError("boom")
+
+        worker = SinkWorker(FailingSink())
+        worker.submit(MQTTDATA, TIMESTAMP)
+        worker.close()
+        assert worker.n_errors == 1
+        assert "Sink 'failing' failed! OSError: boom" in caplog.text
+
+
+class TestFanOut:
+
+    @staticmethod
+    def test_slow_sink_does_not_stall():
+        release = threading.Event()
+        slow = RecordingSink(delay=release)
+        fast = RecordingSink()
+        fanout = FanOut([slow, fast])
+        fanout([{'total': 1, 'time': 11}, {'total': 2, 'time': 12}])
+        fanout([{'total': 3, 'time': 13}])
+        fanout.workers[1].queue.join()
+        assert [mqttdata['total']['value'] for mqttdata, _ in fast.written] == [2, 3]
+        assert not slow.written
+        release.set()
+        fanout.close()
+        assert len(slow.written) == 2
+
+    @staticmethod
+    def test_daily():
+        sink = RecordingSink()
+        fanout = FanOut([sink], daily=DailyCounters(('total', 'total_export')))
+        fanout([{'total': 1.5, 'time': 11}, {'total': 2.0, 'time': 12}])
+        fanout.close()
+        mqttdata, _ = sink.written[0]
+        assert mqttdata['total'] == {'value': 2.0, 'first': 1.5, 'last': 2.0, 'd0': 0.5}
+
+
+class TestCreateSinks:
+
+    @staticmethod
+    def test_default():
+        actual = create_sinks(ConfigParser())
+        assert [sink.name for sink in actual] == ['mqtt']
+
+    @staticmethod
+    def test_no_mqtt():
+        assert [sink.name for sink in create_sinks(ConfigParser(), no_mqtt=True)] == ['stdout']
+
+    @staticmethod
+    def test_all(tmp_path):
+        config = ConfigParser()
+        config.read_dict({'Sinks': {'sinks': 'mqtt, influxdb,csv,jsonl,prometheus',
+                                    'csv_file': str(tmp_path.joinpath('a.csv')),
+                                    'jsonl_file': str(tmp_path.joinpath('a.jsonl')),
+                                    'prometheus_file': str(tmp_path.joinpath('a.prom'))}})
+        actual = create_sinks(config, no_mqtt=True)
+        assert [type(sink) for sink in actual] == [StdoutSink, InfluxDbSink, CsvSink, JsonlSink, PrometheusSink]
+        for sink in actual:
+            sink.close()
+
+    @staticmethod
+    def test_unknown():
+        config = ConfigParser()
+        config.read_dict({'Sinks': {'sinks': 'foo'}})
+        with pytest.raises(ValueError, match="Unknown sink 'foo'"):
+            create_sinks(config)
+        assert 'mqtt' in sinks.SINK_NAMES
@@ -0,0 +1,78 @@
+#!pytest
+# -*- coding: utf-8 -*-
+"""Startup budget tests: lazy imports, import time and resident memory of smltextmqttprocessor.
+
+Each check runs in a fresh interpreter. The budgets are generous for a
+development machine (a Pi Zero is about 10x slower), they catch new eager
+imports of heavy modules, not small fluctuations.
+"""
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+# do not complain about missing docstring for tests
+# pylint: disable=missing-function-docstring,  missing-class-docstring
+# pylint: disable=line-too-long, too-few-public-methods
+# noqa: D102
+
+ROOT = Path(__file__).parent.parent
+MODULE = 'smlmqttprocessor.smltextmqttprocessor'
+# only imported when needed
+LAZY_MODULES = ('sml', 'pprint', 'colorlog', 'http.server', 'cProfile', 'tracemalloc')
+# seconds, cumulative import time of MODULE (python -X importtime)
+IMPORT_TIME_BUDGET = 0.5
+# KiB, max. resident memory added by importing MODULE
+RSS_BUDGET = 20 * 1024
+
+
+def _run_python(*args):
+    return subprocess.run([sys.executable, *args], cwd=ROOT, capture_output=True, text=True, check=True,
+                          timeout=60)
+
+
+def parse_importtime(stderr):
+    """Return module --> (self, cumulative) import time in seconds from `python -X importtime` output."""
+    times = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        times[name.strip()] = (int(self_us) / 1e6, int(cumulative_us) / 1e6)
+    return times
+
+
+class TestStartup:
+
+    @staticmethod
+    def test_parse_importtime():
+        stderr = ("import time: self [us] | cumulative | imported package\n"
+                  "import time:       289 |       9000 |   smlmqttprocessor.daily\n")
+        assert parse_importtime(stderr) == {'smlmqttprocessor.daily': (0.000289, 0.009)}
+
+    @staticmethod
+    def test_lazy_modules():
+        result = _run_python('-c', "import json, sys, %s; print(json.dumps(sorted(sys.modules)))" % MODULE)
+        modules = set(json.loads(result.stdout))
+        assert not modules.intersection(LAZY_MODULES)
+
+    @staticmethod
+    def test_import_time():
+        # warm up (bytecode cache)
+        _run_python('-c', "import %s" % MODULE)
+        times = parse_importtime(_run_python('-X', 'importtime', '-c', "import %s" % MODULE).stderr)
+        slowest = sorted(times.items(), key=lambda item: item[1][0], reverse=True)[:10]
+        assert times[MODULE][1] <= IMPORT_TIME_BUDGET, "slowest imports (self, cumulative): %s" % slowest
+
+    @staticmethod
+    def test_rss():
+        pytest.importorskip('resource')
+        script = ("import resource; before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss; import %s; "
+                  "print(before, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)" % MODULE)
+        before, after = map(int, _run_python('-c', script).stdout.split())
+        if sys.platform == 'darwin':
+            # bytes instead of KiB
+            before, after = before // 1024, after // 1024
+        assert after - before <= RSS_BUDGET
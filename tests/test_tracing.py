@@ -0,0 +1,133 @@
+#!pytest
+# -*- coding: utf-8 -*-
+"""Unit tests for the window latency tracing."""
+import io
+import time
+
+from smlmqttprocessor.instrumentation import ProcessorMetrics
+from smlmqttprocessor.sinks import FanOut, Sink
+from smlmqttprocessor.smltextmqttprocessor import processing_loop
+from smlmqttprocessor.tracing import Window, WindowTrace
+from tests.helpers import make_window, sml_frames
+
+# do not complain about missing docstring for tests
+# pylint: disable=missing-function-docstring,  missing-class-docstring
+# pylint: disable=line-too-long, too-few-public-methods
+# noqa: D102
+
+INPUT = sml_frames([100.5, 100.6, 100.7])
+
+
+def _trace():
+    trace = WindowTrace(first_read=10.0, last_read=25.0, metrics=ProcessorMetrics())
+    trace.aggregation_start = 25.1
+    trace.aggregation_end = 25.2
+    trace.handoff = 25.5
+    return trace
+
+
+class TestWindow:
+
+    @staticmethod
+    def test_list():
+        window = Window([{'total': 1}])
+        assert window == [{'total': 1}]
+        assert window.first_read is None and window.last_read is None
+
+    @staticmethod
+    def test_processing_loop():
+        windows = []
+        start = time.monotonic()
+        processing_loop(io.StringIO(INPUT), 2, windows.append, timeout=1)
+        assert windows[0] == [{'total': 100.5}, {'total': 100.6}]
+        assert start <= windows[0].first_read <= windows[0].last_read <= windows[1].first_read
+        # the last one ended by the timeout, its (empty) message after the last header is not timed
+        assert windows[1] == [{'total': 100.7}, {}]
+        assert windows[0].last_read == windows[1].first_read < windows[1].last_read
+
+
+class TestWindowTrace:
+
+    @staticmethod
+    def test_stages():
+        trace = _trace()
+        stages = trace.stages()
+        assert sorted(stages) == ['aggregate', 'queue', 'read']
+        assert stages['read'] == 15.0
+        assert round(stages['aggregate'], 3) == 0.2
+        assert round(stages['queue'], 3) == 0.3
+        assert trace.end_to_end() == {}
+
+    @staticmethod
+    def test_complete():
+        trace = _trace()
+        trace.published = 25.6
+        trace.acked = 26.0
+        trace.complete()
+        metrics = trace.metrics
+        # read and aggregate are recorded by FanOut
+        assert [metrics.stage_time[stage].count for stage in ('read', 'aggregate', 'queue', 'publish', 'ack')] \
+            == [0, 0, 1, 1, 1]
+        assert metrics.end_to_end['first'].sum == 16.0
+        assert metrics.end_to_end['last'].sum == 1.0
+
+    @staticmethod
+    def test_complete_without_metrics():
+        trace = WindowTrace(1.0, 2.0)
+        trace.acked = 3.0
+        trace.complete()
+        assert trace.end_to_end() == {'first': 2.0, 'last': 1.0}
+
+    @staticmethod
+    def test_to_payload():
+        now = time.monotonic()
+        trace = WindowTrace(now - 15, now - 1)
+        trace.aggregation_end = now
+        payload = trace.to_payload()
+        assert sorted(payload) == ['aggregated', 'first_read', 'last_read', 'sent']
+        assert abs(payload['aggregated'] - time.time()) < 1
+        assert round(payload['aggregated'] - payload['first_read']) == 15
+
+
+class TestFanOutTrace:
+
+    @staticmethod
+    def test_trace():
+        class TracedSink(Sink):
+            traces = []
+
+            def write(self, mqttdata, timestamp):
+                raise AssertionError("write_traced expected")
+
+            def write_traced(self, mqttdata, timestamp, trace):
+                self.traces.append(trace)
+
+        metrics = ProcessorMetrics()
+        sink = TracedSink()
+        fanout = FanOut([sink], metrics=metrics)
+        window = make_window({'total': 1, 'time': 11}, {'total': 2, 'time': 12},
+                             first_read=time.monotonic() - 2, last_read=time.monotonic() - 1)
+        fanout(window)
+        fanout.close()
+        trace, = sink.traces
+        assert trace.first_read == window.first_read
+        assert trace.aggregation_start <= trace.aggregation_end
+        assert metrics.stage_time['read'].count == metrics.stage_time['aggregate'].count == 1
+        assert round(metrics.stage_time['aggregate'].sum) == 1
+
+    @staticmethod
+    def test_disabled():
+        class PlainSink(Sink):
+            written = []
+
+            def write(self, mqttdata, timestamp):
+                self.written.append(mqttdata)
+
+            def write_traced(self, mqttdata, timestamp, trace):
+                raise AssertionError("write expected")
+
+        sink = PlainSink()
+        fanout = FanOut([sink])
+        fanout([{'total': 1, 'time': 11}])
+        fanout.close()
+        assert len(sink.written) == 1
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""Unit Tests."""
+import pytest
+
+from smlmqttprocessor.utils.metrics import Counter, Histogram, MetricsRegistry
+
+# do not complain about missing docstring for tests
+# pylint: disable=missing-function-docstring,  missing-class-docstring
+# noqa: D102
+
+
+class TestHistogram:
+
+    @staticmethod
+    def test_observe():
+        histogram = Histogram(buckets=(1, 5, 10))
+        for value in (0.5, 1, 3, 7, 100):
+            histogram.observe(value)
+        assert histogram.count == 5
+        assert histogram.sum == 111.5
+        assert histogram.counts == [2, 1, 1, 1]
+        assert histogram.cumulative() == [(1, 2), (5, 3), (10, 4), (float('inf'), 5)]
+
+    @staticmethod
+    def test_quantile():
+        histogram = Histogram(buckets=(1, 5, 10))
+        assert histogram.quantile(0.5) is None
+        for value in (0.5, 0.7, 3, 7):
+            histogram.observe(value)
+        assert histogram.quantile(0.5) == 1
+        assert histogram.quantile(0.75) == 5
+        assert histogram.quantile(1.0) == 10
+
+
+class TestMetricsRegistry:
+
+    @staticmethod
+    def test_render_prometheus():
+        registry = MetricsRegistry('test')
+        lines = registry.counter('lines_total', "Lines")
+        lines.inc()
+        lines.inc(2)
+        assert isinstance(lines, Counter)
+        registry.gauge('queue_length', "Queue", lambda: 7, labels={'sink': 'mqtt'})
+        histogram = registry.histogram('parse_seconds', "Parsing", buckets=(0.1, 1))
+        histogram.observe(0.5)
+        assert registry.render_prometheus() == (
+            '# HELP test_lines_total Lines\n'
+            '# TYPE test_lines_total counter\n'
+            'test_lines_total 3\n'
+            '# HELP test_queue_length Queue\n'
+            '# TYPE test_queue_length gauge\n'
+            'test_queue_length{sink="mqtt"} 7\n'
+            '# HELP test_parse_seconds Parsing\n'
+            '# TYPE test_parse_seconds histogram\n'
+            'test_parse_seconds_bucket{le="0.1"} 0\n'
+            'test_parse_seconds_bucket{le="1"} 1\n'
+            'test_parse_seconds_bucket{le="+Inf"} 1\n'
+            'test_parse_seconds_sum 0.5\n'
+            'test_parse_seconds_count 1\n')
+
+    @staticmethod
+    def test_snapshot():
+        registry = MetricsRegistry('test')
+        registry.counter('lines_total', "Lines").inc()
+        registry.histogram('write_seconds', "Writing", buckets=(0.1, 1), labels={'sink': 'csv'}).observe(0.05)
+        registry.histogram('write_seconds', "Writing", labels={'sink': 'mqtt'})
+        assert registry.snapshot() == {
+            'lines_total': 1,
+            'write_seconds/csv/count': 1, 'write_seconds/csv/sum': 0.05,
+            'write_seconds/csv/p50': 0.1, 'write_seconds/csv/p90': 0.1, 'write_seconds/csv/p99': 0.1,
+            'write_seconds/mqtt/count': 0, 'write_seconds/mqtt/sum': 0.0,
+            'write_seconds/mqtt/p50': None, 'write_seconds/mqtt/p90': None, 'write_seconds/mqtt/p99': None,
+        }
+
+    @staticmethod
+    def test_type_conflict():
+        registry = MetricsRegistry()
+        registry.counter('lines_total', "Lines")
+        with pytest.raises(ValueError):
+            registry.gauge('lines_total', "Lines")
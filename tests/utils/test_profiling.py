@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""Unit Tests."""
+import os
+import pstats
+import signal
+import tracemalloc
+from configparser import ConfigParser
+
+import pytest
+
+from smlmqttprocessor.utils.profiling import ProfilingHooks, install_profiling
+
+# do not complain about missing docstring for tests
+# pylint: disable=missing-function-docstring,  missing-class-docstring
+# noqa: D102
+
+
+def _busy():
+    return sum(i * i for i in range(1000))
+
+
+class TestProfilingHooks:
+
+    @staticmethod
+    def test_toggle_profile(tmp_path):
+        hooks = ProfilingHooks('test', tmp_path)
+        assert hooks.toggle_profile() is None
+        _busy()
+        filename = hooks.toggle_profile()
+        assert filename.parent == tmp_path
+        assert filename.name.startswith('profile-test-')
+        assert filename.suffix == '.pstats'
+        functions = [function for _, _, function in pstats.Stats(str(filename)).stats]
+        assert '_busy' in functions
+
+    @staticmethod
+    def test_dump_tracemalloc(tmp_path):
+        hooks = ProfilingHooks('test', tmp_path, top=5)
+        try:
+            assert hooks.dump_tracemalloc() is None
+            assert tracemalloc.is_tracing()
+            first = hooks.dump_tracemalloc()
+            assert first.name.startswith('tracemalloc-test-')
+            assert "top 5 allocations:" in first.read_text()
+            second = hooks.dump_tracemalloc()
+            assert "differences to the previous snapshot" in second.read_text()
+        finally:
+            hooks.close()
+        assert not tracemalloc.is_tracing()
+
+    @staticmethod
+    @pytest.mark.skipif(not hasattr(signal, 'SIGUSR1'), reason="no SIGUSR1")
+    def test_signals(tmp_path):
+        previous = signal.getsignal(signal.SIGUSR1), signal.getsignal(signal.SIGUSR2)
+        hooks = ProfilingHooks('test', tmp_path)
+        try:
+            assert hooks.install()
+            os.kill(os.getpid(), signal.SIGUSR1)
+            assert hooks.profile is not None
+            os.kill(os.getpid(), signal.SIGUSR1)
+            assert hooks.profile is None
+            assert len(list(tmp_path.glob('profile-test-*.pstats'))) == 1
+        finally:
+            hooks.close()
+            signal.signal(signal.SIGUSR1, previous[0])
+            signal.signal(signal.SIGUSR2, previous[1])
+
+
+class TestInstallProfiling:
+
+    @staticmethod
+    def test_disabled():
+        assert install_profiling(ConfigParser(), 'test') is None
+
+    @staticmethod
+    @pytest.mark.skipif(not hasattr(signal, 'SIGUSR1'), reason="no SIGUSR1")
+    def test_enabled(tmp_path):
+        previous = signal.getsignal(signal.SIGUSR1), signal.getsignal(signal.SIGUSR2)
+        config = ConfigParser()
+        config.read_dict({'Profiling': {'signals': 'true', 'directory': str(tmp_path), 'top': '10'}})
+        try:
+            hooks = install_profiling(config, 'test')
+            assert hooks.directory == tmp_path
+            assert hooks.top == 10
+            assert signal.getsignal(signal.SIGUSR1) not in previous
+        finally:
+            signal.signal(signal.SIGUSR1, previous[0])
+            signal.signal(signal.SIGUSR2, previous[1])
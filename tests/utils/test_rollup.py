@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""Unit Tests."""
+from datetime import date, datetime, timedelta, timezone
+
+import pytest
+
+from smlmqttprocessor.utils.rollup import bucket_bounds, CalendarClock, get_timezone
+
+# do not complain about missing docstring for tests
+# pylint: disable=missing-function-docstring,  missing-class-docstring
+# noqa: D102
+
+BERLIN = get_timezone('Europe/Berlin')
+
+
+def _timestamp(*args):
+    return datetime(*args, tzinfo=BERLIN).timestamp()
+
+
+class TestBucketBounds:
+
+    @staticmethod
+    @pytest.mark.parametrize("day, hours", [(date(2024, 3, 30), 24),
+                                            (date(2024, 3, 31), 23),   # CET -> CEST
+                                            (date(2024, 10, 27), 25)])  # CEST -> CET
+    def test_day_dst(day, hours):
+        start, end = bucket_bounds(_timestamp(day.year, day.month, day.day, 12), 'day', BERLIN)
+        assert start == datetime(day.year, day.month, day.day, tzinfo=BERLIN)
+        assert end - start.timestamp() == hours * 3600
+        assert end == _timestamp(day.year, day.month, day.day) + hours * 3600
+
+    @staticmethod
+    def test_units():
+        timestamp = _timestamp(2024, 2, 29, 13, 45, 10)
+        assert bucket_bounds(timestamp, 'hour', BERLIN) == (datetime(2024, 2, 29, 13, tzinfo=BERLIN),
+                                                            _timestamp(2024, 2, 29, 14))
+        assert bucket_bounds(timestamp, 'week', BERLIN) == (datetime(2024, 2, 26, tzinfo=BERLIN),
+                                                            _timestamp(2024, 3, 4))
+        assert bucket_bounds(timestamp, 'month', BERLIN) == (datetime(2024, 2, 1, tzinfo=BERLIN),
+                                                             _timestamp(2024, 3, 1))
+        assert bucket_bounds(timestamp, 'year', BERLIN) == (datetime(2024, 1, 1, tzinfo=BERLIN),
+                                                            _timestamp(2025, 1, 1))
+        # December, not the 13th month
+        assert bucket_bounds(_timestamp(2024, 12, 31, 23), 'month', BERLIN)[1] == _timestamp(2025, 1, 1)
+
+    @staticmethod
+    def test_utc():
+        start, end = bucket_bounds(datetime(2024, 3, 31, 23, 30, tzinfo=timezone.utc).timestamp(), 'day',
+                                   timezone.utc)
+        assert (start.day, end - start.timestamp()) == (31, 24 * 3600)
+
+    @staticmethod
+    def test_unknown_unit():
+        with pytest.raises(ValueError, match="Unknown unit 'minute'"):
+            bucket_bounds(0, 'minute')
+        with pytest.raises(ValueError):
+            CalendarClock('minute')
+
+
+class TestCalendarClock:
+
+    @staticmethod
+    def test_advance():
+        clock = CalendarClock('day', BERLIN, _timestamp(2024, 3, 30, 22))
+        assert clock.day == date(2024, 3, 30)
+        assert not clock.advance(_timestamp(2024, 3, 30, 23, 59, 59))
+        assert clock.advance(_timestamp(2024, 3, 31, 0, 0))
+        assert clock.day == date(2024, 3, 31)
+        assert clock.duration == 23 * 3600
+        # the system clock is set back: no rollback
+        assert not clock.advance(_timestamp(2024, 3, 30, 12))
+        assert clock.day == date(2024, 3, 31)
+        # gap of several days
+        assert clock.advance(_timestamp(2024, 4, 3, 1))
+        assert clock.day == date(2024, 4, 3)
+
+    @staticmethod
+    def test_hours_of_25h_day():
+        clock = CalendarClock('hour', BERLIN, _timestamp(2024, 10, 27, 0, 0))
+        timestamp = clock.start.timestamp()
+        starts = []
+        while timestamp < _timestamp(2024, 10, 28):
+            if clock.advance(timestamp) or not starts:
+                starts.append(clock.start)
+            timestamp += 60
+        assert len(starts) == 25
+        # the repeated hour 02:00..03:00 is a bucket of its own
+        assert [(start.hour, start.fold) for start in starts[2:4]] == [(2, 0), (2, 1)]
+        assert all(b.timestamp() - a.timestamp() == 3600 for a, b in zip(starts, starts[1:]))
+
+    @staticmethod
+    def test_local_time():
+        # system local time (naive datetimes)
+        clock = CalendarClock()
+        assert clock.day == datetime.now().date()
+        assert clock.start.tzinfo is None
+        assert clock.end == datetime.combine(clock.day + timedelta(days=1), datetime.min.time()).timestamp()
+
+    @staticmethod
+    def test_get_timezone():
+        assert get_timezone('') is None
+        assert str(get_timezone('Europe/Berlin')) == 'Europe/Berlin'
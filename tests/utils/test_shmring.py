@@ -0,0 +1,65 @@
+#!pytest
+# -*- coding: utf-8 -*-
+"""Unit tests for the shared-memory ring buffer."""
+import pytest
+
+from smlmqttprocessor.utils.shmring import ShmRing
+
+# do not complain about missing docstring for tests
+# pylint: disable=missing-function-docstring,  missing-class-docstring
+# noqa: D102
+
+
+@pytest.fixture(name='ring')
+def fixture_ring():
+    ring = ShmRing(64)
+    yield ring
+    ring.close()
+
+
+class TestShmRing:
+
+    @staticmethod
+    def test_fifo(ring):
+        assert ring.get() is None
+        assert ring.put(b"foo") and ring.put(b"") and ring.put(b"bar")
+        assert [ring.get(), ring.get(), ring.get(), ring.get()] == [b"foo", b"", b"bar", None]
+        assert len(ring) == 0
+
+    @staticmethod
+    def test_wrap_around(ring):
+        # sizes not dividing the capacity, i.e. wrap markers and remainders < 4 bytes
+        for i in range(200):
+            record = bytes([i % 256]) * (i % 23)
+            assert ring.put(record)
+            assert ring.get() == record
+        assert ring.get() is None
+        assert ring.n_dropped == 0
+
+    @staticmethod
+    def test_full(ring):
+        assert ring.put(b"x" * 30)
+        assert ring.put(b"y" * 26)
+        # 60 of 64 bytes used
+        assert not ring.put(b"z")
+        assert ring.n_dropped == 1
+        assert ring.get() == b"x" * 30
+        # needs a wrap, skipping the last 4 bytes
+        assert ring.put(b"z" * 20)
+        assert [ring.get(), ring.get(), ring.get()] == [b"y" * 26, b"z" * 20, None]
+
+    @staticmethod
+    def test_too_large(ring):
+        with pytest.raises(ValueError):
+            ring.put(b"x" * 61)
+
+    @staticmethod
+    def test_attach(ring):
+        consumer = ShmRing(name=ring.name)
+        try:
+            assert consumer.capacity == ring.capacity == 64
+            ring.put(b"foo")
+            assert consumer.get() == b"foo"
+            assert ring.get() is None
+        finally:
+            consumer.close()